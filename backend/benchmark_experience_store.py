@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Save and load times of the three topic files (`TopicExperiences` Biohacking,
+Pregnancy and Sleep) as legacy pretty-printed JSON against the columnar store
+of `website.experience_store`: a full load, a load projected to the action
+and outcomes columns, and reading one row of the memory-mapped embeddings.
+
+With --store-dir the legacy JSON files are copied from the ETL store into a
+temporary directory, the originals are not touched. Without it the topics are
+synthetic: `--size` experiences each, with `--dim` wide action and outcomes
+embeddings.
+
+    poetry run python benchmark_experience_store.py --size 30000 --dim 256
+    poetry run python benchmark_experience_store.py --store-dir /data/etl_store
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+# settings.py needs these at import time, the benchmark never talks to Azure
+for name in [
+    "AZURE_OPENAI_API_KEY",
+    "WEST_API_KEY",
+    "EASTUS2_API_KEY",
+    "API_KEY",
+    "AZURE_SEARCH_API_KEY",
+]:
+    os.environ.setdefault(name, "benchmark")
+os.environ.setdefault("AZURE_SEARCH_SERVICE_ENDPOINT", "https://benchmark.invalid")
+
+import numpy as np
+from rich import print
+from rich.table import Table
+
+from website import base
+from website.biohacks import TopicExperiences
+from website.experience_store import ExperienceStore
+from website.models import Experience
+
+topics = ["Biohacking", "Pregnancy", "Sleep"]
+
+
+def synthetic_topic(topic: str, *, size: int, dim: int, seed: int) -> TopicExperiences:
+    rng = np.random.default_rng(seed)
+    experiences = [
+        Experience(
+            permalink=f"/r/{topic}/comments/{i}/",
+            action=f"Took {rng.integers(50, 500)}mg magnesium glycinate before bed",
+            outcomes="Fell asleep in 10 minutes instead of an hour, fewer wake-ups",
+            health_disorder="insomnia",
+            takeaway="Magnesium glycinate may shorten sleep onset",
+            biohack_type="supplement",
+            biohack_topic="Magnesium",
+            action_score=int(rng.integers(0, 5)),
+            outcomes_score=int(rng.integers(0, 5)),
+        )
+        for i in range(size)
+    ]
+    return TopicExperiences(
+        title=topic,
+        subreddit=[],
+        experiences=experiences,
+        action_embeddings=rng.standard_normal((size, dim)).round(6).tolist(),
+        outcomes_embeddings=rng.standard_normal((size, dim)).round(6).tolist(),
+    )
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def size_mb(path: Path) -> float:
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file()) / 1e6
+    return path.stat().st_size / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store-dir", type=Path, default=None)
+    parser.add_argument("--size", type=int, default=10_000)
+    parser.add_argument("--dim", type=int, default=256)
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp())
+    base.ETL_STORE_DIR = work_dir
+    table = Table(title="TopicExperiences: legacy JSON vs columnar store (seconds)")
+    for column in [
+        "Topic",
+        "Rows",
+        "JSON MB",
+        "Store MB",
+        "JSON save",
+        "Store save",
+        "JSON load",
+        "Store load",
+        "Projected load",
+        "Embedding row",
+    ]:
+        table.add_column(column)
+    try:
+        for seed, topic in enumerate(topics):
+            legacy_path = work_dir / f"{topic}.TopicExperiences.json"
+            if args.store_dir is not None:
+                shutil.copy(args.store_dir / legacy_path.name, legacy_path)
+                model, _ = timed(lambda: TopicExperiences.load(name=topic, legacy=True))
+            else:
+                model = synthetic_topic(topic, size=args.size, dim=args.dim, seed=seed)
+
+            _, json_save = timed(
+                lambda: legacy_path.write_text(model.model_dump_json(indent=2))
+            )
+            _, json_load = timed(lambda: TopicExperiences.load(name=topic, legacy=True))
+            _, store_save = timed(model.save)
+            loaded, store_load = timed(lambda: TopicExperiences.load(name=topic))
+            assert loaded.experiences == model.experiences
+            _, projected_load = timed(
+                lambda: ExperienceStore(TopicExperiences.store_path(topic)).experiences(
+                    Experience, columns=["action", "outcomes"]
+                )
+            )
+            embeddings = ExperienceStore(
+                TopicExperiences.store_path(topic)
+            ).embeddings("action_embeddings")
+            embedding_row = "-"
+            if embeddings is not None:
+                _, seconds = timed(lambda: np.array(embeddings[-1]))
+                embedding_row = f"{seconds * 1000:.2f}ms"
+            table.add_row(
+                topic,
+                f"{len(model.experiences):,}",
+                f"{size_mb(legacy_path):.1f}",
+                f"{size_mb(TopicExperiences.store_path(topic)):.1f}",
+                f"{json_save:.2f}",
+                f"{store_save:.2f}",
+                f"{json_load:.2f}",
+                f"{store_load:.2f}",
+                f"{projected_load:.3f}",
+                embedding_row,
+            )
+    finally:
+        shutil.rmtree(work_dir)
+    print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Recall@k and query latency of the local IVF index (`website.local_index`)
+against exact brute-force NumPy kNN over the same memory-mapped matrix.
+
+Without --index-dir it builds an index over a synthetic corpus shaped like
+ours: `--size` unit vectors of text-embedding-3-large width, drawn around
+topic centers. Queries are perturbed corpus vectors, like a question close to
+the health disorders it should find.
+
+    poetry run python benchmark_local_index.py --size 30000 --queries 200 --k 100
+    poetry run python benchmark_local_index.py --index-dir /local_index
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from rich import print
+from rich.table import Table
+
+from website.local_index import LocalIndex, normalize
+
+
+def synthetic_corpus(*, size: int, dim: int, topics: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.standard_normal((topics, dim)))
+    vectors = np.empty((size, dim), dtype=np.float32)
+    for start in range(0, size, 4096):
+        n = min(4096, size - start)
+        topic = rng.integers(topics, size=n)
+        noise = rng.standard_normal((n, dim)).astype(np.float32) / np.sqrt(dim)
+        vectors[start : start + n] = centers[topic] + 0.8 * noise
+    return normalize(vectors)
+
+
+def make_queries(index: LocalIndex, *, queries: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed + 1)
+    rows = rng.choice(len(index), queries, replace=False)
+    dim = index.vectors.shape[1]
+    noise = rng.standard_normal((queries, dim)).astype(np.float32) / np.sqrt(dim)
+    return normalize(np.asarray(index.vectors[rows], dtype=np.float32) + 0.5 * noise)
+
+
+def measure(search, queries: np.ndarray, k: int) -> tuple[list[set], float]:
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        rows, _ = search(query, k)
+        latencies.append(time.perf_counter() - start)
+        results.append(set(rows.tolist()))
+    return results, float(np.median(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index-dir", type=Path, default=None)
+    parser.add_argument("--size", type=int, default=30_000)
+    parser.add_argument("--dim", type=int, default=3072)
+    parser.add_argument("--topics", type=int, default=500)
+    parser.add_argument("--dtype", choices=["float16", "float32"], default="float32")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=100)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32, 64])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index_dir = args.index_dir
+        if index_dir is None:
+            index_dir = Path(tmp_dir)
+            corpus = synthetic_corpus(
+                size=args.size, dim=args.dim, topics=args.topics, seed=args.seed
+            )
+            start = time.perf_counter()
+            LocalIndex.build(
+                index_dir,
+                vectors=corpus,
+                documents=[{"row": i} for i in range(len(corpus))],
+                dtype=args.dtype,
+                seed=args.seed,
+            )
+            print(f"Built in {time.perf_counter() - start:.1f} s")
+            del corpus
+
+        start = time.perf_counter()
+        index = LocalIndex(index_dir)
+        open_ms = (time.perf_counter() - start) * 1000
+        queries = make_queries(index, queries=args.queries, seed=args.seed)
+        # fault the pages in so both sides are measured warm
+        measure(index.brute_force, queries[:5], args.k)
+
+        exact, exact_latency = measure(index.brute_force, queries, args.k)
+        table = Table(
+            title=(
+                f"{len(index):,} x {index.vectors.shape[1]} {index.meta['dtype']}, "
+                f"nlist {index.meta['nlist']}, recall@{args.k}, "
+                f"opened in {open_ms:.1f} ms"
+            )
+        )
+        table.add_column("Search")
+        table.add_column(f"Recall@{args.k}")
+        table.add_column("p50 latency (ms)")
+        table.add_column("Speedup")
+        table.add_row("brute force", "1.000", f"{exact_latency * 1000:.2f}", "1.0x")
+        for nprobe in args.nprobe:
+            found, latency = measure(
+                lambda query, k: index.search(query, k, nprobe=nprobe),
+                queries,
+                args.k,
+            )
+            recall = np.mean([len(f & e) / len(e) for f, e in zip(found, exact)])
+            table.add_row(
+                f"IVF nprobe={nprobe}",
+                f"{recall:.3f}",
+                f"{latency * 1000:.2f}",
+                f"{exact_latency / latency:.1f}x",
+            )
+        print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Throughput, latency and top-k agreement of the int8 ONNX models
+(`website.onnx_models`) against the fp32 PyTorch sentence-transformers models
+they were exported from.
+
+Each request is one question against `--passages` passages, like a search
+reranking its biohacks. Agreement is the share of the PyTorch top `--k`
+passages the ONNX model also ranks in its top `--k`, averaged over questions.
+For the embedding model, each request embeds all the passages, agreement is
+over the cosine neighbours of the first `--questions` passages, and the mean
+cosine between the two models' vectors is reported too.
+
+Passages come from the experiences of a local index (`--index-dir`), or are
+synthetic.
+
+    poetry run python -m website.onnx_models cross-encoder \
+        cross-encoder/ms-marco-MiniLM-L-12-v2 models/ms-marco-MiniLM-L-12-v2
+    poetry run python benchmark_onnx.py cross-encoder \
+        cross-encoder/ms-marco-MiniLM-L-12-v2 models/ms-marco-MiniLM-L-12-v2
+    poetry run python benchmark_onnx.py embedding \
+        sentence-transformers/all-MiniLM-L6-v2 models/all-MiniLM-L6-v2
+"""
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+# settings.py needs these at import time, the benchmark never talks to Azure
+for name in [
+    "AZURE_OPENAI_API_KEY",
+    "WEST_API_KEY",
+    "EASTUS2_API_KEY",
+    "API_KEY",
+    "AZURE_SEARCH_API_KEY",
+]:
+    os.environ.setdefault(name, "benchmark")
+os.environ.setdefault("AZURE_SEARCH_SERVICE_ENDPOINT", "https://benchmark.invalid")
+
+import numpy as np
+from rich import print
+from rich.table import Table
+
+from website.local_index import LocalIndex, normalize
+from website.onnx_models import OnnxCrossEncoder, OnnxSentenceEncoder
+from website.questions import curated_questions
+
+actions = [
+    "Took 65mg iron bisglycinate every other day",
+    "Magnesium glycinate 400mg before bed",
+    "Cold showers every morning for a month",
+    "Cut out gluten and dairy",
+    "Walked 10k steps a day after dinner",
+    "Started a low-dose SSRI",
+    "Used a CPAP machine every night",
+    "Creatine 5g with breakfast",
+]
+outcomes = [
+    "ferritin went from 12 to 45 in three months",
+    "falling asleep in 10 minutes instead of an hour",
+    "less afternoon fatigue and better focus",
+    "bloating gone after two weeks",
+    "fasting glucose down from 105 to 92",
+    "fewer panic attacks, some nausea at first",
+]
+
+
+def passages(index_dir: Path, size: int, seed: int = 0) -> list[str]:
+    rng = np.random.default_rng(seed)
+    if index_dir is not None:
+        index = LocalIndex(index_dir)
+        rows = rng.choice(len(index), min(size, len(index)), replace=False)
+        documents = [index.document(row) for row in rows.tolist()]
+        return [f"{d['action']}. {d['outcomes']}" for d in documents]
+    return [
+        f"{rng.choice(actions)}: {rng.choice(outcomes)} ({i})" for i in range(size)
+    ]
+
+
+def agreement(reference: np.ndarray, candidate: np.ndarray, k: int) -> float:
+    """
+    Mean overlap of the top `k` columns of each row.
+    """
+    overlaps = []
+    for expected, got in zip(reference, candidate):
+        top_expected = set(np.argsort(-expected)[:k].tolist())
+        top_got = set(np.argsort(-got)[:k].tolist())
+        overlaps.append(len(top_expected & top_got) / k)
+    return float(np.mean(overlaps))
+
+
+def timed(fn, requests: list) -> tuple[np.ndarray, list[float]]:
+    results = []
+    latencies = []
+    for request in requests:
+        start = time.perf_counter()
+        results.append(fn(request))
+        latencies.append(time.perf_counter() - start)
+    return np.array(results), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("kind", choices=["cross-encoder", "embedding"])
+    parser.add_argument("model_name")
+    parser.add_argument("onnx_dir", type=Path)
+    parser.add_argument("--index-dir", type=Path, default=None)
+    parser.add_argument("--passages", type=int, default=100)
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--pool-size", type=int, default=2)
+    args = parser.parse_args()
+
+    texts = passages(args.index_dir, args.passages)
+    questions = curated_questions[: args.questions]
+    runtimes = {}
+    if args.kind == "cross-encoder":
+        from sentence_transformers.cross_encoder import CrossEncoder
+
+        models = {
+            "pytorch fp32": CrossEncoder(args.model_name, device="cpu"),
+            "onnx fp32": OnnxCrossEncoder(
+                args.onnx_dir, quantized=False, pool_size=args.pool_size
+            ),
+            "onnx int8": OnnxCrossEncoder(args.onnx_dir, pool_size=args.pool_size),
+        }
+        for name, model in models.items():
+            runtimes[name] = timed(
+                lambda question: model.predict(
+                    [(question, text) for text in texts], batch_size=args.batch_size
+                ),
+                questions,
+            )
+    else:
+        from sentence_transformers import SentenceTransformer
+
+        models = {
+            "pytorch fp32": SentenceTransformer(args.model_name, device="cpu"),
+            "onnx fp32": OnnxSentenceEncoder(
+                args.onnx_dir, quantized=False, pool_size=args.pool_size
+            ),
+            "onnx int8": OnnxSentenceEncoder(args.onnx_dir, pool_size=args.pool_size),
+        }
+        for name, model in models.items():
+            runtimes[name] = timed(
+                lambda batch: model.encode(
+                    batch, batch_size=args.batch_size, normalize_embeddings=True
+                ),
+                [texts] * len(questions),
+            )
+
+    baseline_results, _ = runtimes["pytorch fp32"]
+    table = Table(title=f"{args.kind} {args.model_name}, {len(texts)} per request")
+    table.add_column("Runtime")
+    table.add_column("Per second")
+    table.add_column("p50 (ms)")
+    table.add_column("p95 (ms)")
+    table.add_column(f"Top {args.k} agreement")
+    if args.kind == "embedding":
+        table.add_column("Mean cosine")
+    for name, (results, latencies) in runtimes.items():
+        if args.kind == "cross-encoder":
+            scores, baseline_scores = results, baseline_results
+        else:
+            # neighbours of the first passages among all of them
+            scores = results[0][: args.questions] @ results[0].T
+            baseline = baseline_results[0]
+            baseline_scores = baseline[: args.questions] @ baseline.T
+        row = [
+            name,
+            f"{len(texts) * len(latencies) / sum(latencies):,.0f}",
+            f"{np.percentile(latencies, 50) * 1000:.1f}",
+            f"{np.percentile(latencies, 95) * 1000:.1f}",
+            f"{agreement(baseline_scores, scores, args.k):.3f}",
+        ]
+        if args.kind == "embedding":
+            cosines = (normalize(results[0]) * normalize(baseline_results[0])).sum(1)
+            row.append(f"{cosines.mean():.4f}")
+        table.add_row(*row)
+    print(table)
+
+
+if __name__ == "__main__":
+    main()
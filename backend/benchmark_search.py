@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Requests per second of one worker for the /search retrieval step, before
+(blocking `run_search_query`) and after (`arun_search_query`).
+
+A local mock HTTP server stands in for the Azure OpenAI embeddings endpoint
+and the Azure Search index. Both answer after a fixed latency, so the numbers
+only measure how well one event loop overlaps the round-trips.
+
+    poetry run python benchmark_search.py --requests 100 --concurrency 20 --latency 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# settings.py needs these at import time, the benchmark never talks to Azure
+for name in [
+    "AZURE_OPENAI_API_KEY",
+    "WEST_API_KEY",
+    "EASTUS2_API_KEY",
+    "API_KEY",
+    "AZURE_SEARCH_API_KEY",
+]:
+    os.environ.setdefault(name, "benchmark")
+os.environ.setdefault("AZURE_SEARCH_SERVICE_ENDPOINT", "https://benchmark.invalid")
+
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
+from langchain_openai import AzureOpenAIEmbeddings
+from rich import print
+from rich.table import Table
+
+from website import search
+from website.embedding_cache import EmbeddingCache
+from website.settings import console, index_name
+
+HIT = {
+    "@search.score": 1.0,
+    "permalink": "/r/BabyBumps/comments/abc123/iron/",
+    "action": "Took an iron supplement with vitamin C",
+    "outcomes": "Ferritin went from 9 to 40 in three months",
+    "health_disorder": "Iron deficiency anemia",
+    "takeaway": "Vitamin C helps iron absorption",
+    "biohack_type": "supplements",
+    "biohack_topic": "Iron supplementation",
+    "action_score": 3,
+    "outcomes_score": 3,
+}
+
+
+class MockAzureHandler(BaseHTTPRequestHandler):
+    latency = 0.1
+    limit = 100
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency)
+        if "/embeddings" in self.path:
+            body = {
+                "object": "list",
+                "model": "text-embedding-3-large",
+                "data": [
+                    {"object": "embedding", "index": 0, "embedding": [0.0] * 3072}
+                ],
+                "usage": {"prompt_tokens": 5, "total_tokens": 5},
+            }
+        elif "/docs/search" in self.path:
+            body = {"value": [HIT] * self.limit}
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+async def before(*, requests: int, client, limit: int) -> float:
+    async def request():
+        # what the endpoint used to do: a sync call inside `async def search`
+        search.run_search_query(
+            question="Iron and pregnancy", client=client, limit=limit
+        )
+
+    start = time.perf_counter()
+    await asyncio.gather(*[request() for _ in range(requests)])
+    return requests / (time.perf_counter() - start)
+
+
+async def after(*, requests: int, concurrency: int, client, limit: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def request():
+        async with semaphore:
+            await search.arun_search_query(
+                question="Iron and pregnancy", client=client, limit=limit
+            )
+
+    start = time.perf_counter()
+    await asyncio.gather(*[request() for _ in range(requests)])
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    MockAzureHandler.latency = args.latency
+    MockAzureHandler.limit = args.limit
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockAzureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    mock_url = f"http://127.0.0.1:{server.server_port}"
+
+    console.quiet = True
+    # no embedding cache, every request pays for the embedding round-trip
+    search.embedding_cache = EmbeddingCache(
+        embeddings=AzureOpenAIEmbeddings(
+            azure_deployment="text-embedding-3-large",
+            openai_api_version="2024-02-01",  # pyright: ignore
+            azure_endpoint=mock_url,
+            api_key="benchmark",
+            check_embedding_ctx_length=False,
+        ),
+        max_entries=0,
+    )
+    credential = AzureKeyCredential("benchmark")
+    sync_client = SearchClient(mock_url, index_name, credential)
+
+    async def run():
+        async_client = AsyncSearchClient(mock_url, index_name, credential)
+        # warm up both connection pools
+        await after(requests=1, concurrency=1, client=async_client, limit=args.limit)
+        await before(requests=1, client=sync_client, limit=args.limit)
+        rps_before = await before(
+            requests=args.requests, client=sync_client, limit=args.limit
+        )
+        rps_after = await after(
+            requests=args.requests,
+            concurrency=args.concurrency,
+            client=async_client,
+            limit=args.limit,
+        )
+        await async_client.close()
+        return rps_before, rps_after
+
+    rps_before, rps_after = asyncio.run(run())
+    server.shutdown()
+
+    table = Table(
+        title=f"/search retrieval, {args.latency * 1000:.0f} ms per upstream call"
+    )
+    table.add_column("Path")
+    table.add_column("Requests/sec/worker")
+    table.add_row("run_search_query (blocking)", f"{rps_before:.1f}")
+    table.add_row("arun_search_query (async)", f"{rps_after:.1f}")
+    table.add_row("Speedup", f"{rps_after / rps_before:.1f}x")
+    print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+CPU time and peak allocations of turning search hits into the taxonomy,
+before (an `Experience` per hit, `clean()` per step, dicts of lists) and after
+(`website.columns`: arrays per field, `np.unique` grouping, slotted
+`HitRecord`s built once at the end), and of serializing the taxonomy to JSON
+for the cache.
+
+The hits are synthetic, shaped like Azure Search hits: ~8 biohack types,
+~hits/4 biohack topics, a few duplicated (action, outcomes) pairs.
+
+    poetry run python benchmark_taxonomy.py --sizes 100 1000 10000
+"""
+
+import argparse
+import os
+import time
+import tracemalloc
+from collections import defaultdict
+
+# settings.py needs these at import time, the benchmark never talks to Azure
+for name in [
+    "AZURE_OPENAI_API_KEY",
+    "WEST_API_KEY",
+    "EASTUS2_API_KEY",
+    "API_KEY",
+    "AZURE_SEARCH_API_KEY",
+]:
+    os.environ.setdefault(name, "benchmark")
+os.environ.setdefault("AZURE_SEARCH_SERVICE_ENDPOINT", "https://benchmark.invalid")
+
+import numpy as np
+from rich import print
+from rich.table import Table
+
+from website import search
+from website.models import (BiohackTypeGroup, DynamicBiohack,
+                            DynamicBiohackingTaxonomy)
+
+biohack_types = [
+    "diet",
+    "supplement",
+    "exercise",
+    "sleep habit",
+    "device",
+    "prescription drug",
+    "mindfulness",
+    "other",
+]
+
+
+def make_hits(size: int, seed: int = 0) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    topics = max(size // 4, 1)
+    hits = []
+    for i in range(size):
+        topic = int(rng.integers(topics))
+        # every 20th hit repeats an earlier (action, outcomes)
+        source = i - 1 if i % 20 == 19 else i
+        hits.append(
+            {
+                "@search.score": float(rng.random()),
+                "id": str(i),
+                "permalink": (
+                    f"10.1000/study.{i}" if i % 7 == 0 else f"/r/Biohackers/{i}/"
+                ),
+                "action": f"Took supplement {source} every morning",
+                "outcomes": f"Energy improved after {source} weeks",
+                "health_disorder": "Fatigue",
+                "mechanism": "Raises ferritin",
+                "personal_context": "Vegetarian, 30s",
+                "takeaway": "Worth a try",
+                "rationale": "Consistent effect",
+                "biohack_type": biohack_types[topic % len(biohack_types)],
+                "biohack_topic": f"topic {topic}",
+                "action_score": int(rng.integers(1, 4)),
+                "outcomes_score": int(rng.integers(1, 4)),
+                "health_disorderVector": None,
+            }
+        )
+    return hits
+
+
+def legacy(hits: list[dict]) -> DynamicBiohackingTaxonomy:
+    # search.py before the columnar path, deduped the same way
+    experiences = search.dedupe_experiences(search.hits_to_experiences(hits))
+    d = defaultdict(list)
+    for experience in experiences:
+        experience = search.clean(experience)
+        d[experience.biohack_topic].append(experience)
+    biohacks = [DynamicBiohack(biohack_topic=k, experiences=v) for k, v in d.items()]
+    biohack_type2biohack = defaultdict(list)
+    all_experiences = []
+    for biohack in biohacks:
+        biohack_type2biohack[biohack.biohack_type].append(biohack)
+        all_experiences.extend(biohack.experiences)
+    return DynamicBiohackingTaxonomy(
+        biohack_types=[
+            BiohackTypeGroup(biohack_type=biohack_type, biohacks=biohacks)
+            for biohack_type, biohacks in biohack_type2biohack.items()
+        ],
+        count_experiences=len(all_experiences),
+        count_reddits=sum(1 for e in all_experiences if e.source_type == "reddit"),
+        count_studies=sum(1 for e in all_experiences if e.source_type == "study"),
+    )
+
+
+def columnar(hits: list[dict]) -> DynamicBiohackingTaxonomy:
+    return search.enriched_biohacks_to_taxonomy(search.hits_to_biohacks(hits))
+
+
+def outline(taxonomy: DynamicBiohackingTaxonomy) -> list:
+    # same groups, topics and experiences, whatever the experience type
+    return [
+        (
+            group.biohack_type,
+            [
+                (biohack.biohack_topic, [e.permalink for e in biohack.experiences])
+                for biohack in group.biohacks
+            ],
+        )
+        for group in taxonomy.biohack_types
+    ] + [taxonomy.count_experiences, taxonomy.count_reddits, taxonomy.count_studies]
+
+
+def measure(fn, hits, repeat: int) -> tuple[float, int]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(hits)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn(hits)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    table = Table(title="search hits -> DynamicBiohackingTaxonomy")
+    table.add_column("Hits")
+    table.add_column("Before (ms)")
+    table.add_column("After (ms)")
+    table.add_column("Speedup")
+    table.add_column("Before peak (KiB)")
+    table.add_column("After peak (KiB)")
+    table.add_column("Before JSON (ms)")
+    table.add_column("After JSON (ms)")
+    for size in args.sizes:
+        hits = make_hits(size)
+        before = legacy(hits)
+        after = columnar(hits)
+        assert outline(before) == outline(after), "outputs differ"
+        before_time, before_peak = measure(legacy, hits, args.repeat)
+        after_time, after_peak = measure(columnar, hits, args.repeat)
+        dump = DynamicBiohackingTaxonomy.model_dump_json
+        before_json, _ = measure(dump, before, args.repeat)
+        after_json, _ = measure(dump, after, args.repeat)
+        table.add_row(
+            f"{size:,}",
+            f"{before_time * 1000:.1f}",
+            f"{after_time * 1000:.1f}",
+            f"{before_time / after_time:.1f}x",
+            f"{before_peak / 1024:,.0f}",
+            f"{after_peak / 1024:,.0f}",
+            f"{before_json * 1000:.1f}",
+            f"{after_json * 1000:.1f}",
+        )
+    print(table)
+
+
+if __name__ == "__main__":
+    main()
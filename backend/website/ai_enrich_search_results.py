@@ -22,6 +22,7 @@ install(show_locals=True)
 # install()
 
 from website.chain import Chain, endpoints
+from website.dedupe import dedupe_experiences
 from website.experiences import Experience
 from website.models import (AISummary, BiohackTypeGroup, DynamicBiohack,
                             DynamicBiohackingTaxonomy)
@@ -47,15 +48,7 @@ async def enrich_search_results_chain(
     start: int = 0,
     size: Optional[int] = None,
 ) -> DynamicBiohackingTaxonomy:
-    # deduplicate experiences
-    existing = set()
-    deduplicated = []
-    for experience in experiences:
-        action_outcome = f"{experience.action} {experience.outcomes}"
-        if action_outcome not in existing:
-            deduplicated.append(experience)
-            existing.add(action_outcome)
-    experiences = deduplicated
+    experiences = dedupe_experiences(experiences)
 
     question = question.strip()
 
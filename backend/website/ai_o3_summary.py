@@ -4,7 +4,7 @@ import asyncio
 import os
 import time
 from collections import defaultdict
-from typing import Any, Iterable, Literal, Optional
+from typing import Any, AsyncIterator, Iterable, Literal, Optional
 
 import instructor
 import logfire
@@ -21,11 +21,13 @@ from rich.traceback import install
 install(show_locals=True)
 # install()
 
+from website import llm_clients
 from website.chain import Chain, endpoints
 from website.experiences import Experience
 from website.models import (AISummary, BiohackTypeGroup, DynamicBiohack,
                             DynamicBiohackingTaxonomy)
-from website.settings import azure_search_client, console
+from website.settings import (azure_search_client, console,
+                              summary_timeout)
 
 load_dotenv()
 azure_openai_api_key = os.environ["AZURE_OPENAI_API_KEY"]
@@ -387,7 +389,7 @@ async def mechanism_task(
         return error_msg
 
 
-async def new_ai_summary(*, taxonomy: DynamicBiohackingTaxonomy, question: str):
+def make_summary_client():
     llm_name = "gpt-4o"
     llm_name = "o3-mini"
     if llm_name == "gpt-4o":
@@ -402,15 +404,20 @@ async def new_ai_summary(*, taxonomy: DynamicBiohackingTaxonomy, question: str):
     else:
         raise ValueError(f"Unknown LLM name: {llm_name}")
 
-    openai = AsyncAzureOpenAI(
-        max_retries=0,
+    llm_client = llm_clients.get_client(
+        endpoint=endpoint,
+        deployment=llm_name,
         api_version=api_version,
-        azure_endpoint=endpoint,
-        azure_deployment=llm_name,
         api_key=api_key,
+        timeout=summary_timeout,
+        max_retries=0,
+        instrument=True,
     )
-    logfire.instrument_openai(openai)
-    llm_client = instructor.patch(openai)
+    return llm_name, llm_client
+
+
+async def new_ai_summary(*, taxonomy: DynamicBiohackingTaxonomy, question: str):
+    llm_name, llm_client = make_summary_client()
     responses = []
     tasks = []
     tasks.append(
@@ -454,3 +461,41 @@ async def new_ai_summary(*, taxonomy: DynamicBiohackingTaxonomy, question: str):
         mechanisms=[],
     )
     return ai_summary
+
+
+summary_tasks = {
+    "balance": balance_task,
+    "skeptical": skeptical_task,
+    "curious": curious_task,
+}
+
+
+async def stream_ai_summary(
+    *, taxonomy: DynamicBiohackingTaxonomy, question: str
+) -> AsyncIterator[tuple[str, list[str]]]:
+    """
+    Yields `(section, items)` for each AISummary section as soon as its task
+    finishes, instead of waiting on all of them like `new_ai_summary`.
+    A failed task yields an empty section.
+    """
+    llm_name, llm_client = make_summary_client()
+
+    async def run(section: str, task) -> tuple[str, list[str]]:
+        response = await task(
+            llm_name=llm_name,
+            llm_client=llm_client,
+            taxonomy=taxonomy,
+            question=question,
+        )
+        return section, getattr(response, section, [])
+
+    tasks = [
+        asyncio.create_task(run(section, task))
+        for section, task in summary_tasks.items()
+    ]
+    try:
+        for next_section in asyncio.as_completed(tasks):
+            yield await next_section
+    finally:
+        for task in tasks:
+            task.cancel()
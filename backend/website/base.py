@@ -4,10 +4,12 @@ import gzip
 import json
 from abc import ABCMeta
 from pathlib import Path
-from typing import Any, Optional, Union
+from typing import Any, Optional, Sequence, Union
 
 from loguru import logger
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
+from website.experience_store import (ExperienceStore, Journal, row_field,
+                                      save_store)
 from website.settings import ETL_STORE_DIR, console
 
 
@@ -30,6 +32,8 @@ class SubredditAttributes(BaseModel):
 class Base(BaseModel, metaclass=ABCMeta):
     title: Optional[str] = None
     subreddit: Optional[Union[SubredditAttributes, list[SubredditAttributes]]] = None
+    # the `columns` of a projected `load`, which can't be saved
+    _projection: Optional[list[str]] = PrivateAttr(default=None)
 
     class Config:
         use_enum_values = True
@@ -44,24 +48,59 @@ class Base(BaseModel, metaclass=ABCMeta):
         files = []
         # get all the files in the store directory
         for path in Path(ETL_STORE_DIR).iterdir():
-            if f"{cls.__name__}.json" in path.name:
+            if path.name.endswith((f".{cls.__name__}.json", f".{cls.__name__}.store")):
                 files.append(path.stem.split(".")[0])
-        return files
+        return sorted(set(files))
 
     @classmethod
-    def load(cls, *, name: str) -> Any:
+    def store_path(cls, name: str) -> Path:
+        return Path(ETL_STORE_DIR) / f"{name}.{cls.__name__}.store"
+
+    @classmethod
+    def load(
+        cls,
+        *,
+        name: str,
+        columns: Optional[Sequence[str]] = None,
+        legacy: bool = False,
+    ) -> Any:
+        """
+        `columns` projects the experiences to those fields, see
+        `website.experience_store`. `legacy` reads the old whole-file JSON
+        even when a store exists.
+        """
         # name must be the subreddit name or the topic/title name
-        source_path = Path(ETL_STORE_DIR) / f"{name}.{cls.__name__}.json"
-        print(source_path)
-        with open(source_path, "r") as f:
-            data = json.load(f)
-        console.print(f"Loaded {cls.__name__} from {source_path}", style="info")
-        return cls(**data)
+        store_path = cls.store_path(name)
+        if not legacy and store_path.is_dir():
+            instance = ExperienceStore(store_path).load(cls, columns=columns)
+            console.print(f"Loaded {cls.__name__} from {store_path}", style="info")
+        else:
+            source_path = Path(ETL_STORE_DIR) / f"{name}.{cls.__name__}.json"
+            print(source_path)
+            with open(source_path, "r") as f:
+                data = json.load(f)
+            console.print(f"Loaded {cls.__name__} from {source_path}", style="info")
+            instance = cls(**data)
+        if row_field in cls.model_fields:
+            # updates of a run that didn't get to save
+            Journal(cls.journal_path(name)).replay(getattr(instance, row_field))
+        return instance
+
+    @classmethod
+    def journal_path(cls, name: str) -> Path:
+        return Path(ETL_STORE_DIR) / f"{name}.{cls.__name__}.journal.jsonl"
+
+    def journal(self) -> Journal:
+        """
+        Where long runs log their updates between saves, see
+        `website.experience_store.Journal`.
+        """
+        return Journal(self.journal_path(self.stored_name()))
 
     def name(self) -> str:
         raise NotImplementedError
 
-    def save(self) -> None:
+    def stored_name(self) -> str:
         non_subreddit_classes = [
             "Topic",
             "StudyExperiences",
@@ -75,17 +114,27 @@ class Base(BaseModel, metaclass=ABCMeta):
                 raise ValueError(
                     f"Title is required for {self.__class__.__name__} to save"
                 )
-            name = self.title
-        else:
-            try:
-                name = self.subreddit.display_name
-            except AttributeError:
-                logger.warning(
-                    f"Check if you need to add this class name to the non_subreddit_classes list: {self.__class__.__name__}"
-                )
-                raise Exception(
-                    f"Cant save {self.__class__.__name__}. Add it to the non_subreddit_classes list in base.py"
-                )
+            return self.title
+        try:
+            return self.subreddit.display_name
+        except AttributeError:
+            logger.warning(
+                f"Check if you need to add this class name to the non_subreddit_classes list: {self.__class__.__name__}"
+            )
+            raise Exception(
+                f"Cant save {self.__class__.__name__}. Add it to the non_subreddit_classes list in base.py"
+            )
+
+    def save(self) -> None:
+        name = self.stored_name()
+        if row_field in type(self).model_fields:
+            # experiences go to the columnar store, see website/experience_store.py
+            sink_path = self.store_path(name)
+            save_store(self, sink_path)
+            # the store now has every journaled update
+            self.journal().clear()
+            console.print(f"Saved to {sink_path}", style="info")
+            return
 
         sink_path = Path(ETL_STORE_DIR) / f"{name}.{self.__class__.__name__}.json"
         with open(sink_path, "w") as f:
@@ -43,14 +43,16 @@ def get_docs_file_path(
     biohack_type: BiohackTypeEnum,
 ):
     file_path = (
-        ETL_STORE_DIR / "biohack_topics" / f"{biohack_type.value}_unique_docs.json"
+        Path(ETL_STORE_DIR)
+        / "biohack_topics"
+        / f"{biohack_type.value}_unique_docs.json"
     )
     return file_path
 
 
 def get_cluster_file_path(*, biohack_type: BiohackTypeEnum):
     # Create output directory
-    output_dir = ETL_STORE_DIR / "biohack_clusters"
+    output_dir = Path(ETL_STORE_DIR) / "biohack_clusters"
     output_dir.mkdir(parents=True, exist_ok=True)
     sink_file = output_dir / f"{biohack_type.value}_topic_docs.json"
     return sink_file
@@ -61,7 +63,16 @@ def get_unique_actions(
     subreddit_type: Literal["Pregnancy", "Sleep", "Biohacking"],
     biohack_type: BiohackTypeEnum,
 ) -> list[str]:
-    o = TopicExperiences.load(name=subreddit_type)
+    o = TopicExperiences.load(
+        name=subreddit_type,
+        columns=[
+            "action",
+            "biohack_type",
+            "action_score",
+            "outcomes_score",
+            "clinical_trial_study",
+        ],
+    )
     actions: list[str] = []
     # Extract relevant actions
     target_experiences = [
@@ -165,7 +176,8 @@ def cluster(*, biohack_type: BiohackTypeEnum, docs: list[str]) -> None:
     from bertopic_easy.main import bertopic_easy_azure
     from bertopic_easy.models import AzureOpenAIConfig
 
-    print(f"Loaded {len(docs)} documents from {docs_file}")
+    type_value = biohack_type.value
+    print(f"Loaded {len(docs)} documents for {type_value}")
     # check = [d for d in docs if "C to MSM" in d]
     # assert len(check) == 1, f"Expected 1 match, found {len(check)}"
 
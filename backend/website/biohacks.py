@@ -29,6 +29,7 @@ from tqdm import tqdm
 
 from website.base import Base
 from website.chain import Chain
+from website.dedupe import dedupe_rows, experience_text
 from website.experiences import (CommentExperiences, Experience,
                                  StudyExperiences, SubmissionExperiences)
 from website.subreddit import (biohacker_subreddits, new_biohacker_subreddits,
@@ -318,16 +319,38 @@ class TopicExperiences(Base):
         super().__init__(**data)
 
     def deduplicate_experiences(self) -> None:
+        """
+        Drop repeated permalinks, then the exact and near duplicates of the
+        action and outcomes text across the whole topic, keeping the first.
+        """
         old_length = len(self.experiences)
-        unique_experiences = []
+        rows = []
         unique_permalinks = set()
-        for experience in self.experiences:
+        for row, experience in enumerate(self.experiences):
             if experience.permalink not in unique_permalinks:
-                unique_experiences.append(experience)
+                rows.append(row)
                 unique_permalinks.add(experience.permalink)
-        self.experiences = list(unique_experiences)
+        texts = [experience_text(self.experiences[row]) for row in rows]
+        rows = [rows[i] for i in dedupe_rows(texts)]
+        self.experiences = [self.experiences[row] for row in rows]
+        for field in ["action", "outcomes", "health_disorder"]:
+            embeddings = getattr(self, f"{field}_embeddings")
+            if embeddings is not None and len(embeddings) == old_length:
+                setattr(self, f"{field}_embeddings", [embeddings[r] for r in rows])
         self.save()
-        print(f"Unique experiences: {len(unique_experiences)} down from {old_length}")
+        print(f"Unique experiences: {len(rows)} down from {old_length}")
+
+    def unscored_rows(
+        self, field: str, *, start: int, size: Optional[int], resume: bool
+    ) -> list[int]:
+        """
+        Rows `start:size` of the experiences, without those that already have
+        `field` when resuming.
+        """
+        rows = list(range(len(self.experiences)))[start:size]
+        if resume:
+            rows = [r for r in rows if getattr(self.experiences[r], field) is None]
+        return rows
 
     async def extract_biohack_subtype(
         self,
@@ -339,14 +362,19 @@ class TopicExperiences(Base):
         max_tokens: int,
         max_retries: int,
         timeout: int,
+        resume: bool = False,
     ) -> None:
-        # save the experiences after every 500 batch
+        # journal the subtypes after every 500 batch, save once at the end
         save_batch_size = 500
-        experiences = self.experiences[start:size]
-        experience_batches = list(itertools.batched(experiences, save_batch_size))
-        number_of_batches = len(experience_batches)
-        for idx, experience_batch in enumerate(experience_batches):
-            print(f"Batch: {idx}/{number_of_batches} saving every {save_batch_size}")
+        journal = self.journal()
+        rows = self.unscored_rows(
+            "biohack_subtype", start=start, size=size, resume=resume
+        )
+        row_batches = list(itertools.batched(rows, save_batch_size))
+        number_of_batches = len(row_batches)
+        for idx, row_batch in enumerate(row_batches):
+            print(f"Batch: {idx}/{number_of_batches} journaled every {save_batch_size}")
+            experience_batch = [self.experiences[row] for row in row_batch]
             responses = await BiohackSubtypeChain.batch_predict(
                 size=batch_size,
                 llm_name=llm_name,
@@ -369,7 +397,8 @@ class TopicExperiences(Base):
                     print(experience.action)
                     print(experience.biohack_subtype)
                     print("-" * 50)
-            self.save()
+            journal.append(self.experiences, row_batch, ["biohack_subtype"])
+        self.save()
 
     async def action_score_experiences(
         self,
@@ -381,14 +410,17 @@ class TopicExperiences(Base):
         max_retries: int,
         timeout: int,
         start: int = 0,
+        resume: bool = False,
     ) -> None:
-        # save the experiences after every 500 batch
+        # journal the scores after every 500 batch, save once at the end
         save_batch_size = 500
-        experiences = self.experiences[start:size]
-        experience_batches = list(itertools.batched(experiences, save_batch_size))
-        number_of_batches = len(experience_batches)
-        for idx, experience_batch in enumerate(experience_batches):
-            print(f"Batch: {idx}/{number_of_batches} saving every {save_batch_size}")
+        journal = self.journal()
+        rows = self.unscored_rows("action_score", start=start, size=size, resume=resume)
+        row_batches = list(itertools.batched(rows, save_batch_size))
+        number_of_batches = len(row_batches)
+        for idx, row_batch in enumerate(row_batches):
+            print(f"Batch: {idx}/{number_of_batches} journaled every {save_batch_size}")
+            experience_batch = [self.experiences[row] for row in row_batch]
             responses = await ActionScoreChain.batch_predict(
                 size=batch_size,
                 llm_name=llm_name,
@@ -403,8 +435,8 @@ class TopicExperiences(Base):
                 except Exception as e:
                     print(response)
                     experience.action_score = 0
-
-            self.save()
+            journal.append(self.experiences, row_batch, ["action_score"])
+        self.save()
 
     async def outcomes_score_experiences(
         self,
@@ -416,26 +448,23 @@ class TopicExperiences(Base):
         max_retries: int,
         timeout: int,
         start: int = 0,
+        resume: bool = True,
     ) -> None:
-        # save the experiences after every 500 batch
+        # journal the scores after every 500 batch, save once at the end
         def missing_outcomes_score():
             missing = sum([1 for e in self.experiences if e.outcomes_score is None])
             print(f"Missing outcomes: {missing}")
 
         missing_outcomes_score()
         save_batch_size = 500
-        experiences = self.experiences[start:size]
-        indices = [
-            idx
-            for idx, experience in enumerate(experiences)
-            if experience.outcomes_score is None
-        ]
-        outcomes_scores = [experience.outcomes_score for experience in experiences]
-        indices = indices[start:size]
-        indices_batches = list(itertools.batched(indices, save_batch_size))
-        for idx, index_batch in enumerate(indices_batches):
-            print(f"Batch: {idx}/{len(indices_batches)}")
-            experience_batch = [experiences[idx] for idx in index_batch]
+        journal = self.journal()
+        rows = self.unscored_rows(
+            "outcomes_score", start=start, size=size, resume=resume
+        )
+        row_batches = list(itertools.batched(rows, save_batch_size))
+        for idx, row_batch in enumerate(row_batches):
+            print(f"Batch: {idx}/{len(row_batches)}")
+            experience_batch = [self.experiences[row] for row in row_batch]
             responses = await OutcomesScoreChain.batch_predict(
                 size=batch_size,
                 llm_name=llm_name,
@@ -444,14 +473,15 @@ class TopicExperiences(Base):
                 max_retries=max_retries,
                 timeout=timeout,
             )
-            for index, response in zip(index_batch, responses):
+            for experience, response in zip(experience_batch, responses):
                 try:
-                    self.experiences[index].outcomes_score = response.score
+                    experience.outcomes_score = response.score
                 except Exception as e:
                     print(response)
-                    self.experiences[index].outcomes_score = 0
+                    experience.outcomes_score = 0
+            journal.append(self.experiences, row_batch, ["outcomes_score"])
             missing_outcomes_score()
-            self.save()
+        self.save()
 
     @classmethod
     def from_all(
@@ -644,6 +674,7 @@ class MechanismChain(Chain):
 
 
 def main():
+    # the whole ETL, with skips and restarts: poetry run python -m website.pipeline
     for topic in ["Biohacking", "Pregnancy", "Sleep"]:
         print(topic)
         if topic == "Biohacking":
@@ -0,0 +1,184 @@
+"""
+In-process BM25 over the experiences of the local vector index.
+
+Azure Search fuses BM25 on `search_text=question` with the vector kNN. This is
+the text half for `website.local_index`, written next to its files and in the
+same row order:
+
+    index_dir/
+        bm25_vocab.json       -- term -> term id
+        bm25_offsets.npy      -- (terms + 1,) term t is [offsets[t], offsets[t+1])
+        bm25_rows.npy         -- (postings,) int32 rows, ascending per term
+        bm25_impacts.npy      -- (postings,) float32 BM25 weight of the term in the row
+        bm25_idf.npy          -- (terms,) float32
+        bm25_doc_lengths.npy  -- (rows,) int32 tokens per row
+
+A row's BM25 score only depends on the term frequency, its length and the
+term's IDF, all known at build time, so each posting stores its final weight
+and a query is one `np.bincount` over the postings of its terms.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+
+# the text Azure Search matches `search_text` against
+fields = ["action", "outcomes", "health_disorder", "takeaway"]
+
+stopwords = frozenset(
+    "a an and are as at be by for from has have i in is it its my of on or that "
+    "the this to was were with".split()
+)
+token_pattern = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    >>> tokenize("Took iron AND vitamin-C, ferritin 9->40")
+    ['took', 'iron', 'vitamin', 'c', 'ferritin', '9', '40']
+    """
+    tokens = token_pattern.findall(text.lower())
+    return [token for token in tokens if token not in stopwords]
+
+
+def document_text(document: dict) -> str:
+    return " ".join(document.get(field) or "" for field in fields)
+
+
+def reciprocal_rank_fusion(rankings: Iterable[np.ndarray], k: int = 60) -> dict:
+    """
+    Sum of 1 / (k + rank) over the rankings each row appears in.
+
+    >>> fused = reciprocal_rank_fusion([np.array([3, 1]), np.array([1, 2])])
+    >>> sorted(fused, key=fused.get, reverse=True)
+    [1, 3, 2]
+    """
+    fused: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking.tolist(), start=1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank)
+    return fused
+
+
+def linear_fusion(
+    vector: tuple[np.ndarray, np.ndarray],
+    text: tuple[np.ndarray, np.ndarray],
+    alpha: float = 0.5,
+) -> dict:
+    """
+    `alpha` * the min-max normalized vector score + (1 - `alpha`) * the
+    normalized BM25 score. A row missing from one side gets 0 there.
+
+    >>> fused = linear_fusion(
+    ...     (np.array([1, 2]), np.array([0.9, 0.5])),
+    ...     (np.array([2]), np.array([7.0])),
+    ...     alpha=0.3,
+    ... )
+    >>> {row: round(score, 2) for row, score in fused.items()}
+    {1: 0.3, 2: 0.7}
+    """
+    fused: dict[int, float] = {}
+    for (rows, scores), weight in [(vector, alpha), (text, 1 - alpha)]:
+        if len(rows) == 0:
+            continue
+        low, high = float(scores.min()), float(scores.max())
+        if high > low:
+            normalized = (scores - low) / (high - low)
+        else:
+            normalized = np.ones(len(rows))
+        for row, score in zip(rows.tolist(), normalized.tolist()):
+            fused[row] = fused.get(row, 0.0) + weight * score
+    return fused
+
+
+class BM25Index:
+    def __init__(self, index_dir: Path):
+        index_dir = Path(index_dir)
+        with open(index_dir / "bm25_vocab.json") as f:
+            self.vocab: dict[str, int] = json.load(f)
+        self.offsets = np.load(index_dir / "bm25_offsets.npy", mmap_mode="r")
+        self.rows = np.load(index_dir / "bm25_rows.npy", mmap_mode="r")
+        self.impacts = np.load(index_dir / "bm25_impacts.npy", mmap_mode="r")
+        self.idf = np.load(index_dir / "bm25_idf.npy", mmap_mode="r")
+        self.doc_lengths = np.load(index_dir / "bm25_doc_lengths.npy", mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    @staticmethod
+    def exists(index_dir: Path) -> bool:
+        return (Path(index_dir) / "bm25_vocab.json").exists()
+
+    @classmethod
+    def build(
+        cls,
+        index_dir: Path,
+        *,
+        documents: list[dict],
+        k1: float = 1.2,
+        b: float = 0.75,
+    ) -> BM25Index:
+        """
+        `documents` in the row order of the vector index.
+        """
+        vocab: dict[str, int] = {}
+        postings: list[list[tuple[int, int]]] = []
+        doc_lengths = np.zeros(len(documents), dtype=np.int32)
+        for row, document in enumerate(documents):
+            tokens = tokenize(document_text(document))
+            doc_lengths[row] = len(tokens)
+            for token, tf in Counter(tokens).items():
+                term = vocab.setdefault(token, len(vocab))
+                if term == len(postings):
+                    postings.append([])
+                postings[term].append((row, tf))
+
+        n = max(len(documents), 1)
+        average_length = max(float(doc_lengths.mean()) if len(documents) else 0, 1.0)
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p in postings])
+        rows = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.float32)
+        for term, term_postings in enumerate(postings):
+            rows[offsets[term] : offsets[term + 1]] = [row for row, _ in term_postings]
+            tfs[offsets[term] : offsets[term + 1]] = [tf for _, tf in term_postings]
+        df = np.diff(offsets).astype(np.float32)
+        idf = np.log(1 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        term_ids = np.repeat(np.arange(len(vocab)), np.diff(offsets))
+        norm = k1 * (1 - b + b * doc_lengths[rows] / average_length)
+        impacts = (idf[term_ids] * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        with open(index_dir / "bm25_vocab.json", "w") as f:
+            json.dump(vocab, f)
+        np.save(index_dir / "bm25_offsets.npy", offsets)
+        np.save(index_dir / "bm25_rows.npy", rows)
+        np.save(index_dir / "bm25_impacts.npy", impacts)
+        np.save(index_dir / "bm25_idf.npy", idf)
+        np.save(index_dir / "bm25_doc_lengths.npy", doc_lengths)
+        return cls(index_dir)
+
+    def search(self, text: str, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the rows and BM25 scores of the top `k` rows, best first.
+        """
+        terms = {self.vocab[token] for token in tokenize(text) if token in self.vocab}
+        if not terms:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows = np.concatenate(
+            [self.rows[self.offsets[t] : self.offsets[t + 1]] for t in terms]
+        )
+        impacts = np.concatenate(
+            [self.impacts[self.offsets[t] : self.offsets[t + 1]] for t in terms]
+        )
+        scores = np.bincount(rows, weights=impacts, minlength=len(self))
+        matched = np.flatnonzero(scores)
+        best = matched[np.argsort(-scores[matched], kind="stable")[:k]]
+        return best, scores[best].astype(np.float32)
@@ -0,0 +1,302 @@
+"""
+Result cache for search taxonomies and AI summaries.
+
+Two tiers:
+
+- local: in-process LRU with a TTL, bounded by number of entries
+- shared: redis, so every uvicorn worker sees the same entries
+
+A get checks the local tier first, then the shared tier (and copies the hit
+into the local tier). A set writes through to both tiers.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Optional
+
+from loguru import logger
+from pydantic import BaseModel
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+
+from website.models import AISummary, DynamicBiohackingTaxonomy
+
+# only these types are written to the shared tier, so we know how to read them back
+cacheable_models: dict[str, type[BaseModel]] = {
+    "DynamicBiohackingTaxonomy": DynamicBiohackingTaxonomy,
+    "AISummary": AISummary,
+}
+
+
+def normalize_question(question: str) -> str:
+    """
+    Cache (and single-flight) key for a search question.
+
+    >>> normalize_question("  Iron and   pregnancy? ")
+    'iron and pregnancy'
+    """
+    question = question.replace("?", " ").lower()
+    return re.sub(r"\s+", " ", question).strip()
+
+
+class CacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    errors: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Typed envelope so the reader knows which model to validate against.
+
+    >>> loads(dumps("Error starting ai summary task"))
+    'Error starting ai summary task'
+    """
+    if isinstance(value, BaseModel):
+        type_name = value.__class__.__name__
+        if type_name not in cacheable_models:
+            raise TypeError(f"{type_name} is not registered in cacheable_models")
+        data = value.model_dump_json()
+    elif isinstance(value, str):
+        type_name = "str"
+        data = json.dumps(value)
+    else:
+        raise TypeError(f"Can't cache values of type {type(value).__name__}")
+    return f'{{"type": "{type_name}", "data": {data}}}'.encode("utf-8")
+
+
+def loads(raw: bytes) -> Any:
+    envelope = json.loads(raw)
+    type_name = envelope["type"]
+    if type_name == "str":
+        return envelope["data"]
+    model = cacheable_models[type_name]
+    return model.model_validate(envelope["data"])
+
+
+class LocalCache:
+    """
+    In-process LRU + TTL tier.
+    """
+
+    def __init__(self, *, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        if ttl is None:
+            ttl = self.ttl
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def pop(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+
+class RedisCache:
+    """
+    Shared tier. Eviction past `maxmemory` is redis' job (use `allkeys-lru`),
+    here we only cap the size of a single value.
+    """
+
+    def __init__(
+        self,
+        *,
+        client: aioredis.Redis,
+        ttl: int,
+        max_value_bytes: int,
+        prefix: str = "result:",
+        lock_prefix: str = "lock:",
+    ):
+        self.client = client
+        self.ttl = ttl
+        self.max_value_bytes = max_value_bytes
+        self.prefix = prefix
+        self.lock_prefix = lock_prefix
+        self.stats = CacheStats()
+
+    async def get(self, key: str) -> Any:
+        try:
+            raw = await self.client.get(self.prefix + key)
+        except RedisError as e:
+            logger.warning(f"Redis get failed for {key}: {e}")
+            self.stats.errors += 1
+            return None
+        if raw is None:
+            self.stats.misses += 1
+            return None
+        try:
+            value = loads(raw)
+        except Exception as e:
+            logger.warning(f"Dropping unreadable cache entry {key}: {e}")
+            self.stats.errors += 1
+            await self.pop(key)
+            return None
+        self.stats.hits += 1
+        return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        raw = dumps(value)
+        if len(raw) > self.max_value_bytes:
+            logger.warning(
+                f"Not sharing {key}: {len(raw)} bytes > {self.max_value_bytes} bytes"
+            )
+            self.stats.evictions += 1
+            return
+        try:
+            await self.client.set(self.prefix + key, raw, ex=ttl or self.ttl)
+        except RedisError as e:
+            logger.warning(f"Redis set failed for {key}: {e}")
+            self.stats.errors += 1
+
+    async def pop(self, key: str) -> None:
+        try:
+            await self.client.delete(self.prefix + key)
+        except RedisError as e:
+            logger.warning(f"Redis delete failed for {key}: {e}")
+            self.stats.errors += 1
+
+    async def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        """
+        Returns a token if we own the lock, None if another worker does.
+        If redis is down we behave as if we own it and run locally.
+        """
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self.client.set(
+                self.lock_prefix + key, token, nx=True, px=int(ttl * 1000)
+            )
+        except RedisError as e:
+            logger.warning(f"Redis lock failed for {key}: {e}")
+            self.stats.errors += 1
+            return token
+        if acquired:
+            return token
+        return None
+
+    async def is_locked(self, key: str) -> bool:
+        try:
+            return bool(await self.client.exists(self.lock_prefix + key))
+        except RedisError as e:
+            logger.warning(f"Redis exists failed for {key}: {e}")
+            self.stats.errors += 1
+            return False
+
+    async def release_lock(self, key: str, token: str) -> None:
+        # best effort compare-and-delete, the lock ttl bounds the damage of a race
+        try:
+            owner = await self.client.get(self.lock_prefix + key)
+            if owner is not None and owner.decode("utf-8") == token:
+                await self.client.delete(self.lock_prefix + key)
+        except RedisError as e:
+            logger.warning(f"Redis unlock failed for {key}: {e}")
+            self.stats.errors += 1
+
+
+class ResultCache:
+    def __init__(self, *, local: LocalCache, shared: Optional[RedisCache] = None):
+        self.local = local
+        self.shared = shared
+
+    @classmethod
+    def from_url(
+        cls,
+        redis_url: Optional[str],
+        *,
+        max_entries: int = 512,
+        local_ttl: float = 60 * 60,
+        shared_ttl: int = 24 * 60 * 60,
+        max_value_bytes: int = 2_000_000,
+    ) -> ResultCache:
+        if redis_url is None:
+            return cls(local=LocalCache(max_entries=max_entries, ttl=local_ttl))
+        client = aioredis.Redis.from_url(redis_url, health_check_interval=10)
+        shared = RedisCache(
+            client=client, ttl=shared_ttl, max_value_bytes=max_value_bytes
+        )
+        # keep the local copy short lived so a pop on one worker is seen by the others
+        local = LocalCache(max_entries=max_entries, ttl=min(local_ttl, 60))
+        return cls(local=local, shared=shared)
+
+    async def get(self, key: str) -> Any:
+        value = self.local.get(key)
+        if value is not None or self.shared is None:
+            return value
+        value = await self.shared.get(key)
+        if value is not None:
+            self.local.set(key, value)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
+        local_ttl = self.local.ttl if ttl is None else min(ttl, self.local.ttl)
+        self.local.set(key, value, ttl=local_ttl)
+        if self.shared is not None:
+            await self.shared.set(key, value, ttl=ttl)
+
+    async def pop(self, key: str) -> None:
+        self.local.pop(key)
+        if self.shared is not None:
+            await self.shared.pop(key)
+
+    async def acquire_lock(self, key: str, ttl: float) -> Optional[str]:
+        if self.shared is None:
+            # single worker, the in-process SingleFlight already coalesces
+            return "local"
+        return await self.shared.acquire_lock(key, ttl)
+
+    async def is_locked(self, key: str) -> bool:
+        if self.shared is None:
+            return False
+        return await self.shared.is_locked(key)
+
+    async def release_lock(self, key: str, token: str) -> None:
+        if self.shared is not None:
+            await self.shared.release_lock(key, token)
+
+    def stats(self) -> dict[str, Any]:
+        stats: dict[str, Any] = {
+            "local": self.local.stats.model_dump(),
+            "local_entries": len(self.local),
+            "local_hit_rate": self.local.stats.hit_rate,
+        }
+        if self.shared is not None:
+            stats["shared"] = self.shared.stats.model_dump()
+            stats["shared_hit_rate"] = self.shared.stats.hit_rate
+        return stats
@@ -4,8 +4,10 @@ import asyncio
 import itertools
 import random
 from abc import ABCMeta, abstractmethod
+from contextvars import ContextVar
 from time import sleep
-from typing import Any, ClassVar, Iterable, Optional, Type, Union
+from typing import (Any, AsyncIterator, Callable, ClassVar, Iterable, Optional,
+                    Type, Union)
 
 import instructor
 from instructor.exceptions import InstructorRetryException
@@ -17,14 +19,26 @@ from rich import print
 from rich.console import Console
 from rich.theme import Theme
 from rich.traceback import install
-from website import settings
+from website import llm_clients, settings
+from website.limiter import (CallDeadline, current_deadline, estimate_tokens,
+                             get_limiter)
+from website.llm_cache import llm_cache
+from website.router import RoutedClient, get_router
 
 install()
 
 custom_theme = Theme({"info": "dim cyan", "warning": "magenta", "danger": "bold red"})
 console = Console(theme=custom_theme)
 
-backup_endpoints = {}
+# other regional deployments of the same model, the router spreads the load
+# over these and fails over to them (see website/router.py)
+backup_endpoints = {
+    "gpt-4o-mini": [
+        "https://openai-rg-nobsmed.openai.azure.com/openai/deployments/gpt-4o-mini/chat/completions?api-version=2024-02-15-preview",
+    ],
+    # the live /search and /stream_search enrichment
+    "gpt-4o": settings.gpt_4o_backup_endpoints,
+}
 
 # endpoint="https://boris-m3ndov9n-eastus2.openai.azure.com/",
 # api_version="2024-12-01-preview",
@@ -41,6 +55,67 @@ endpoints = {
     "o3-mini": "https://boris-m3ndov9n-eastus2.openai.azure.com/",
 }
 
+# $ per 1M prompt and completion tokens, for the usage reports
+prices = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "o1-preview": (15.00, 60.00),
+    "o1-mini": (1.10, 4.40),
+    "o3-mini": (1.10, 4.40),
+}
+
+
+class LLMUsage(BaseModel):
+    calls: int = 0
+    cached: int = 0
+    errors: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+
+    def record(
+        self,
+        *,
+        llm_name: str,
+        prompt: str,
+        result: Any,
+        max_tokens: Optional[int],
+        cached: bool = False,
+    ) -> None:
+        if cached:
+            self.cached += 1
+            return
+        self.calls += 1
+        failed = isinstance(result, Exception)
+        self.errors += int(failed)
+        # instructor keeps the completion, and its token counts, on the result
+        usage = getattr(getattr(result, "_raw_response", None), "usage", None)
+        if usage is not None:
+            prompt_tokens, completion_tokens = (
+                usage.prompt_tokens,
+                usage.completion_tokens,
+            )
+        else:
+            prompt_tokens = estimate_tokens(prompt, 0)
+            completion_tokens = 0 if failed else max_tokens or 0
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        prompt_price, completion_price = prices.get(llm_name, (0.0, 0.0))
+        self.cost += (
+            prompt_tokens * prompt_price + completion_tokens * completion_price
+        ) / 1e6
+
+
+# counts the calls made in this context, e.g. by one `website.pipeline` stage;
+# tasks and threads started in it share the same `LLMUsage`
+llm_usage: ContextVar[Optional[LLMUsage]] = ContextVar("llm_usage", default=None)
+
+
+def record_usage(**kwargs) -> None:
+    usage = llm_usage.get()
+    if usage is not None:
+        usage.record(**kwargs)
+
 
 class Chain(BaseModel, metaclass=ABCMeta):
     """
@@ -53,10 +128,13 @@ class Chain(BaseModel, metaclass=ABCMeta):
 
     >>> cls.predict()
     >>> await cls.batch_predict()
+    >>> async for index, result in cls.iter_predict(): ...
     """
 
     input_schema: ClassVar[Type[Any]]
     output_schema: ClassVar[Type[Any]]
+    # look up identical prompts in the LLM response cache first
+    cache: ClassVar[bool] = True
 
     @classmethod
     @abstractmethod
@@ -81,9 +159,24 @@ class Chain(BaseModel, metaclass=ABCMeta):
     @classmethod
     def make_client(
         cls, llm_name: str, timeout: Union[int, None], sync: bool = False
-    ) -> Union[AsyncAzureOpenAI, AzureOpenAI]:
-        endpoint = endpoints[llm_name]
+    ) -> Union[AsyncAzureOpenAI, AzureOpenAI, RoutedClient]:
+        urls = [endpoints[llm_name]] + backup_endpoints.get(llm_name, [])
+        if sync or len(urls) == 1:
+            return cls.make_endpoint_client(
+                llm_name, endpoint=urls[0], timeout=timeout, sync=sync
+            )
+        clients = {
+            url: cls.make_endpoint_client(
+                llm_name, endpoint=url, timeout=timeout, sync=sync
+            )
+            for url in urls
+        }
+        return RoutedClient(get_router(llm_name, urls), clients)
 
+    @classmethod
+    def make_endpoint_client(
+        cls, llm_name: str, *, endpoint: str, timeout: Union[int, None], sync: bool
+    ) -> Union[AsyncAzureOpenAI, AzureOpenAI]:
         if llm_name == "o3-mini":
             api_version = "2024-12-01-preview"
         else:
@@ -96,28 +189,33 @@ class Chain(BaseModel, metaclass=ABCMeta):
         else:
             api_key = settings.api_key
 
-        if sync is False:
-            deployment_client = instructor.from_openai(
-                AsyncAzureOpenAI(
-                    api_version=api_version,
-                    azure_endpoint=endpoint,
-                    azure_deployment=llm_name,
-                    api_key=api_key,
-                    timeout=timeout,
-                )
-            )
-        else:
-            deployment_client = instructor.patch(
-                AzureOpenAI(
-                    api_version=api_version,
-                    azure_endpoint=endpoint,
-                    azure_deployment=llm_name,
-                    api_key=api_key,
-                    timeout=timeout,
-                )
-            )
+        # reuses the process-wide client and its connection pool
+        deployment_client = llm_clients.get_client(
+            endpoint=endpoint,
+            deployment=llm_name,
+            api_version=api_version,
+            api_key=api_key,
+            sync=sync,
+            timeout=timeout,
+        )
         return deployment_client  # type: ignore
 
+    @classmethod
+    def cache_key(cls, *, llm_name: str, prompt: str) -> Optional[str]:
+        if not cls.cache or llm_cache is None:
+            return None
+        return llm_cache.make_key(
+            chain=cls.__name__,
+            llm_name=llm_name,
+            output_schema=cls.output_schema,
+            prompt=prompt,
+        )
+
+    @classmethod
+    def cache_result(cls, *, key: Optional[str], llm_name: str, result: Any) -> None:
+        if key is not None and llm_cache is not None and isinstance(result, BaseModel):
+            llm_cache.set(key, result, chain=cls.__name__, llm_name=llm_name)
+
     @classmethod
     async def coroutine(
         cls,
@@ -128,45 +226,70 @@ class Chain(BaseModel, metaclass=ABCMeta):
         max_retries: int,
         max_tokens: int,
         reasoning_effort: Optional[str] = None,
+        batch: bool = False,
     ) -> Any:
+        key = cls.cache_key(llm_name=llm_name, prompt=prompt)
+        if key is not None:
+            cached = llm_cache.get(key, cls.output_schema)  # type: ignore
+            if cached is not None:
+                record_usage(
+                    llm_name=llm_name,
+                    prompt=prompt,
+                    result=cached,
+                    max_tokens=max_tokens,
+                    cached=True,
+                )
+                return cached
+        tokens = estimate_tokens(prompt, max_tokens)
+        request: dict[str, Any] = dict(
+            model=llm_name,
+            messages=[
+                {"role": "user", "content": prompt},
+            ],
+            response_model=cls.output_schema,
+            max_retries=max_retries,
+        )
+        if reasoning_effort is None:
+            request["max_tokens"] = max_tokens
+
+        async def create(deployment_client, endpoint: Optional[str]) -> Any:
+            # each deployment has its own window, a 429 on one leaves the others
+            limiter = get_limiter(llm_name, endpoint)
+            async with limiter.slot(tokens=tokens, batch=batch):
+                return await deployment_client.chat.completions.create(**request)
+
         try:
-            if reasoning_effort is not None:
-                result = await client.chat.completions.create(  # type: ignore
-                    model=llm_name,
-                    messages=[
-                        {"role": "user", "content": prompt},
-                    ],
-                    response_model=cls.output_schema,
-                    max_retries=max_retries,
-                    # max_tokens=max_tokens,
+            if isinstance(client, RoutedClient):
+                result = await client.router.call(
+                    lambda url: create(client.clients[url], url)
                 )
             else:
-                result = await client.chat.completions.create(  # type: ignore
-                    model=llm_name,
-                    messages=[
-                        {"role": "user", "content": prompt},
-                    ],
-                    response_model=cls.output_schema,
-                    max_retries=max_retries,
-                    max_tokens=max_tokens,
-                )
+                result = await create(client, endpoints.get(llm_name))
         except InstructorRetryException as e:
             print(prompt)
             logger.warning(f"Retry Exception: {e}")
-            return e
+            result = e
         except BadRequestError as e:
             print(prompt)
             logger.warning(f"Risky Content: {e}")
-            return e
+            result = e
         except ValidationError as e:
             print(prompt)
             logger.warning(f"Validation error: {e}")
-            return e
+            result = e
         except Exception as e:
             print(prompt)
             logger.error(f"Unknown Exception: {e}")
             # website.chain:coroutine:136 - Unknown Exception: Connection error.
-            return e
+            result = e
+        record_usage(
+            llm_name=llm_name, prompt=prompt, result=result, max_tokens=max_tokens
+        )
+        if key is not None:
+            # the INSERT can wait up to 10s on the ETL's write lock, not on the loop
+            await asyncio.to_thread(
+                cls.cache_result, key=key, llm_name=llm_name, result=result
+            )
         return result
 
     @classmethod
@@ -192,7 +315,6 @@ class Chain(BaseModel, metaclass=ABCMeta):
             print(batch_size)
             print(e)
             breakpoint()
-        # new client for each batch
         client = cls.make_client(llm_name, sync=False, timeout=timeout)
         for idx, input_objects_batch in enumerate(input_objects_batches):
 
@@ -213,6 +335,7 @@ class Chain(BaseModel, metaclass=ABCMeta):
                         max_tokens=max_tokens,
                         max_retries=max_retries,
                         reasoning_effort=reasoning_effort,
+                        batch=True,  # leaves room for live searches
                     )
                 )
                 tasks.append(task)
@@ -232,6 +355,115 @@ class Chain(BaseModel, metaclass=ABCMeta):
         # client.close()
         return responses
 
+    @classmethod
+    async def iter_predict(
+        cls,
+        *,
+        max_tokens: int,
+        size: int,
+        llm_name: str,
+        timeout: Union[int, None],
+        max_retries: int,
+        input_objects: Iterable[Any],
+        reasoning_effort: Optional[str] = None,
+        call_deadline: Optional[float] = None,
+        deadline: Optional[float] = None,
+        min_results: Optional[int] = None,
+        is_result: Callable[[Any], bool] = lambda r: not isinstance(r, Exception),
+        batch: bool = False,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        **kwargs,
+    ) -> AsyncIterator[tuple[int, Any]]:
+        """
+        Like `batch_predict` but yields `(index, result)` in completion order,
+        so the slowest call in a batch doesn't hold back the others.
+
+        - size: max calls in flight
+        - call_deadline: seconds before a single call yields a TimeoutError,
+          counted from its limiter slot once it has one
+        - deadline: seconds before giving up on the remaining calls
+        - min_results: stop once this many results pass `is_result`
+        - batch: offline caller, yields to live ones on the deployment limiter
+        - semaphore: calls in flight shared with other callers, instead of `size`
+
+        Unfinished calls are cancelled when it stops early or the caller
+        stops iterating.
+        """
+        name = cls.__name__
+        input_objects = list(input_objects)
+        prompts = cls.make_inputs(input_objects=input_objects, **kwargs)
+        client = cls.make_client(llm_name, sync=False, timeout=timeout)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(size)
+
+        async def call(index: int, prompt: str) -> tuple[int, Any]:
+            async with semaphore:
+                # seen by the limiter slot of the call, a missed deadline is a
+                # throttle of the deployment
+                call_clock = CallDeadline()
+                current_deadline.set(call_clock)
+                task = asyncio.create_task(
+                    cls.coroutine(
+                        client=client,
+                        llm_name=llm_name,
+                        prompt=prompt,
+                        max_tokens=max_tokens,
+                        max_retries=max_retries,
+                        reasoning_effort=reasoning_effort,
+                        batch=batch,
+                    )
+                )
+                try:
+                    done, _ = await asyncio.wait({task}, timeout=call_deadline)
+                    if not done and call_clock.started is not None:
+                        # the deadline runs from the limiter slot, not the queue
+                        remaining = call_clock.started + call_deadline - loop.time()
+                        if remaining > 0:
+                            done, _ = await asyncio.wait({task}, timeout=remaining)
+                    if done:
+                        return index, task.result()
+                    if call_clock.started is not None:
+                        call_clock.missed.set()
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    logger.warning(f"{name} call {index} missed its deadline")
+                    return index, asyncio.TimeoutError()
+                finally:
+                    task.cancel()
+
+        loop = asyncio.get_running_loop()
+        stop_at = None if deadline is None else loop.time() + deadline
+        tasks = [
+            asyncio.create_task(call(index, prompt))
+            for index, prompt in enumerate(prompts)
+        ]
+        pending = set(tasks)
+        count_results = 0
+        try:
+            while pending:
+                remaining = None if stop_at is None else stop_at - loop.time()
+                if remaining is not None and remaining <= 0:
+                    count_done = len(tasks) - len(pending)
+                    logger.warning(f"{name} deadline: {count_done}/{len(tasks)} done")
+                    return
+                done, pending = await asyncio.wait(
+                    pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    index, result = task.result()
+                    yield index, result
+                    if is_result(result):
+                        count_results += 1
+                if min_results is not None and count_results >= min_results:
+                    console.print(
+                        f"{name} got {count_results} results, skipping {len(pending)}",
+                        style="info",
+                    )
+                    return
+        finally:
+            for task in pending:
+                task.cancel()
+
     @classmethod
     def predict(
         cls,
@@ -242,10 +474,22 @@ class Chain(BaseModel, metaclass=ABCMeta):
         timeout: int,
         **kwargs,
     ) -> Any:
-        client = cls.make_client(llm_name, sync=True, timeout=timeout)
-
         prompts = cls.make_inputs(input_objects=[input_object])
         prompt = prompts[0]
+        key = cls.cache_key(llm_name=llm_name, prompt=prompt)
+        if key is not None:
+            cached = llm_cache.get(key, cls.output_schema)  # type: ignore
+            if cached is not None:
+                record_usage(
+                    llm_name=llm_name,
+                    prompt=prompt,
+                    result=cached,
+                    max_tokens=max_tokens,
+                    cached=True,
+                )
+                return cached
+
+        client = cls.make_client(llm_name, sync=True, timeout=timeout)
         print(prompt)
         try:
             response = client.chat.completions.create(  # type: ignore
@@ -263,6 +507,10 @@ class Chain(BaseModel, metaclass=ABCMeta):
             logger.error(f"error in predict: {e}")
             response = e
 
+        record_usage(
+            llm_name=llm_name, prompt=prompt, result=response, max_tokens=max_tokens
+        )
+        cls.cache_result(key=key, llm_name=llm_name, result=response)
         return response
 
 
@@ -0,0 +1,188 @@
+"""
+Columnar grouping of search hits into the taxonomy.
+
+`hits_to_experiences`, `experiences2biohacks` and `make_taxonomy` used to
+validate an `Experience` per hit, then `clean()` it (dump + validate again),
+sometimes twice, before grouping with dicts of lists. Here the hits stay one
+array per field: sorting, dedupe, grouping by `biohack_topic` and
+`biohack_type` and the reddit/study counts are NumPy operations, and the
+read-only `HitRecord`s are only built once, at the end.
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, Optional
+
+import numpy as np
+
+from website.dedupe import dedupe_rows
+from website.models import (BiohackTypeGroup, DynamicBiohack,
+                            DynamicBiohackingTaxonomy, Experience, HitRecord,
+                            hit_record_fields)
+
+# what `search.clean` keeps of an experience, plus its resolved computed fields
+fields = hit_record_fields
+required_fields = ["permalink", "action", "health_disorder", "outcomes"]
+
+
+def factorize(values: np.ndarray) -> tuple[np.ndarray, list]:
+    """
+    Integer codes for `values` and the unique values, in order of first
+    appearance. None is a value of its own.
+
+    >>> codes, uniques = factorize(np.array(["sleep", None, "diet", "sleep"]))
+    >>> codes.tolist(), uniques
+    ([0, 1, 2, 0], ['sleep', None, 'diet'])
+    """
+    if len(values) == 0:
+        return np.empty(0, dtype=np.int64), []
+    is_none = np.equal(values, None)
+    # np.unique can't order None against str, give it a key no string has
+    keys = np.where(is_none, "\x00", values).astype(str)
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    codes = rank[inverse.ravel()]
+    uniques = [values[i] for i in first[order]]
+    return codes, uniques
+
+
+def groups(codes: np.ndarray) -> list[np.ndarray]:
+    """
+    Row indices of each code, in code order, rows in their original order.
+
+    >>> [rows.tolist() for rows in groups(np.array([1, 0, 1, 2]))]
+    [[1], [0, 2], [3]]
+    """
+    if len(codes) == 0:
+        return []
+    order = np.argsort(codes, kind="stable")
+    boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+    return np.split(order, boundaries)
+
+
+def is_study(permalinks: np.ndarray) -> np.ndarray:
+    # `Experience.source_type`: studies are DOIs, reddits are paths
+    return np.char.find(permalinks.astype(str), "10.") >= 0
+
+
+class HitColumns:
+    def __init__(self, columns: dict[str, np.ndarray]):
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns["permalink"])
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        return self.columns[field]
+
+    @classmethod
+    def from_lists(cls, lists: dict[str, list]) -> HitColumns:
+        columns = {}
+        for field, values in lists.items():
+            column = np.empty(len(values), dtype=object)
+            column[:] = values
+            columns[field] = column
+        for field in required_fields:
+            if np.equal(columns[field], None).any():
+                raise ValueError(f"Search hit without {field}")
+        return cls(columns)
+
+    @classmethod
+    def from_hits(cls, hits: Iterable[dict]) -> HitColumns:
+        """
+        Raw search hits, best `Experience.score` first like `hits_to_experiences`.
+        """
+        hits = list(hits)
+        columns = cls.from_lists(
+            {field: [hit.get(field) for hit in hits] for field in fields}
+        )
+        return columns.take(columns.score_order())
+
+    @classmethod
+    def from_experiences(cls, experiences: Iterable[Experience]) -> HitColumns:
+        experiences = list(experiences)
+        lists = {
+            field: [getattr(e, field) for e in experiences]
+            for field in fields
+            if field != "key"
+        }
+        # `Experience.key` is bytes, the record resolves its own
+        lists["key"] = [None] * len(experiences)
+        return cls.from_lists(lists)
+
+    def take(self, rows: np.ndarray) -> HitColumns:
+        return HitColumns(
+            {field: column[rows] for field, column in self.columns.items()}
+        )
+
+    def score_order(self) -> np.ndarray:
+        action_scores = self["action_score"]
+        outcomes_scores = self["outcomes_score"]
+        if np.equal(action_scores, None).any():
+            raise ValueError("Action score is None")
+        if np.equal(outcomes_scores, None).any():
+            raise ValueError("Outcomes score is None")
+        scores = action_scores.astype(np.int64) + outcomes_scores.astype(np.int64)
+        return np.argsort(-scores, kind="stable")
+
+    def dedupe(self, **kwargs) -> HitColumns:
+        """
+        Keep the first row of each exact or near duplicate (action, outcomes),
+        see `website.dedupe.dedupe_rows`.
+        """
+        if len(self) == 0:
+            return self
+        texts = [
+            f"{action} {outcomes}"
+            for action, outcomes in zip(
+                self["action"].tolist(), self["outcomes"].tolist()
+            )
+        ]
+        return self.take(dedupe_rows(texts, **kwargs))
+
+    def records(self, rows: Optional[np.ndarray] = None) -> list[HitRecord]:
+        if rows is None:
+            rows = np.arange(len(self))
+        values = [self.columns[field][rows].tolist() for field in fields]
+        return [HitRecord(*row) for row in zip(*values)]
+
+    def to_biohacks(self) -> list[DynamicBiohack]:
+        """
+        One `DynamicBiohack` per `biohack_topic`, in order of first appearance.
+        """
+        codes, topics = factorize(self["biohack_topic"])
+        records = self.records()
+        return [
+            DynamicBiohack.model_construct(
+                biohack_topic=topic, experiences=[records[row] for row in rows]
+            )
+            for topic, rows in zip(topics, groups(codes))
+        ]
+
+
+def biohacks_to_taxonomy(biohacks: list[DynamicBiohack]) -> DynamicBiohackingTaxonomy:
+    """
+    Group biohacks by `biohack_type`, in order of first appearance, and count
+    their reddit and study experiences.
+    """
+    biohack_types = np.empty(len(biohacks), dtype=object)
+    biohack_types[:] = [biohack.biohack_type for biohack in biohacks]
+    codes, unique_types = factorize(biohack_types)
+    biohack_type_groups = [
+        BiohackTypeGroup(
+            biohack_type=biohack_type, biohacks=[biohacks[row] for row in rows]
+        )
+        for biohack_type, rows in zip(unique_types, groups(codes))
+    ]
+    permalinks = np.array(
+        [e.permalink for biohack in biohacks for e in biohack.experiences], dtype=str
+    )
+    count_studies = int(is_study(permalinks).sum()) if len(permalinks) else 0
+    return DynamicBiohackingTaxonomy(
+        biohack_types=biohack_type_groups,
+        count_experiences=len(permalinks),
+        count_reddits=len(permalinks) - count_studies,
+        count_studies=count_studies,
+    )
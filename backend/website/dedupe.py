@@ -0,0 +1,185 @@
+"""
+Exact and near-duplicate detection for experiences.
+
+The same experience shows up more than once: a post and its crosspost, a
+comment quoted in a reply, the same study abstract under two permalinks, or a
+light edit of the `action`/`outcomes` text. Each copy is one more row in the
+taxonomy and one more LLM enrichment call.
+
+Two passes over the `action + outcomes` text, both linear in the rows:
+
+- exact: rows whose normalized tokens (`website.bm25.tokenize`) are equal
+  collapse to their first row with a dict lookup.
+- near: a MinHash signature of the word bigrams of each remaining text, then
+  LSH banding. Rows sharing a band bucket are candidates, and a candidate joins
+  its bucket's first row if the signatures estimate a Jaccard similarity of at
+  least `threshold`.
+
+The first row of each duplicate group is kept, so callers pass rows best
+first.
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, Sequence, TypeVar
+
+import numpy as np
+
+from website.bm25 import tokenize
+
+T = TypeVar("T")
+
+# token id of the missing second word of a one-word text
+pad = 0xFFFFFFFF
+
+
+def experience_text(experience) -> str:
+    return f"{experience.action} {experience.outcomes}"
+
+
+def bigram_hashes(token_ids: list[int]) -> list[int]:
+    """
+    32-bit hashes of the word bigrams of a text, the lone word padded.
+
+    >>> len(bigram_hashes([4, 7, 4, 7])), len(set(bigram_hashes([4, 7, 4, 7])))
+    (3, 2)
+    >>> len(bigram_hashes([]))
+    1
+    """
+    if len(token_ids) < 2:
+        token_ids = token_ids + [pad] * (2 - len(token_ids))
+    return [
+        (first * 0x9E3779B1 + second) & 0xFFFFFFFF
+        for first, second in zip(token_ids, token_ids[1:])
+    ]
+
+
+def minhash_signatures(
+    texts: Sequence[list[str]],
+    *,
+    num_perm: int = 64,
+    seed: int = 0,
+    batch_size: int = 4096,
+) -> np.ndarray:
+    """
+    (len(texts), num_perm) uint32 MinHash signatures of the word bigrams of
+    tokenized texts. Tokens get ids in order of first appearance, so
+    signatures only compare within one call.
+
+    The permutations are `h = a * x + b; h ^ (h >> 15)` with wrapping uint32
+    arithmetic and an odd `a`, both bijections. `(a * x + b) mod p` needs
+    uint64 and is ~3x slower.
+    """
+    rng = np.random.default_rng(seed)
+    a = (rng.integers(0, 2**31, num_perm, dtype=np.uint32) * 2 + 1)[:, None]
+    b = rng.integers(0, 2**32, num_perm, dtype=np.uint32)[:, None]
+    vocab: dict[str, int] = {}
+    signatures = np.empty((num_perm, len(texts)), dtype=np.uint32)
+    for start in range(0, len(texts), batch_size):
+        batch = [
+            bigram_hashes([vocab.setdefault(token, len(vocab)) for token in tokens])
+            for tokens in texts[start : start + batch_size]
+        ]
+        hashes = np.fromiter(
+            (h for shingles in batch for h in shingles), dtype=np.uint32
+        )
+        offsets = np.zeros(len(batch), dtype=np.int64)
+        offsets[1:] = np.cumsum([len(shingles) for shingles in batch])[:-1]
+        # (num_perm, shingles), so each reduceat runs over contiguous memory
+        permuted = a * hashes + b
+        permuted ^= permuted >> np.uint32(15)
+        signatures[:, start : start + len(batch)] = np.minimum.reduceat(
+            permuted, offsets, axis=1
+        )
+    return np.ascontiguousarray(signatures.T)
+
+
+def near_duplicate_leaders(
+    signatures: np.ndarray, *, bands: int = 16, threshold: float = 0.7
+) -> np.ndarray:
+    """
+    For each row, the first row of its near-duplicate group.
+
+    With `bands` bands of `rows = num_perm / bands` rows each, a pair with
+    Jaccard similarity s shares a bucket with probability 1 - (1 - s^rows)^bands.
+    """
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    parent = list(range(n))
+
+    def find(row: int) -> int:
+        while parent[row] != row:
+            parent[row] = parent[parent[row]]
+            row = parent[row]
+        return row
+
+    for band in range(bands):
+        band_signatures = np.ascontiguousarray(
+            signatures[:, band * rows : (band + 1) * rows]
+        )
+        keys = band_signatures.view(np.dtype((np.void, rows * 4))).ravel()
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        leaders = first[inverse]
+        candidates = np.flatnonzero(leaders != np.arange(n))
+        if len(candidates) == 0:
+            continue
+        similarity = (
+            signatures[candidates] == signatures[leaders[candidates]]
+        ).mean(axis=1)
+        candidates = candidates[similarity >= threshold]
+        for row, leader in zip(candidates.tolist(), leaders[candidates].tolist()):
+            row, leader = find(row), find(leader)
+            if row != leader:
+                # the earlier row leads the merged group
+                parent[max(row, leader)] = min(row, leader)
+    return np.array([find(row) for row in range(n)], dtype=np.int64)
+
+
+def dedupe_rows(
+    texts: Sequence[str],
+    *,
+    near: bool = True,
+    threshold: float = 0.7,
+    num_perm: int = 64,
+    bands: int = 16,
+) -> np.ndarray:
+    """
+    Sorted indices of the rows to keep: the first of each exact, then
+    near-duplicate group.
+
+    >>> dedupe_rows(
+    ...     [
+    ...         "Took iron daily. Energy came back in two weeks",
+    ...         "took iron daily, energy came back in two weeks!",
+    ...         "Magnesium before bed, fell asleep faster",
+    ...     ]
+    ... ).tolist()
+    [0, 2]
+    """
+    seen: set[tuple[str, ...]] = set()
+    unique_rows = []
+    unique_tokens = []
+    for row, text in enumerate(texts):
+        tokens = tokenize(text)
+        key = tuple(tokens)
+        if key not in seen:
+            seen.add(key)
+            unique_rows.append(row)
+            unique_tokens.append(tokens)
+    unique_rows = np.array(unique_rows, dtype=np.int64)
+    if not near or len(unique_rows) < 2:
+        return unique_rows
+    signatures = minhash_signatures(unique_tokens, num_perm=num_perm)
+    leaders = near_duplicate_leaders(signatures, bands=bands, threshold=threshold)
+    return unique_rows[leaders == np.arange(len(unique_rows))]
+
+
+def dedupe_experiences(experiences: Iterable[T], **kwargs) -> list[T]:
+    """
+    `experiences` without exact and near duplicates of their action and
+    outcomes, in their original order.
+    """
+    experiences = list(experiences)
+    rows = dedupe_rows([experience_text(e) for e in experiences], **kwargs)
+    return [experiences[row] for row in rows.tolist()]
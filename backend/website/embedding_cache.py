@@ -0,0 +1,260 @@
+"""
+Query embedding cache.
+
+Every /search embeds the question with text-embedding-3-large (3072 floats),
+which costs 100-400 ms on the critical path. Questions are keyed on their
+normalized text, so "Iron and pregnancy?" and "iron and pregnancy" share one
+embedding.
+
+- memory: LRU of float32 arrays
+- disk (optional): append-only float32 matrix, memory-mapped for reads, plus a
+  JSONL index of key -> row. Survives container restarts and is shared by the
+  uvicorn workers.
+
+Pre-warm from the curated questions (and a file of popular queries):
+
+    poetry run python -m website.embedding_cache --popular popular_queries.txt
+"""
+
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel
+
+from website.cache import normalize_question
+
+
+class EmbeddingCacheStats(BaseModel):
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+
+
+class EmbeddingStore:
+    """
+    vectors.f32 -- rows of `dim` float32, append only
+    keys.jsonl  -- {"key": ..., "row": ...} written after its row
+
+    The async paths `put` from a thread, the index is read under a lock.
+    """
+
+    def __init__(self, *, store_dir: Path, dim: int):
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.vectors_path = self.store_dir / "vectors.f32"
+        self.keys_path = self.store_dir / "keys.jsonl"
+        self.vectors_path.touch(exist_ok=True)
+        self.keys_path.touch(exist_ok=True)
+        self.rows: dict[str, int] = {}
+        self._keys_offset = 0
+        self._matrix: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+        self._refresh()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _refresh(self) -> None:
+        # pick up rows appended by other workers since we last looked
+        with self._lock:
+            if self.keys_path.stat().st_size == self._keys_offset:
+                return
+            with open(self.keys_path, "rb") as f:
+                f.seek(self._keys_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # half written line, read it next time
+                    record = json.loads(line)
+                    self.rows[record["key"]] = record["row"]
+                    self._keys_offset += len(line)
+            self._matrix = None
+
+    def _remap(self) -> np.memmap:
+        if self._matrix is None:
+            n_rows = self.vectors_path.stat().st_size // (self.dim * 4)
+            self._matrix = np.memmap(
+                self.vectors_path, dtype=np.float32, mode="r", shape=(n_rows, self.dim)
+            )
+        return self._matrix
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self.rows.get(key)
+        if row is None:
+            self._refresh()
+            row = self.rows.get(key)
+            if row is None:
+                return None
+        matrix = self._remap()
+        if row >= matrix.shape[0]:
+            self._matrix = None
+            matrix = self._remap()
+        return np.array(matrix[row])
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        if key in self.rows:
+            return
+        vector = np.asarray(vector, dtype=np.float32)
+        if vector.shape != (self.dim,):
+            raise ValueError(f"Expected a ({self.dim},) vector, got {vector.shape}")
+        with open(self.keys_path, "a") as keys_file:
+            fcntl.flock(keys_file, fcntl.LOCK_EX)
+            try:
+                with open(self.vectors_path, "ab") as vectors_file:
+                    row = vectors_file.tell() // (self.dim * 4)
+                    vectors_file.write(vector.tobytes())
+                    vectors_file.flush()
+                    os.fsync(vectors_file.fileno())
+                keys_file.write(json.dumps({"key": key, "row": row}) + "\n")
+                keys_file.flush()
+            finally:
+                fcntl.flock(keys_file, fcntl.LOCK_UN)
+        self._refresh()
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        *,
+        embeddings,
+        max_entries: int = 4096,
+        store_dir: Optional[Path] = None,
+        dim: int = 3072,
+    ):
+        """
+        `embeddings` is a langchain Embeddings object, e.g. `AzureOpenAIEmbeddings`.
+        """
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.stats = EmbeddingCacheStats()
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.store: Optional[EmbeddingStore] = None
+        if store_dir is not None:
+            self.store = EmbeddingStore(store_dir=store_dir, dim=dim)
+            logger.info(f"Embedding store {store_dir} has {len(self.store)} vectors")
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = normalize_question(text)
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            self.stats.memory_hits += 1
+            return vector
+        if self.store is not None:
+            vector = self.store.get(key)
+            if vector is not None:
+                self.stats.disk_hits += 1
+                self._remember(key, vector)
+                return vector
+        self.stats.misses += 1
+        return None
+
+    def put(self, text: str, vector: Iterable[float]) -> np.ndarray:
+        key = normalize_question(text)
+        array = np.asarray(vector, dtype=np.float32)
+        self._remember(key, array)
+        if self.store is not None:
+            self.store.put(key, array)
+        return array
+
+    async def aput(self, text: str, vector: Iterable[float]) -> np.ndarray:
+        """
+        `put`, the flock and fsync of the disk store in a thread.
+        """
+        key = normalize_question(text)
+        array = np.asarray(vector, dtype=np.float32)
+        self._remember(key, array)
+        if self.store is not None:
+            await asyncio.to_thread(self.store.put, key, array)
+        return array
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = self.get(text)
+        if vector is None:
+            vector = self.put(
+                text, self.embeddings.embed_query(normalize_question(text))
+            )
+        return vector.tolist()
+
+    async def aembed_query(self, text: str) -> list[float]:
+        vector = self.get(text)
+        if vector is None:
+            vector = await self.aput(
+                text, await self.embeddings.aembed_query(normalize_question(text))
+            )
+        return vector.tolist()
+
+    async def aembed_documents(self, texts: list[str]) -> np.ndarray:
+        """
+        (len(texts), dim) vectors of `texts`, the missing ones embedded in one
+        request.
+        """
+        vectors = [self.get(text) for text in texts]
+        missing = sorted(
+            {normalize_question(t) for t, v in zip(texts, vectors) if v is None}
+        )
+        if missing:
+            embedded = await self.embeddings.aembed_documents(missing)
+            fresh = {key: await self.aput(key, v) for key, v in zip(missing, embedded)}
+            vectors = [
+                fresh[normalize_question(t)] if v is None else v
+                for t, v in zip(texts, vectors)
+            ]
+        return np.stack(vectors) if vectors else np.empty((0, 0), np.float32)
+
+    def prewarm(self, texts: Iterable[str], batch_size: int = 64) -> int:
+        """
+        Embed every text not already cached, returns how many were embedded.
+        """
+        missing = []
+        seen = set()
+        for text in texts:
+            key = normalize_question(text)
+            if key and key not in seen and self.get(key) is None:
+                missing.append(key)
+            seen.add(key)
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start : start + batch_size]
+            for key, vector in zip(batch, self.embeddings.embed_documents(batch)):
+                self.put(key, vector)
+        logger.info(f"Pre-warmed {len(missing)} question embeddings")
+        return len(missing)
+
+
+def prewarm_texts(popular_queries_path: Optional[Path] = None) -> list[str]:
+    from website.questions import questions
+
+    texts = [question.question for question in questions]
+    if popular_queries_path is not None:
+        with open(popular_queries_path, "r") as f:
+            texts.extend(line.strip() for line in f if line.strip())
+    return texts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from website.search import embedding_cache
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--popular", type=Path, default=None)
+    args = parser.parse_args()
+    if embedding_cache.store is None:
+        raise SystemExit("Set EMBEDDING_CACHE_DIR so the pre-warmed vectors persist")
+    embedding_cache.prewarm(prewarm_texts(args.popular))
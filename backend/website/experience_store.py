@@ -0,0 +1,396 @@
+"""
+Columnar on-disk store of the `Base` models that hold experiences.
+
+`TopicExperiences`, `SubmissionExperiences`, `CommentExperiences` and
+`StudyExperiences` used to be one pretty-printed JSON file each. Loading
+"Biohacking" parsed the whole file, embeddings included, into pydantic
+objects even when the caller only reads two fields of each experience.
+`Base.save` now writes a directory instead:
+
+    {name}.{ClassName}.store/
+        meta.json                 -- format, rows, the model's other fields
+        columns/{field}.json      -- one JSON list per `Experience` field
+        columns/{field}.npy       -- (rows, dim) float32 of per-row vectors,
+                                     NaN rows for None
+        {field}.npy               -- (rows, dim) float32 of the model's
+                                     `*_embeddings` fields
+
+- projection: `Base.load(name=..., columns=[...])` parses only those column
+  files. The instance remembers it, and saving it raises rather than write
+  the other columns back as None.
+- lazy: columns are read on first use, and the embedding matrices are
+  memory-mapped, so a load that never touches them reads none of their pages.
+  `Base.load` assigns the memory-mapped arrays to the `*_embeddings` fields;
+  they index like the `list[list[float]]` they replace.
+
+A save writes a new directory next to the old one and swaps them, so a
+reader never sees half a store. `Base.load` falls back to the legacy JSON
+file when there is no store yet.
+
+`StoreWriter` streams rows into a new store, e.g. the experiences of
+`website.fanout` as the LLM extracts them.
+
+Long enrichment runs (the `TopicExperiences` scoring passes) don't save the
+whole store per batch. They append each batch of field updates to a
+`Journal`, fsynced, and save once at the end. `Base.load` replays the journal
+of a run that crashed, and `Base.save` compacts it away.
+
+    poetry run python -m website.experience_store Biohacking Pregnancy Sleep
+
+converts the legacy JSON `TopicExperiences` files.
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import os
+import shutil
+import typing
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel, TypeAdapter, create_model
+
+format_version = 1
+row_field = "experiences"
+# per-row vectors, stored as a float32 matrix rather than JSON lists
+vector_columns = {"action_embedding"}
+
+
+def embedding_fields(cls: type[BaseModel]) -> list[str]:
+    return [name for name in cls.model_fields if name.endswith("_embeddings")]
+
+
+def row_type(cls: type[BaseModel]) -> type[BaseModel]:
+    """
+    The item type of `cls.experiences`, e.g. `Experience` for
+    `Optional[list[Experience]]`.
+    """
+    annotation = cls.model_fields[row_field].annotation
+    while typing.get_origin(annotation) is not None:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        annotation = args[0]
+    return annotation
+
+
+@functools.cache
+def rows_adapter(cls: type[BaseModel], columns: frozenset[str]) -> TypeAdapter:
+    """
+    Validator of a list of `cls` rows holding only `columns`. The required
+    fields left out become None in a subclass of `cls`, so the rows keep
+    its methods.
+    """
+    missing = {
+        name: (Optional[field.annotation], None)
+        for name, field in cls.model_fields.items()
+        if name not in columns and field.is_required()
+    }
+    if missing:
+        cls = create_model(f"{cls.__name__}Projection", __base__=cls, **missing)
+    return TypeAdapter(list[cls])
+
+
+def save_store(model: BaseModel, path: Path) -> None:
+    """
+    Write `model` as a store directory at `path`, replacing any previous one.
+    """
+    projection = getattr(model, "_projection", None)
+    if projection is not None:
+        raise ValueError(
+            f"{type(model).__name__} was loaded with only the columns "
+            f"{projection}, saving it would drop the others"
+        )
+    path = Path(path)
+    cls = type(model)
+    rows: Optional[list] = getattr(model, row_field)
+    matrices = embedding_fields(cls)
+    tmp_path = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    (tmp_path / "columns").mkdir(parents=True)
+
+    columns: dict[str, str] = {}
+    if rows is not None:
+        for field in row_type(cls).model_fields:
+            values = [getattr(row, field) for row in rows]
+            if field in vector_columns:
+                present = [value for value in values if value is not None]
+                if not present:
+                    continue
+                matrix = np.full((len(values), len(present[0])), np.nan, np.float32)
+                for index, value in enumerate(values):
+                    if value is not None:
+                        matrix[index] = value
+                np.save(tmp_path / "columns" / f"{field}.npy", matrix)
+                columns[field] = "npy"
+            else:
+                with open(tmp_path / "columns" / f"{field}.json", "w") as f:
+                    json.dump(values, f)
+                columns[field] = "json"
+
+    embeddings: dict[str, list[int]] = {}
+    for field in matrices:
+        value = getattr(model, field)
+        if value is None:
+            continue
+        matrix = np.asarray(value, dtype=np.float32)
+        np.save(tmp_path / f"{field}.npy", matrix)
+        embeddings[field] = list(matrix.shape)
+
+    meta = {
+        "format": format_version,
+        "class": cls.__name__,
+        "rows": None if rows is None else len(rows),
+        "columns": columns,
+        "embeddings": embeddings,
+        "fields": model.model_dump(mode="json", exclude={row_field, *matrices}),
+    }
+    with open(tmp_path / "meta.json", "w") as f:
+        json.dump(meta, f, indent=2)
+    swap_in(tmp_path, path)
+
+
+def swap_in(tmp_path: Path, path: Path) -> None:
+    old_path = path.with_name(path.name + ".old")
+    shutil.rmtree(old_path, ignore_errors=True)
+    if path.exists():
+        path.rename(old_path)
+    tmp_path.rename(path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+class StoreWriter:
+    """
+    Writes a store one experience at a time, for producers that shouldn't
+    hold all the rows in memory. Each JSON column is written as a list as
+    the rows come in; `close` adds meta.json and swaps the new directory in
+    like `save_store`. Leaving the `with` block without `close`, e.g. on an
+    exception, drops it.
+
+    >>> with StoreWriter(path, TopicExperiences) as writer:  # doctest: +SKIP
+    ...     writer.append(experience)
+    ...     writer.close(title="Sleep", subreddit=[])
+    """
+
+    def __init__(self, path: Path, cls: type[BaseModel]):
+        self.path = Path(path)
+        self.cls = cls
+        self.rows = 0
+        self.closed = False
+        self.tmp_path = self.path.with_name(self.path.name + ".tmp")
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        (self.tmp_path / "columns").mkdir(parents=True)
+        fields = row_type(cls).model_fields
+        self.files = {
+            field: open(self.tmp_path / "columns" / f"{field}.json", "w")
+            for field in fields
+            if field not in vector_columns
+        }
+        # sparse, the extraction never sets them
+        self.vectors: dict[str, dict[int, list[float]]] = {
+            field: {} for field in fields if field in vector_columns
+        }
+        for f in self.files.values():
+            f.write("[")
+
+    def append(self, row: BaseModel) -> None:
+        separator = ", " if self.rows else ""
+        for field, f in self.files.items():
+            f.write(separator + json.dumps(getattr(row, field)))
+        for field, vectors in self.vectors.items():
+            value = getattr(row, field)
+            if value is not None:
+                vectors[self.rows] = value
+        self.rows += 1
+
+    def close(self, **fields: Any) -> None:
+        """
+        `fields` are the model's other fields, e.g. `title`.
+        """
+        for f in self.files.values():
+            f.write("]")
+            f.close()
+        columns = {field: "json" for field in self.files}
+        for field, vectors in self.vectors.items():
+            if not vectors:
+                continue
+            dim = len(next(iter(vectors.values())))
+            matrix = np.full((self.rows, dim), np.nan, np.float32)
+            for index, value in vectors.items():
+                matrix[index] = value
+            np.save(self.tmp_path / "columns" / f"{field}.npy", matrix)
+            columns[field] = "npy"
+        model = self.cls.model_validate({**fields, row_field: []})
+        meta = {
+            "format": format_version,
+            "class": self.cls.__name__,
+            "rows": self.rows,
+            "columns": columns,
+            "embeddings": {},
+            "fields": model.model_dump(
+                mode="json", exclude={row_field, *embedding_fields(self.cls)}
+            ),
+        }
+        with open(self.tmp_path / "meta.json", "w") as f:
+            json.dump(meta, f, indent=2)
+        swap_in(self.tmp_path, self.path)
+        self.closed = True
+
+    def __enter__(self) -> StoreWriter:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        for f in self.files.values():
+            f.close()
+        if not self.closed:
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+class ExperienceStore:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path / "meta.json") as f:
+            self.meta: dict[str, Any] = json.load(f)
+        if self.meta["format"] != format_version:
+            raise ValueError(f"{self.path} is format {self.meta['format']}")
+        self._columns: dict[str, list] = {}
+
+    def __len__(self) -> int:
+        return self.meta["rows"] or 0
+
+    @property
+    def columns(self) -> list[str]:
+        return list(self.meta["columns"])
+
+    def column(self, field: str) -> list:
+        """
+        The values of one `Experience` field, in row order.
+        """
+        if field not in self._columns:
+            kind = self.meta["columns"][field]
+            if kind == "npy":
+                matrix = np.load(self.path / "columns" / f"{field}.npy")
+                self._columns[field] = [
+                    None if np.isnan(row[0]) else row.tolist() for row in matrix
+                ]
+            else:
+                with open(self.path / "columns" / f"{field}.json") as f:
+                    self._columns[field] = json.load(f)
+        return self._columns[field]
+
+    def embeddings(self, field: str) -> Optional[np.ndarray]:
+        """
+        Memory-mapped (rows, dim) matrix of a `*_embeddings` field.
+        """
+        if field not in self.meta["embeddings"]:
+            return None
+        return np.load(self.path / f"{field}.npy", mmap_mode="r")
+
+    def experiences(
+        self, cls: type[BaseModel], columns: Optional[Sequence[str]] = None
+    ) -> Optional[list]:
+        """
+        The rows as `cls` objects, only with `columns` when given; the other
+        fields keep their defaults.
+        """
+        if self.meta["rows"] is None:
+            return None
+        if columns is None:
+            names = self.columns
+        else:
+            names = [name for name in columns if name in self.meta["columns"]]
+        values = [self.column(name) for name in names]
+        if names:
+            rows = [dict(zip(names, row)) for row in zip(*values)]
+        else:
+            rows = [{} for _ in range(len(self))]
+        return rows_adapter(cls, frozenset(names)).validate_python(rows)
+
+    def load(
+        self, cls: type[BaseModel], columns: Optional[Sequence[str]] = None
+    ) -> BaseModel:
+        instance = cls(
+            **self.meta["fields"],
+            **{row_field: self.experiences(row_type(cls), columns)},
+        )
+        for field in embedding_fields(cls):
+            # not validated: a memory-mapped array where a list of lists was
+            matrix = self.embeddings(field)
+            if matrix is not None:
+                setattr(instance, field, matrix)
+        if columns is not None:
+            # `save_store` refuses to write it back
+            instance._projection = list(columns)
+        return instance
+
+
+class Journal:
+    """
+    Append-only JSONL of per-experience field updates since the last save,
+    one `{"row": ..., "permalink": ..., field: value}` line per experience.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def append(
+        self, experiences: Sequence, rows: Sequence[int], fields: Sequence[str]
+    ) -> None:
+        lines = "".join(
+            json.dumps(
+                {
+                    "row": row,
+                    "permalink": experiences[row].permalink,
+                    **{field: getattr(experiences[row], field) for field in fields},
+                }
+            )
+            + "\n"
+            for row in rows
+        )
+        with open(self.path, "a") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def replay(self, experiences: Optional[list]) -> int:
+        """
+        Apply the journaled updates to `experiences`, returns how many.
+        """
+        if experiences is None or not self.path.exists():
+            return 0
+        count = 0
+        with open(self.path) as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # the batch being written when the run crashed
+                update = json.loads(line)
+                row = update.pop("row")
+                permalink = update.pop("permalink")
+                if row >= len(experiences) or experiences[row].permalink not in (
+                    permalink,
+                    None,  # projected without the permalink column
+                ):
+                    logger.warning(f"{self.path}: row {row} is not {permalink}")
+                    continue
+                for field, value in update.items():
+                    setattr(experiences[row], field, value)
+                count += 1
+        logger.info(f"Replayed {count} updates from {self.path}")
+        return count
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from website.biohacks import TopicExperiences
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("topics", nargs="+")
+    args = parser.parse_args()
+    for topic in args.topics:
+        TopicExperiences.load(name=topic, legacy=True).save()
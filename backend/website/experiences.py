@@ -335,6 +335,42 @@ class StudyChain(Chain):
         return input_text
 
 
+def make_experience(inp: Any, response: Any) -> Optional[Experience]:
+    """
+    The experience of one extraction response, None when the LLM failed or
+    left out a part of it.
+    """
+    if isinstance(response, Exception):
+        return None
+    elif response.biohack is None:
+        return None
+    elif response.outcomes is None:
+        return None
+    elif response.biohack.action is None:
+        return None
+    elif response.biohack.health_disorder is None:
+        return None
+    elif response.takeaway is None:
+        return None
+    if hasattr(inp, "doi"):
+        ID = inp.doi
+    elif hasattr(inp, "permalink"):
+        ID = inp.permalink
+    else:
+        raise ValueError("Input object must have a permalink or doi attribute")
+    # mechanism=response.mechanism,
+    # personal_context=response.personal_context,
+    return Experience(
+        permalink=ID,
+        action=response.biohack.action,
+        health_disorder=response.biohack.health_disorder,
+        takeaway=response.takeaway,
+        biohack_type=response.biohack_type,
+        clinical_trial_study=response.clinical_trial_study,
+        outcomes=response.outcomes,
+    )
+
+
 class Experiences(Base, metaclass=ABCMeta):
     # subreddit: str
     experiences: Optional[list[Experience]] = None
@@ -370,39 +406,8 @@ class Experiences(Base, metaclass=ABCMeta):
         )
         experiences = []
         for inp, response in zip(input_objects, responses):
-            if isinstance(response, Exception):
-                continue
-            elif response.biohack is None:
-                continue
-            elif response.outcomes is None:
-                continue
-            elif response.biohack.action is None:
-                continue
-            elif response.biohack.health_disorder is None:
-                continue
-            elif response.takeaway is None:
-                continue
-            else:
-                if hasattr(inp, "doi"):
-                    ID = inp.doi
-                elif hasattr(inp, "permalink"):
-                    ID = inp.permalink
-                else:
-                    raise ValueError(
-                        "Input object must have a permalink or doi attribute"
-                    )
-
-                experience = Experience(
-                    permalink=ID,
-                    action=response.biohack.action,
-                    health_disorder=response.biohack.health_disorder,
-                    takeaway=response.takeaway,
-                    biohack_type=response.biohack_type,
-                    clinical_trial_study=response.clinical_trial_study,
-                    outcomes=response.outcomes,
-                )
-                # mechanism=response.mechanism,
-                # personal_context=response.personal_context,
+            experience = make_experience(inp, response)
+            if experience is not None:
                 experiences.append(experience)
         self.experiences = experiences
         self.save()
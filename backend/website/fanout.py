@@ -0,0 +1,274 @@
+"""
+Concurrent experience extraction for the subreddits of a topic.
+
+`experiences.main` awaits `CommentExperiences.from_subreddit` and
+`SubmissionExperiences.from_subreddit` one subreddit at a time, and
+`TopicExperiences.from_all` then loads the saved files one after another
+into one list. `fan_out` instead
+
+- runs `max_subreddits` subreddit jobs (comments or submissions of one
+  subreddit) at a time
+- shares one budget of `max_inflight` LLM calls between them, on top of the
+  per-deployment limiter of `website.limiter`, so a large subreddit doesn't
+  starve the others and many small ones don't flood the deployment
+- writes a job's experiences to the topic store (`StoreWriter`) once the
+  job has saved them to the subreddit's own file, so only the running jobs'
+  experiences are in memory
+- logs the progress of the running jobs every `report_every` seconds and
+  returns the inputs, experiences, errors, LLM usage and throughput of each
+
+The topic store gets every extracted experience, and the topic's saved
+study experiences first. It is swapped in when all jobs succeeded. When a
+job fails the new store is dropped and the old one, and its journal, stay:
+the failed subreddit's experiences would be missing from it. The jobs that
+succeeded have saved their subreddit files anyway.
+
+    poetry run python -m website.fanout Sleep --size 10 --max-subreddits 8
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Literal, Optional, Union
+
+from loguru import logger
+from pydantic import BaseModel
+
+from website.biohacks import TopicExperiences
+from website.chain import LLMUsage, llm_usage
+from website.experience_store import Journal, StoreWriter
+from website.experiences import (CommentChain, CommentExperiences,
+                                 StudyExperiences, SubmissionChain,
+                                 SubmissionExperiences, make_experience)
+
+Source = Literal["comments", "submissions"]
+sources = {
+    "comments": (CommentExperiences, CommentChain),
+    "submissions": (SubmissionExperiences, SubmissionChain),
+}
+
+
+class SubredditProgress(BaseModel):
+    subreddit: str
+    source: Source
+    inputs: int = 0
+    done: int = 0
+    experiences: int = 0
+    errors: int = 0
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    usage: LLMUsage = LLMUsage()
+    error: Optional[str] = None
+
+    @property
+    def seconds(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        """
+        Inputs done per second.
+        """
+        return self.done / self.seconds if self.seconds > 0 else 0.0
+
+
+async def extract(
+    progress: SubredditProgress,
+    *,
+    writer: StoreWriter,
+    semaphore: asyncio.Semaphore,
+    size: Union[int, None],
+    llm_name: str,
+    max_retries: int,
+    max_tokens: int,
+    timeout: int,
+) -> None:
+    cls, chain = sources[progress.source]
+    # this task's calls, the tasks of iter_predict share the context
+    llm_usage.set(progress.usage)
+    instance = await asyncio.to_thread(
+        lambda: cls(subreddit=cls.subreddit_metadata(progress.subreddit))
+    )
+    input_objects = await asyncio.to_thread(
+        instance.get_relevant_input_objects, size=size
+    )
+    progress.inputs = len(input_objects)
+    progress.started = time.monotonic()
+    experiences = {}
+    async for index, response in chain.iter_predict(
+        size=1,  # unused, the shared semaphore limits the calls
+        semaphore=semaphore,
+        input_objects=input_objects,
+        llm_name=llm_name,
+        max_retries=max_retries,
+        max_tokens=max_tokens,
+        timeout=timeout,
+        batch=True,
+    ):
+        progress.done += 1
+        progress.errors += isinstance(response, Exception)
+        experience = make_experience(input_objects[index], response)
+        if experience is not None:
+            experiences[index] = experience
+            progress.experiences += 1
+    # the subreddit's own file keeps the input order
+    instance.experiences = [experiences[index] for index in sorted(experiences)]
+    await asyncio.to_thread(instance.save)
+    # only now, a job failing above leaves nothing in the topic store
+    for experience in instance.experiences:
+        writer.append(experience)
+    progress.finished = time.monotonic()
+
+
+def log_progress(progress: list[SubredditProgress]) -> None:
+    running = [p for p in progress if p.started is not None and p.finished is None]
+    finished = sum(p.finished is not None or p.error is not None for p in progress)
+    done = sum(p.done for p in progress)
+    logger.info(f"{finished}/{len(progress)} subreddit jobs done, {done} calls")
+    for p in running:
+        logger.info(
+            f"{p.subreddit} {p.source}: {p.done}/{p.inputs}, "
+            f"{p.experiences} experiences, {p.throughput:.1f}/s"
+        )
+
+
+async def fan_out(
+    *,
+    topic: str,
+    subreddit_names: list[str],
+    size: Union[int, None],
+    llm_name: str,
+    max_retries: int,
+    max_tokens: int,
+    timeout: int,
+    max_subreddits: int = 4,
+    max_inflight: int = 200,
+    studies: bool = True,
+    report_every: float = 30.0,
+) -> list[SubredditProgress]:
+    subreddits = [name.split("/")[-1] for name in subreddit_names]
+    progress = [
+        SubredditProgress(subreddit=subreddit, source=source)
+        for subreddit in subreddits
+        for source in sources
+    ]
+    semaphore = asyncio.Semaphore(max_inflight)
+    slots = asyncio.Semaphore(max_subreddits)
+
+    async def run(p: SubredditProgress) -> None:
+        async with slots:
+            try:
+                await extract(
+                    p,
+                    writer=writer,
+                    semaphore=semaphore,
+                    size=size,
+                    llm_name=llm_name,
+                    max_retries=max_retries,
+                    max_tokens=max_tokens,
+                    timeout=timeout,
+                )
+            except Exception as e:
+                logger.exception(f"{p.subreddit} {p.source} failed")
+                p.error = repr(e)
+
+    async def report() -> None:
+        while True:
+            await asyncio.sleep(report_every)
+            log_progress(progress)
+
+    with StoreWriter(TopicExperiences.store_path(topic), TopicExperiences) as writer:
+        if studies and topic in StudyExperiences.get_stored_file_names():
+            s = await asyncio.to_thread(StudyExperiences.load, name=topic)
+            for experience in s.experiences or []:
+                writer.append(experience)
+        reporter = asyncio.create_task(report())
+        try:
+            await asyncio.gather(*(run(p) for p in progress))
+        finally:
+            reporter.cancel()
+        failed = [f"{p.subreddit} {p.source}" for p in progress if p.error]
+        if failed:
+            # leaving the block without `close` drops the new store
+            logger.error(
+                f"Kept the old {topic} store, {len(failed)} jobs failed: "
+                + ", ".join(failed)
+            )
+            return progress
+        metadatum = await asyncio.to_thread(
+            lambda: [TopicExperiences.subreddit_metadata(s) for s in subreddits]
+        )
+        writer.close(title=topic, subreddit=metadatum)
+    # updates of the replaced store's rows
+    Journal(TopicExperiences.journal_path(topic)).clear()
+    logger.info(f"Saved {writer.rows} experiences to {writer.path}")
+    return progress
+
+
+def report(progress: list[SubredditProgress]):
+    from rich.table import Table
+
+    table = Table(title="Experience extraction")
+    for column in [
+        "Subreddit",
+        "Source",
+        "Inputs",
+        "Experiences",
+        "Errors",
+        "LLM calls",
+        "Cached",
+        "Seconds",
+        "Inputs/s",
+        "Cost ($)",
+    ]:
+        table.add_column(column)
+    for p in progress:
+        table.add_row(
+            p.subreddit,
+            p.source,
+            str(p.inputs),
+            str(p.experiences),
+            str(p.errors) if p.error is None else p.error,
+            str(p.usage.calls),
+            str(p.usage.cached),
+            f"{p.seconds:.1f}",
+            f"{p.throughput:.1f}",
+            f"{p.usage.cost:.2f}",
+        )
+    return table
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from rich import print
+
+    from website.subreddit import topic_subreddits
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("topic", choices=list(topic_subreddits))
+    parser.add_argument("--size", type=int, default=None, help="inputs per job")
+    parser.add_argument("--max-subreddits", type=int, default=4)
+    parser.add_argument("--max-inflight", type=int, default=200)
+    parser.add_argument("--llm-name", default="gpt-4o-mini")
+    parser.add_argument("--no-studies", action="store_true")
+    args = parser.parse_args()
+
+    progress = asyncio.run(
+        fan_out(
+            topic=args.topic,
+            subreddit_names=topic_subreddits[args.topic],
+            size=args.size,
+            llm_name=args.llm_name,
+            max_retries=0,
+            max_tokens=400,
+            timeout=5,
+            max_subreddits=args.max_subreddits,
+            max_inflight=args.max_inflight,
+            studies=not args.no_studies,
+        )
+    )
+    print(report(progress))
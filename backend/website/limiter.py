@@ -0,0 +1,255 @@
+"""
+Per-deployment rate limiting for Azure OpenAI calls.
+
+`Chain` used to fire `size` concurrent calls (300 for /search, 50 in the ETL)
+regardless of the deployment quota, and found out about it through 429s,
+timeouts and "too many open files". Each deployment in `chain.endpoints` now
+gets a limiter combining
+
+- an AIMD concurrency window: +1/window on success, halved on a 429 or a
+  timeout (at most once per `cooldown` seconds)
+- token buckets for the requests and tokens per minute quota, charged with the
+  estimated prompt tokens plus `max_tokens`
+
+Batch callers (the ETL) only get `batch_share` of the window and can't spend
+the buckets below `1 - batch_share` of their size, so live searches on the
+same deployment are never starved.
+
+Limits are per process: the ETL and the web workers each back off on their
+own 429s. They are per deployment, so a 429 from one region doesn't shrink
+the window of its backups (see website/router.py).
+
+A call cancelled for missing its deadline counts as a throttle when the
+caller marks its `CallDeadline` missed first, see `Chain.iter_predict`. The
+deadline runs from the moment the call got its slot: a call that spent its
+deadline queued behind the window says nothing about the deployment, and
+halving the window for it would only queue the next calls longer.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Literal, Optional
+
+from loguru import logger
+from openai import APITimeoutError, RateLimitError
+from pydantic import BaseModel
+
+Outcome = Literal["success", "throttled", "error"]
+
+class CallDeadline:
+    """
+    `started` is the loop time the call got its slot, `missed` is set by the
+    caller before cancelling a call that ran out its deadline from there.
+    Other cancellations (a hedge that lost, a caller that stopped early, a
+    call still queued) say nothing about the load.
+    """
+
+    def __init__(self):
+        self.started: Optional[float] = None
+        self.missed = asyncio.Event()
+
+
+current_deadline: ContextVar[Optional[CallDeadline]] = ContextVar(
+    "current_deadline", default=None
+)
+
+
+class Quota(BaseModel):
+    rpm: int
+    tpm: int
+
+
+# Azure quota of each deployment, see "Quotas" in Azure AI Foundry
+quotas = {
+    "gpt-4o-mini": Quota(rpm=4_000, tpm=400_000),
+    "gpt-4o": Quota(rpm=900, tpm=150_000),
+    "o3-mini": Quota(rpm=500, tpm=500_000),
+    "o1-mini": Quota(rpm=100, tpm=100_000),
+    "o1-preview": Quota(rpm=100, tpm=100_000),
+}
+default_quota = Quota(rpm=600, tpm=100_000)
+
+
+def estimate_tokens(prompt: str, max_tokens: Optional[int]) -> int:
+    """
+    ~4 characters per token for the prompt plus the completion budget.
+
+    >>> estimate_tokens("x" * 400, 100)
+    200
+    """
+    return len(prompt) // 4 + (max_tokens or 0)
+
+
+def is_throttle(e: BaseException) -> bool:
+    """
+    429s and timeouts, also when instructor wrapped them.
+    """
+    while e is not None:
+        if isinstance(e, (RateLimitError, APITimeoutError, asyncio.TimeoutError)):
+            return True
+        e = e.__cause__  # type: ignore
+    return False
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, reserve: float = 0) -> float:
+        """
+        Seconds until `amount` can be taken leaving `reserve` in the bucket.
+        """
+        self.refill()
+        needed = min(amount + reserve, self.capacity) - self.tokens
+        return max(0.0, needed / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+
+class LimiterStats(BaseModel):
+    window: float
+    inflight: int
+    successes: int = 0
+    throttles: int = 0
+    errors: int = 0
+    waited_seconds: float = 0.0
+
+
+class DeploymentLimiter:
+    def __init__(
+        self,
+        *,
+        name: str,
+        quota: Quota,
+        max_concurrency: int = 300,
+        initial_window: float = 32,
+        batch_share: float = 0.7,
+        cooldown: float = 1.0,
+    ):
+        self.name = name
+        self.quota = quota
+        self.max_concurrency = max_concurrency
+        self.batch_share = batch_share
+        self.cooldown = cooldown
+        self.window = min(initial_window, max_concurrency)
+        self.inflight = 0
+        self.requests = TokenBucket(quota.rpm)
+        self.tokens = TokenBucket(quota.tpm)
+        self.stats = LimiterStats(window=self.window, inflight=0)
+        self._last_decrease = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def condition(self) -> asyncio.Condition:
+        # scripts call asyncio.run more than once, a condition belongs to one loop
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+            self.inflight = 0
+        return self._condition
+
+    def limit(self, batch: bool) -> int:
+        window = self.window * self.batch_share if batch else self.window
+        return max(1, math.floor(window))
+
+    async def acquire(self, *, tokens: int, batch: bool) -> None:
+        condition = self.condition()
+        share = 1 - self.batch_share if batch else 0
+        start = time.monotonic()
+        while True:
+            async with condition:
+                await condition.wait_for(lambda: self.inflight < self.limit(batch))
+                wait = max(
+                    self.requests.wait_time(1, reserve=self.requests.capacity * share),
+                    self.tokens.wait_time(tokens, reserve=self.tokens.capacity * share),
+                )
+                if wait == 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    self.inflight += 1
+                    break
+            await asyncio.sleep(wait)
+        self.stats.waited_seconds += time.monotonic() - start
+
+    async def release(self, outcome: Outcome) -> None:
+        condition = self.condition()
+        async with condition:
+            self.inflight -= 1
+            if outcome == "success":
+                self.stats.successes += 1
+                self.window = min(self.max_concurrency, self.window + 1 / self.window)
+            elif outcome == "throttled":
+                self.stats.throttles += 1
+                now = time.monotonic()
+                if now - self._last_decrease > self.cooldown:
+                    self.window = max(1.0, self.window / 2)
+                    self._last_decrease = now
+                    logger.warning(
+                        f"{self.name} throttled, window down to {self.window:.0f}"
+                    )
+            else:
+                self.stats.errors += 1
+            condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self, *, tokens: int, batch: bool = False) -> AsyncIterator[None]:
+        await self.acquire(tokens=tokens, batch=batch)
+        deadline = current_deadline.get()
+        if deadline is not None and deadline.started is None:
+            deadline.started = asyncio.get_running_loop().time()
+        outcome: Outcome = "error"
+        try:
+            yield
+            outcome = "success"
+        except BaseException as e:
+            if is_throttle(e) or (
+                isinstance(e, asyncio.CancelledError)
+                and deadline is not None
+                and deadline.missed.is_set()
+            ):
+                outcome = "throttled"
+            raise
+        finally:
+            # don't let a cancelled caller leak its slot
+            await asyncio.shield(self.release(outcome))
+
+    def snapshot(self) -> LimiterStats:
+        self.stats.window = self.window
+        self.stats.inflight = self.inflight
+        return self.stats
+
+
+limiters: dict[tuple[str, Optional[str]], DeploymentLimiter] = {}
+
+
+def get_limiter(llm_name: str, endpoint: Optional[str] = None) -> DeploymentLimiter:
+    """
+    The limiter of one deployment, each regional deployment has its own quota.
+    """
+    limiter = limiters.get((llm_name, endpoint))
+    if limiter is None:
+        name = llm_name if endpoint is None else f"{llm_name} {endpoint}"
+        limiter = DeploymentLimiter(name=name, quota=quotas.get(llm_name, default_quota))
+        limiters[(llm_name, endpoint)] = limiter
+    return limiter
+
+
+def limiter_stats() -> dict[str, dict]:
+    return {
+        limiter.name: limiter.snapshot().model_dump() for limiter in limiters.values()
+    }
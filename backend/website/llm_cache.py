@@ -0,0 +1,216 @@
+"""
+Content-addressed cache of validated LLM responses.
+
+Re-running the ETL after a crash, or the same question on /search, used to pay
+again for prompts we already had answers to. `Chain.coroutine` and
+`Chain.predict` now look up
+
+    sha256(chain name, model, output schema, prompt)
+
+in a SQLite file before calling the API and store the validated
+`output_schema` JSON after. SQLite is in the standard library, handles the
+uvicorn workers and the ETL writing to the same file (WAL mode), and needs
+no server.
+
+- ttl: entries older than this are misses
+- max_bytes: the least recently used entries go once the values add up to more
+
+Writes can wait on another process's lock, so they stay off the event loop:
+`Chain.coroutine` calls `set` in a thread, and hits keep their access time in
+memory until the next `set` or eviction writes it. Only a hit that finds
+`flush_every` of them pending writes them itself.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional, Type
+
+from loguru import logger
+from pydantic import BaseModel, ValidationError
+
+from website import settings
+
+
+class LLMCacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    evictions: int = 0
+    errors: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class LLMCache:
+    def __init__(
+        self,
+        path: Path,
+        *,
+        ttl: float = 30 * 24 * 3600,
+        max_bytes: int = 1024 * 1024 * 1024,
+        evict_every: int = 100,
+        flush_every: int = 1000,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self.flush_every = flush_every
+        # key -> access time of the hits not yet written
+        self._accessed: dict[str, float] = {}
+        self.stats = LLMCacheStats()
+        self._schema_hashes: dict[Type[BaseModel], str] = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                chain TEXT NOT NULL,
+                model TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self._db.commit()
+
+    def schema_hash(self, output_schema: Type[BaseModel]) -> str:
+        # the schema includes the field descriptions, i.e. part of the prompt
+        schema_hash = self._schema_hashes.get(output_schema)
+        if schema_hash is None:
+            schema = json.dumps(output_schema.model_json_schema(), sort_keys=True)
+            schema_hash = hashlib.sha256(schema.encode("utf-8")).hexdigest()
+            self._schema_hashes[output_schema] = schema_hash
+        return schema_hash
+
+    def make_key(
+        self, *, chain: str, llm_name: str, output_schema: Type[BaseModel], prompt: str
+    ) -> str:
+        content = json.dumps(
+            [chain, llm_name, self.schema_hash(output_schema), prompt]
+        )
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, output_schema: Type[BaseModel]) -> Optional[Any]:
+        now = time.time()
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT value, created FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] > self.ttl:
+                    row = None  # expired, `evict` deletes it
+                if row is not None:
+                    self._accessed[key] = now
+                    if len(self._accessed) >= self.flush_every:
+                        self.flush()
+                        self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache read failed: {e}")
+            self.stats.errors += 1
+            return None
+        if row is None:
+            self.stats.misses += 1
+            return None
+        try:
+            result = output_schema.model_validate_json(row[0])
+        except ValidationError:
+            # the schema changed shape but not its JSON schema hash, e.g. a validator
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return result
+
+    def set(self, key: str, result: BaseModel, *, chain: str, llm_name: str) -> None:
+        value = result.model_dump_json()
+        now = time.time()
+        try:
+            with self._lock:
+                self._accessed.pop(key, None)
+                self.flush()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, chain, llm_name, value, len(value), now, now),
+                )
+                self._db.commit()
+                self.stats.writes += 1
+                if self.stats.writes % self.evict_every == 0:
+                    self.evict()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache write failed: {e}")
+            self.stats.errors += 1
+
+    def flush(self) -> None:
+        """
+        Write the pending access times, in the caller's transaction. Call with
+        the lock held.
+        """
+        if self._accessed:
+            self._db.executemany(
+                "UPDATE responses SET accessed = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._accessed.items()],
+            )
+            self._accessed.clear()
+
+    def evict(self) -> None:
+        """
+        Drop expired entries, then the least recently used ones down to 90%
+        of `max_bytes`. Call with the lock held.
+        """
+        self.flush()
+        cursor = self._db.execute(
+            "DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)
+        )
+        self.stats.evictions += cursor.rowcount
+        (total,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total > self.max_bytes:
+            excess = total - int(0.9 * self.max_bytes)
+            keys = []
+            for key, size in self._db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed"
+            ):
+                keys.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            self._db.executemany("DELETE FROM responses WHERE key = ?", keys)
+            self.stats.evictions += len(keys)
+            logger.info(f"LLM cache evicted {len(keys)} least recently used")
+        self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()
+        return count
+
+    def summary(self) -> dict:
+        return {**self.stats.model_dump(), "hit_rate": self.stats.hit_rate}
+
+
+llm_cache: Optional[LLMCache] = None
+if settings.llm_cache_path is not None:
+    llm_cache = LLMCache(
+        settings.llm_cache_path,
+        ttl=settings.llm_cache_ttl,
+        max_bytes=settings.llm_cache_max_mb * 1024 * 1024,
+    )
@@ -0,0 +1,201 @@
+"""
+Process-wide Azure OpenAI clients.
+
+Building an `AsyncAzureOpenAI` per call means a new connection pool per call,
+so every search paid for fresh TCP + TLS handshakes to the same endpoints.
+Here clients are built once per (endpoint, deployment, api_version, sync) and
+all of them share one httpx connection pool (per event loop for the async
+ones, since pooled connections belong to the loop that opened them).
+
+The pool is traced with the httpx `trace` extension, `pool_stats()` has the
+requests, new connections and TLS handshakes per host.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import weakref
+from typing import Any, Optional, Union
+
+import httpx
+import instructor
+import logfire
+from loguru import logger
+from openai import AsyncAzureOpenAI, AzureOpenAI
+from pydantic import BaseModel, Field, computed_field
+
+from website import settings
+
+
+class HostStats(BaseModel):
+    requests: int = 0
+    connections: int = 0
+    tls_handshakes: int = 0
+
+    @computed_field
+    @property
+    def reuse_rate(self) -> float:
+        """
+        Share of requests sent on an already open connection.
+        """
+        if self.requests == 0:
+            return 0.0
+        return max(0.0, 1 - self.connections / self.requests)
+
+
+class PoolStats(BaseModel):
+    clients: int = 0
+    hosts: dict[str, HostStats] = Field(default_factory=dict)
+
+    def host(self, host: str) -> HostStats:
+        if host not in self.hosts:
+            self.hosts[host] = HostStats()
+        return self.hosts[host]
+
+
+stats = PoolStats()
+
+limits = httpx.Limits(
+    max_connections=settings.llm_max_connections,
+    max_keepalive_connections=settings.llm_max_keepalive_connections,
+    keepalive_expiry=settings.llm_keepalive_expiry,
+)
+
+ClientKey = tuple[str, str, str, bool]
+
+
+class Registry:
+    """
+    The clients sharing one httpx connection pool.
+    """
+
+    def __init__(self, http_client: Union[httpx.Client, httpx.AsyncClient]):
+        self.http_client = http_client
+        self.clients: dict[ClientKey, Union[AsyncAzureOpenAI, AzureOpenAI]] = {}
+        self.wrapped: dict[tuple, Any] = {}
+
+
+_sync_registry: Optional[Registry] = None
+_async_registries: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, Registry
+] = weakref.WeakKeyDictionary()
+
+
+def record(host: str, event: str) -> None:
+    if event == "connection.connect_tcp.complete":
+        stats.host(host).connections += 1
+    elif event == "connection.start_tls.complete":
+        stats.host(host).tls_handshakes += 1
+
+
+def on_request(request: httpx.Request) -> None:
+    host = request.url.host
+    stats.host(host).requests += 1
+    request.extensions["trace"] = lambda event, info: record(host, event)
+
+
+async def aon_request(request: httpx.Request) -> None:
+    host = request.url.host
+    stats.host(host).requests += 1
+
+    async def trace(event: str, info: dict) -> None:
+        record(host, event)
+
+    request.extensions["trace"] = trace
+
+
+def get_registry(sync: bool) -> Registry:
+    global _sync_registry
+    if sync:
+        if _sync_registry is None:
+            _sync_registry = Registry(
+                httpx.Client(limits=limits, event_hooks={"request": [on_request]})
+            )
+        return _sync_registry
+    loop = asyncio.get_running_loop()
+    registry = _async_registries.get(loop)
+    if registry is None:
+        registry = Registry(
+            httpx.AsyncClient(limits=limits, event_hooks={"request": [aon_request]})
+        )
+        _async_registries[loop] = registry
+    return registry
+
+
+def get_openai_client(
+    *,
+    endpoint: str,
+    deployment: str,
+    api_version: str,
+    api_key: str,
+    sync: bool = False,
+) -> Union[AsyncAzureOpenAI, AzureOpenAI]:
+    """
+    The async clients must be requested from inside the event loop using them.
+    """
+    registry = get_registry(sync)
+    key = (endpoint, deployment, api_version, sync)
+    client = registry.clients.get(key)
+    if client is None:
+        logger.info(f"New {'sync' if sync else 'async'} client for {deployment}")
+        client_class = AzureOpenAI if sync else AsyncAzureOpenAI
+        client = client_class(
+            api_version=api_version,
+            azure_endpoint=endpoint,
+            azure_deployment=deployment,
+            api_key=api_key,
+            http_client=registry.http_client,  # pyright: ignore
+        )
+        registry.clients[key] = client
+        stats.clients += 1
+    return client
+
+
+def get_client(
+    *,
+    endpoint: str,
+    deployment: str,
+    api_version: str,
+    api_key: str,
+    sync: bool = False,
+    timeout: Union[float, None],
+    max_retries: Optional[int] = None,
+    instrument: bool = False,
+):
+    """
+    Instructor client for a deployment, `timeout` and `max_retries` are per
+    call options on top of the shared client, not a new connection pool.
+    """
+    client = get_openai_client(
+        endpoint=endpoint,
+        deployment=deployment,
+        api_version=api_version,
+        api_key=api_key,
+        sync=sync,
+    )
+    registry = get_registry(sync)
+    key = (endpoint, deployment, api_version, sync, timeout, max_retries, instrument)
+    wrapped = registry.wrapped.get(key)
+    if wrapped is None:
+        options: dict[str, Any] = {"timeout": timeout}
+        if max_retries is not None:
+            options["max_retries"] = max_retries
+        client = client.with_options(**options)
+        if instrument:
+            logfire.instrument_openai(client)
+        wrapped = instructor.from_openai(client)
+        registry.wrapped[key] = wrapped
+    return wrapped
+
+
+def pool_stats() -> PoolStats:
+    return stats
+
+
+async def aclose() -> None:
+    """
+    Close the pool of the running event loop, e.g. on app shutdown.
+    """
+    registry = _async_registries.pop(asyncio.get_running_loop(), None)
+    if registry is not None:
+        await registry.http_client.aclose()
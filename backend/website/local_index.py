@@ -0,0 +1,363 @@
+"""
+In-process vector index over the experience corpus.
+
+The corpus is a few tens of thousands of experiences (the Biohacking,
+Pregnancy and Sleep `TopicExperiences`), small enough that the kNN over
+`health_disorderVector` doesn't need a round-trip to Azure Search. This is an
+IVF index:
+
+- spherical k-means splits the unit-normalized vectors into `nlist` lists
+- the rows are stored ordered by list, so each list is a contiguous slice of
+  the memory-mapped matrix
+- a query scores the centroids, then only the rows of the `nprobe` closest
+  lists, and returns the top `k` by cosine similarity
+
+Every file is memory-mapped, so opening the index copies nothing and the
+uvicorn workers share one page cache copy. float16 halves that memory but
+NumPy has no BLAS for it, so those rows are cast back to float32 per query.
+
+    index_dir/
+        meta.json         -- dim, count, nlist, dtype
+        vectors.npy       -- (count, dim) float32 (or float16), ordered by list
+        centroids.npy     -- (nlist, dim) float32
+        list_offsets.npy  -- (nlist + 1,) rows of list i are [offsets[i], offsets[i+1])
+        docs.jsonl        -- one search hit per row, same order as vectors.npy
+        doc_offsets.npy   -- (count + 1,) byte offsets into docs.jsonl
+
+`build` also writes a `website.bm25` index over the same rows. `hits` fuses
+the kNN with BM25 on `search_text` like Azure's hybrid query does, by
+reciprocal rank fusion or, with `fusion="linear"`, a blend weighted by
+`alpha`. Without a question vector it falls back to BM25 alone, so a question
+whose embedding isn't cached can still be answered with no network.
+
+`LocalSearchClient` and `AsyncLocalSearchClient` answer the `search` calls of
+`run_search_query` and `arun_search_query`, so they plug in where the Azure
+`SearchClient`s go. Build it from the ETL store with
+
+    poetry run python -m website.local_index /local_index
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+from pathlib import Path
+from typing import Any, AsyncIterator, Literal, Optional
+
+import numpy as np
+from loguru import logger
+
+from website.bm25 import BM25Index, linear_fusion, reciprocal_rank_fusion
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the `k` highest scores, highest first.
+
+    >>> top_k(np.array([0.1, 0.9, 0.5, 0.7]), 2).tolist()
+    [1, 3]
+    """
+    if k >= len(scores):
+        return np.argsort(-scores)
+    best = np.argpartition(-scores, k)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+def kmeans(
+    vectors: np.ndarray, nlist: int, *, iterations: int = 10, seed: int = 0
+) -> np.ndarray:
+    """
+    Spherical k-means, returns the (nlist, dim) unit centroids.
+    """
+    rng = np.random.default_rng(seed)
+    # a sample of ~64 rows per list is enough to place the centroids
+    sample_size = min(len(vectors), 64 * nlist)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        empty = np.bincount(assignments, minlength=nlist) == 0
+        # reseed empty lists with random rows instead of losing them
+        sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class LocalIndex:
+    def __init__(
+        self,
+        index_dir: Path,
+        *,
+        nprobe: int = 16,
+        fusion: Literal["rrf", "linear"] = "rrf",
+        alpha: float = 0.5,
+        candidates: int = 100,
+    ):
+        self.index_dir = Path(index_dir)
+        with open(self.index_dir / "meta.json") as f:
+            self.meta = json.load(f)
+        self.nprobe = nprobe
+        self.fusion = fusion
+        self.alpha = alpha
+        # how deep each side is ranked before fusing
+        self.candidates = candidates
+        self.vectors = np.load(self.index_dir / "vectors.npy", mmap_mode="r")
+        self.centroids = np.load(self.index_dir / "centroids.npy", mmap_mode="r")
+        self.list_offsets = np.load(self.index_dir / "list_offsets.npy", mmap_mode="r")
+        self.doc_offsets = np.load(self.index_dir / "doc_offsets.npy", mmap_mode="r")
+        with open(self.index_dir / "docs.jsonl", "rb") as f:
+            self.docs = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.bm25: Optional[BM25Index] = None
+        if BM25Index.exists(self.index_dir):
+            self.bm25 = BM25Index(self.index_dir)
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    @classmethod
+    def build(
+        cls,
+        index_dir: Path,
+        *,
+        vectors: np.ndarray,
+        documents: list[dict],
+        nlist: Optional[int] = None,
+        dtype: Any = np.float32,
+        iterations: int = 10,
+        seed: int = 0,
+    ) -> LocalIndex:
+        if len(vectors) != len(documents):
+            raise ValueError(f"{len(vectors)} vectors for {len(documents)} documents")
+        vectors = normalize(vectors)
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(len(vectors))))
+        nlist = min(nlist, len(vectors))
+        centroids = kmeans(vectors, nlist, iterations=iterations, seed=seed)
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), 4096):
+            block = vectors[start : start + 4096]
+            assignments[start : start + 4096] = np.argmax(block @ centroids.T, axis=1)
+        order = np.argsort(assignments, kind="stable")
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(assignments, minlength=nlist))
+
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        np.save(index_dir / "vectors.npy", vectors[order].astype(dtype))
+        np.save(index_dir / "centroids.npy", centroids.astype(np.float32))
+        np.save(index_dir / "list_offsets.npy", list_offsets)
+        doc_offsets = np.zeros(len(documents) + 1, dtype=np.int64)
+        with open(index_dir / "docs.jsonl", "wb") as f:
+            for row, i in enumerate(order):
+                line = json.dumps(documents[i]).encode("utf-8") + b"\n"
+                f.write(line)
+                doc_offsets[row + 1] = doc_offsets[row] + len(line)
+        np.save(index_dir / "doc_offsets.npy", doc_offsets)
+        BM25Index.build(index_dir, documents=[documents[i] for i in order])
+        meta = {
+            "dim": vectors.shape[1],
+            "count": len(vectors),
+            "nlist": nlist,
+            "dtype": np.dtype(dtype).name,
+        }
+        with open(index_dir / "meta.json", "w") as f:
+            json.dump(meta, f)
+        logger.info(f"Built local index {index_dir}: {meta}")
+        return cls(index_dir)
+
+    def scores(self, start: int, end: int, query: np.ndarray) -> np.ndarray:
+        block = self.vectors[start:end]
+        if block.dtype != np.float32:
+            block = block.astype(np.float32)
+        return block @ query
+
+    def search(
+        self, vector: Any, k: int, *, nprobe: Optional[int] = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the rows and cosine similarities of the (approximate) `k`
+        nearest neighbors, best first.
+        """
+        query = normalize(vector)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        lists = top_k(self.centroids @ query, nprobe)
+        rows = []
+        scores = []
+        for i in lists:
+            start, end = self.list_offsets[i], self.list_offsets[i + 1]
+            if start == end:
+                continue
+            rows.append(np.arange(start, end))
+            scores.append(self.scores(start, end, query))
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        all_rows = np.concatenate(rows)
+        all_scores = np.concatenate(scores)
+        best = top_k(all_scores, k)
+        return all_rows[best], all_scores[best]
+
+    def brute_force(self, vector: Any, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Exact kNN over every row, the baseline `search` is measured against.
+        """
+        query = normalize(vector)
+        scores = np.concatenate(
+            [
+                self.scores(start, min(start + 4096, len(self)), query)
+                for start in range(0, len(self), 4096)
+            ]
+        )
+        best = top_k(scores, k)
+        return best, scores[best]
+
+    def document(self, row: int) -> dict:
+        start, end = self.doc_offsets[row], self.doc_offsets[row + 1]
+        return json.loads(self.docs[start:end])
+
+    def hybrid_search(
+        self, vector: Optional[Any], text: Optional[str], k: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The kNN of `vector` fused with the BM25 matches of `text`, either can
+        be missing.
+        """
+        depth = max(k, self.candidates)
+        ranked = []
+        if vector is not None:
+            ranked.append(self.search(vector, depth))
+        if text and self.bm25 is not None:
+            ranked.append(self.bm25.search(text, depth))
+        if not ranked:
+            raise ValueError("Need a vector or a search text")
+        if len(ranked) == 1:
+            rows, scores = ranked[0]
+            return rows[:k], scores[:k]
+        if self.fusion == "linear":
+            fused = linear_fusion(ranked[0], ranked[1], alpha=self.alpha)
+        else:
+            fused = reciprocal_rank_fusion(rows for rows, _ in ranked)
+        best = sorted(fused, key=fused.__getitem__, reverse=True)[:k]
+        return (
+            np.array(best, dtype=np.int64),
+            np.array([fused[row] for row in best], dtype=np.float32),
+        )
+
+    def hits(
+        self, vector: Optional[Any], k: int, text: Optional[str] = None
+    ) -> list[dict]:
+        rows, scores = self.hybrid_search(vector, text, k)
+        return [
+            {**self.document(row), "@search.score": float(score)}
+            for row, score in zip(rows, scores)
+        ]
+
+
+class LocalSearchClient:
+    """
+    Answers `run_search_query` like `azure.search.documents.SearchClient`.
+    """
+
+    def __init__(self, index: LocalIndex):
+        self.index = index
+
+    def search(
+        self,
+        *,
+        vector_queries: Optional[list] = None,
+        search_text: Optional[str] = None,
+        top: int = 50,
+        **kwargs,
+    ) -> list[dict]:
+        vector = vector_queries[0].vector if vector_queries else None
+        return self.index.hits(vector, top, text=search_text)
+
+    def get_document_count(self) -> int:
+        return len(self.index)
+
+    def close(self) -> None:
+        pass
+
+
+class AsyncLocalSearchClient:
+    """
+    Answers `arun_search_query` like `azure.search.documents.aio.SearchClient`.
+    A query takes about a millisecond, so it runs on the event loop.
+    """
+
+    def __init__(self, index: LocalIndex):
+        self.index = index
+
+    async def search(
+        self,
+        *,
+        vector_queries: Optional[list] = None,
+        search_text: Optional[str] = None,
+        top: int = 50,
+        **kwargs,
+    ) -> AsyncIterator[dict]:
+        vector = vector_queries[0].vector if vector_queries else None
+        hits = self.index.hits(vector, top, text=search_text)
+
+        async def results() -> AsyncIterator[dict]:
+            for hit in hits:
+                yield hit
+
+        return results()
+
+    async def get_document_count(self) -> int:
+        return len(self.index)
+
+    async def close(self) -> None:
+        pass
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from website.biohacks import TopicExperiences
+    from website.dedupe import dedupe_rows
+    from website.search import clean, embedding_cache
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("index_dir", type=Path)
+    parser.add_argument(
+        "--topics", nargs="+", default=["Biohacking", "Pregnancy", "Sleep"]
+    )
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument(
+        "--keep-duplicates",
+        action="store_true",
+        help="index exact and near duplicate action/outcomes too",
+    )
+    args = parser.parse_args()
+
+    documents = []
+    for topic in args.topics:
+        for experience in TopicExperiences.load(name=topic).experiences:
+            if experience.health_disorder:
+                documents.append(clean(experience).model_dump(mode="json"))
+    if not args.keep_duplicates:
+        rows = dedupe_rows([f"{d['action']} {d['outcomes']}" for d in documents])
+        logger.info(f"Dropped {len(documents) - len(rows)} duplicates")
+        documents = [documents[row] for row in rows.tolist()]
+    texts = [document["health_disorder"] for document in documents]
+    vectors = []
+    for start in range(0, len(texts), args.batch_size):
+        batch = texts[start : start + args.batch_size]
+        vectors.extend(embedding_cache.embeddings.embed_documents(batch))
+        logger.info(f"Embedded {start + len(batch)}/{len(texts)}")
+    LocalIndex.build(
+        args.index_dir,
+        vectors=np.array(vectors, dtype=np.float32),
+        documents=documents,
+        nlist=args.nlist,
+    )
@@ -1,4 +1,5 @@
 import asyncio
+import json
 from pathlib import Path
 from typing import Any
 
@@ -6,14 +7,18 @@ import logfire
 import uvicorn
 from fastapi import BackgroundTasks, FastAPI, Request, Response, status
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import FileResponse, HTMLResponse, PlainTextResponse
+from fastapi.responses import (FileResponse, HTMLResponse, PlainTextResponse,
+                               StreamingResponse)
 from fastapi.staticfiles import StaticFiles
+from jinja2.utils import Namespace
 from jinja2_fragments.fastapi import Jinja2Blocks
 from logfire.propagate import attach_context, get_context
 from pydantic import BaseModel
 from rich import print
 from rich.traceback import install
 
+from website import llm_clients
+from website.ai_o3_summary import stream_ai_summary
 from website.amazon_products import (baby_carrier_wraps,
                                      bottle_cleaners, bottle_dryers,
                                      bottle_sanitizers,
@@ -26,11 +31,21 @@ from website.amazon_products import (baby_carrier_wraps,
                                      non_toxic_infant_car_seats,
                                      non_toxic_playmats,
                                      post_delivery_healing_products)
+from website.cache import ResultCache, normalize_question
+from website.limiter import limiter_stats
+from website.local_index import AsyncLocalSearchClient, LocalIndex
+from website.precomputed import precomputed
+from website.llm_cache import llm_cache
+from website.rerank import reranker
+from website.router import router_stats
 from website.questions import questions
 from website.models import AISummary, DynamicBiohackingTaxonomy, Experience
-from website.search import (make_taxonomy, run_search_and_enrich,
-                            run_search_query)
-from website.settings import azure_search_client, web_app_env
+from website.search import (EnrichStats, enriched_biohacks_to_taxonomy,
+                            make_taxonomy, run_search_and_enrich,
+                            run_search_query, stream_search_and_enrich)
+from website.settings import (azure_search_async_client, local_index_dir,
+                              redis_url, summary_timeout, web_app_env)
+from website.single_flight import SharedSingleFlight, StreamFlight
 
 install()
 
@@ -52,6 +67,8 @@ try:
             "/robots.txt",
             "/poll_ai_summary",
             "/poll_ai_search",
+            "/cache_stats",
+            "/pool_stats",
         ],
         capture_headers=True,
     )
@@ -61,10 +78,48 @@ except Exception as e:
     logger.error(f"Error configuring logfire: {e}")
     raise e
 
-cache: dict[str, Any] = {}
+cache = ResultCache.from_url(redis_url)
+# concurrent identical /search questions share one search + enrichment run
+search_flight = SharedSingleFlight(cache=cache, lock_ttl=60)
+# and /stream_search streams replay one producer, coalesced with /search
+search_stream_flight = StreamFlight(search_flight)
+# the o3 summary sections take minutes, the lock has to outlast them
+summary_stream_flight = StreamFlight(
+    SharedSingleFlight(cache=cache, lock_ttl=summary_timeout)
+)
+# kNN in process over the memory-mapped index when there is one
+search_client = azure_search_async_client
+if local_index_dir is not None:
+    search_client = AsyncLocalSearchClient(LocalIndex(local_index_dir))
 app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=5)
 
 
+@app.on_event("startup")
+async def start_precomputed_refresh():
+    if precomputed is not None:
+        # rebuilds the precomputed answers when the search index changes
+        app.state.precomputed_refresh = asyncio.create_task(
+            precomputed.refresh_forever(client=search_client, cache=cache)
+        )
+
+
+@app.on_event("startup")
+async def warm_reranker():
+    if reranker is not None:
+        # load the cross-encoder before the first search needs it
+        app.state.reranker_warmup = asyncio.create_task(
+            asyncio.to_thread(reranker.warm)
+        )
+
+
+@app.on_event("shutdown")
+async def close_search_client():
+    if precomputed is not None:
+        app.state.precomputed_refresh.cancel()
+    await azure_search_async_client.close()
+    await llm_clients.aclose()
+
+
 static_directory = Path(__file__).parent / "static"
 app.mount("/static", StaticFiles(directory=str(static_directory)), name="static")
 # app.mount(
@@ -92,6 +147,28 @@ def health_check():
     return "OK"
 
 
+@app.get("/cache_stats", include_in_schema=False)
+def cache_stats():
+    stats = cache.stats()
+    stats["search_flight"] = search_flight.stats.model_dump()
+    stats["summary_flight"] = summary_stream_flight.stats.model_dump()
+    if llm_cache is not None:
+        stats["llm_cache"] = llm_cache.summary()
+    if precomputed is not None:
+        stats["precomputed"] = precomputed.summary()
+    if reranker is not None:
+        stats["reranker"] = reranker.summary()
+    return stats
+
+
+@app.get("/pool_stats", include_in_schema=False)
+def pool_stats():
+    stats = llm_clients.pool_stats().model_dump()
+    stats["limiters"] = limiter_stats()
+    stats["routers"] = router_stats()
+    return stats
+
+
 @app.get("/")
 def home_page(request: Request):
     return templates.TemplateResponse(
@@ -226,7 +303,8 @@ async def ai_search_task(
 ):
     question = question.strip()
     question = question.replace("?", "")
-    cache_result = cache.get("taxonomy" + question)
+    key = normalize_question(question)
+    cache_result = await cache.get("taxonomy" + key)
     if cache_result is not None and isinstance(cache_result, DynamicBiohackingTaxonomy):
         logfire.info(f"Found valid taxonomy in cache, skipping ai search task")
         return
@@ -240,8 +318,8 @@ async def ai_search_task(
         max_retries=max_retries,
         timeout=timeout,
     )
-    cache["taxonomy" + question] = taxonomy
-    logfire.info(f"AI Search saved to cache with key: `taxonomy{question}`")
+    await cache.set("taxonomy" + key, taxonomy)
+    logfire.info(f"AI Search saved to cache with key: `taxonomy{key}`")
     return
 
 
@@ -250,7 +328,8 @@ async def ai_summary_task(
     question: str,
 ):
     question = question.strip().replace("?", "")
-    ai_summary = cache.get("summary" + question)
+    key = normalize_question(question)
+    ai_summary = await cache.get("summary" + key)
     if ai_summary is not None and isinstance(ai_summary, AISummary):
         if len(ai_summary.curious) > 0:
             logfire.info(f"Found valid ai summary in cache, skipping summary task")
@@ -259,7 +338,7 @@ async def ai_summary_task(
             logfire.info(
                 "No curious items found in cache, starting ai summary task again"
             )
-    taxonomy = cache["taxonomy" + question]
+    taxonomy = await cache.get("taxonomy" + key)
     if taxonomy is None or not isinstance(taxonomy, DynamicBiohackingTaxonomy):
         logfire.error("No valid taxonomy found in cache, skipping ai summary task")
         return
@@ -270,17 +349,17 @@ async def ai_summary_task(
         )
     except Exception as e:
         logfire.error(f"Error starting ai summary task: {e}")
-        cache["summary" + question] = "Error starting ai summary task"
+        await cache.set("summary" + key, "Error starting ai summary task")
         return
     if isinstance(ai_summary, AISummary) and len(ai_summary.curious) > 0:
-        cache["summary" + question] = ai_summary
-        logfire.info(f"AI Summary saved to cache with key: `summary{question}`")
+        await cache.set("summary" + key, ai_summary)
+        logfire.info(f"AI Summary saved to cache with key: `summary{key}`")
     elif isinstance(ai_summary, AISummary) and len(ai_summary.curious) == 0:
         logfire.error("AI summary task returned no curious items")
-        cache["summary" + question] = "AI summary task returned no curious items"
+        await cache.set("summary" + key, "AI summary task returned no curious items")
     else:
         logfire.error("AI summary task returned an invalid result")
-        cache["summary" + question] = "AI summary task returned an invalid result"
+        await cache.set("summary" + key, "AI summary task returned an invalid result")
     return
 
 
@@ -295,7 +374,13 @@ async def search(
 ):
     # Part 0 check cache
     question = question.strip().replace("?", "")
-    cache_result = cache.get("taxonomy" + question)
+    key = normalize_question(question)
+    answer = precomputed.get(key) if precomputed is not None else None
+    if answer is not None:
+        logfire.info(f"Found precomputed answer, skipping ai search task")
+        cache_result = answer.taxonomy
+    else:
+        cache_result = await cache.get("taxonomy" + key)
     if cache_result is not None and isinstance(cache_result, DynamicBiohackingTaxonomy):
         logfire.info(f"Found valid taxonomy in cache, skipping ai search task")
         return templates.TemplateResponse(
@@ -304,7 +389,7 @@ async def search(
                 "question": question,
                 "request": request,
                 "relevance_polling": "finished",
-                "summary_polling": "on",
+                "summary_polling": "streaming",
                 "biohack_types": cache_result.biohack_types,
                 "count_experiences": cache_result.count_experiences,
                 "count_reddits": cache_result.count_reddits,
@@ -312,17 +397,41 @@ async def search(
             },
         )
 
+    if "application/json" not in request.headers.get("accept", ""):
+        # render the page shell now, it opens /stream_search and shows each
+        # biohack type as soon as its LLM responses land
+        context = {
+            "question": question,
+            "request": request,
+            "relevance_polling": "streaming",
+            "summary_polling": "streaming",
+        }
+        if "HX-Request" in request.headers:
+            return templates.TemplateResponse(
+                name="search.html",
+                context=context,
+                block_name="ai_search_results",
+            )
+        return templates.TemplateResponse(name="search.html", context=context)
+
     # Part 1 of 3: Search candidate biohacks - recall
+    # concurrent requests for the same question await the same run
     limit = 100
-    taxonomy = await run_search_and_enrich(
-        question=question,
-        client=azure_search_client,
-        limit=limit,
-        batch_size=300,
-        llm_name="gpt-4o",
-        max_tokens=100,
-        max_retries=0,
-        timeout=2,
+    taxonomy = await search_flight.do(
+        "taxonomy" + key,
+        lambda: run_search_and_enrich(
+            question=question,
+            client=search_client,
+            limit=limit,
+            batch_size=300,
+            llm_name="gpt-4o",
+            max_tokens=100,
+            max_retries=0,
+            timeout=2,
+            # render from the first relevant biohacks, don't wait on stragglers
+            deadline=4,
+            min_results=30,
+        ),
     )
     # experiences = run_search_query(
     #     question=question, client=azure_search_client, limit=limit
@@ -335,8 +444,12 @@ async def search(
         biohack_types = taxonomy.biohack_types
         count_reddits = taxonomy.count_reddits
         count_studies = taxonomy.count_studies
-        cache["taxonomy" + question] = taxonomy
-        logfire.info(f"AI Search saved to cache with key: `taxonomy{question}`")
+        if taxonomy.complete:
+            await cache.set("taxonomy" + key, taxonomy)
+            logfire.info(f"AI Search saved to cache with key: `taxonomy{key}`")
+        else:
+            # cut at the deadline, the next visitor runs it again
+            logfire.info(f"AI Search partial, not cached: `taxonomy{key}`")
         relevance_polling = "finished"
 
         # # Perform the search immediately rather than in a background task
@@ -432,6 +545,140 @@ async def search(
         )
 
 
+def sse_event(event: str, data: str) -> str:
+    """
+    >>> sse_event("biohack_type", "<div>\\n</div>")
+    'event: biohack_type\\ndata: <div>\\ndata: </div>\\n\\n'
+    """
+    lines = "".join(f"data: {line}\n" for line in data.split("\n"))
+    return f"event: {event}\n{lines}\n"
+
+
+async def stream_search_events(*, question: str, summary_only: bool):
+    key = normalize_question(question)
+    answer = precomputed.get(key) if precomputed is not None else None
+    try:
+        if answer is not None:
+            taxonomy = answer.taxonomy
+        else:
+            taxonomy = await cache.get("taxonomy" + key)
+        if not isinstance(taxonomy, DynamicBiohackingTaxonomy):
+            taxonomy = None
+        group_template = templates.get_template("biohack_type_group.html")
+        card_counter = Namespace(value=0)
+        if taxonomy is None:
+            enrich_stats = EnrichStats()
+
+            async def cache_taxonomy(biohack_type_groups):
+                taxonomy = enriched_biohacks_to_taxonomy(
+                    [
+                        biohack
+                        for biohack_type_group in biohack_type_groups
+                        for biohack in biohack_type_group.biohacks
+                    ]
+                )
+                taxonomy.complete = enrich_stats.complete
+                if len(taxonomy.biohack_types) > 1 and taxonomy.complete:
+                    await cache.set("taxonomy" + key, taxonomy)
+                    logfire.info(f"AI Search saved to cache with key: `taxonomy{key}`")
+                return taxonomy
+
+            # concurrent streams of the question replay the same run
+            broadcast = search_stream_flight.subscribe(
+                "taxonomy" + key,
+                lambda: stream_search_and_enrich(
+                    question=question,
+                    client=search_client,
+                    limit=100,
+                    batch_size=300,
+                    llm_name="gpt-4o",
+                    max_tokens=100,
+                    max_retries=0,
+                    timeout=2,
+                    deadline=4,
+                    stats=enrich_stats,
+                ),
+                collect=cache_taxonomy,
+                replay=lambda taxonomy: taxonomy.biohack_types,
+            )
+            async for biohack_type_group in broadcast.subscribe():
+                if summary_only:
+                    # the page already shows the biohack types
+                    continue
+                html = group_template.render(
+                    biohack_type=biohack_type_group, card_counter=card_counter
+                )
+                yield sse_event("biohack_type", html)
+            taxonomy = broadcast.result
+        elif not summary_only:
+            for biohack_type_group in taxonomy.biohack_types:
+                html = group_template.render(
+                    biohack_type=biohack_type_group, card_counter=card_counter
+                )
+                yield sse_event("biohack_type", html)
+        counts = taxonomy.model_dump(
+            include={"count_experiences", "count_reddits", "count_studies"}
+        )
+        yield sse_event("counts", json.dumps(counts))
+
+        if not taxonomy.biohack_types:
+            logfire.warning("No experiences found, so no AI summary started")
+            yield sse_event("done", "")
+            return
+
+        section_template = templates.get_template("summary_section.html")
+        if answer is not None and answer.summary is not None:
+            ai_summary = answer.summary
+        else:
+            ai_summary = await cache.get("summary" + key)
+        if isinstance(ai_summary, AISummary) and len(ai_summary.curious) > 0:
+            logfire.info("Found valid ai summary in cache, skipping summary task")
+            sections = ai_summary.model_dump(
+                include={"balance", "skeptical", "curious"}
+            )
+            for section, items in sections.items():
+                html = section_template.render(section=section, items=items)
+                yield sse_event("summary_section", html)
+        else:
+
+            async def cache_summary(sections):
+                ai_summary = AISummary(mechanisms=[], **dict(sections))
+                if len(ai_summary.curious) == 0:
+                    logfire.error("AI summary task returned no curious items")
+                elif taxonomy.complete:
+                    # a cut-off taxonomy's summary isn't cached either
+                    await cache.set("summary" + key, ai_summary)
+                    logfire.info(f"AI Summary saved to cache with key: `summary{key}`")
+                return ai_summary
+
+            broadcast = summary_stream_flight.subscribe(
+                "summary" + key,
+                lambda: stream_ai_summary(taxonomy=taxonomy, question=question),
+                collect=cache_summary,
+                replay=lambda ai_summary: ai_summary.model_dump(
+                    include={"balance", "skeptical", "curious"}
+                ).items(),
+            )
+            async for section, items in broadcast.subscribe():
+                html = section_template.render(section=section, items=items)
+                yield sse_event("summary_section", html)
+        yield sse_event("done", "")
+    except Exception as e:
+        logfire.error(f"Error streaming search results: {e}")
+        yield sse_event("search_error", "Error streaming search results")
+
+
+# the search page's EventSource hits this endpoint
+@app.get("/stream_search")
+async def stream_search(question: str, summary_only: bool = False):
+    question = question.strip().replace("?", "")
+    return StreamingResponse(
+        stream_search_events(question=question, summary_only=summary_only),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # polling hits this endpoint
 @app.get(
     "/poll_ai_search/{question}",
@@ -468,7 +715,7 @@ async def ai_search(request: Request, question: str, background_tasks: Backgroun
 
         question = question.strip()
         question = question.replace("?", "")
-        cache_result = cache.get("taxonomy" + question)
+        cache_result = await cache.get("taxonomy" + normalize_question(question))
         if cache_result is None:
             return templates.TemplateResponse(
                 name="search.html",
@@ -581,7 +828,8 @@ async def ai_summary(request: Request, question: str):
 
         question = question.strip()
         question = question.replace("?", "")
-        cache_result = cache.get("summary" + question)
+        key = normalize_question(question)
+        cache_result = await cache.get("summary" + key)
         # {"traceparent": "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"}
 
         if cache_result is None:
@@ -624,7 +872,7 @@ async def ai_summary(request: Request, question: str):
         else:
             error_message = "Invalid AI summary result in cache -- retry"
             logfire.error(error_message)
-            cache.pop("summary" + question, None)
+            await cache.pop("summary" + key)
             return templates.TemplateResponse(
                 name="search.html",
                 context={
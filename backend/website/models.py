@@ -1,10 +1,11 @@
 from __future__ import annotations
 
 import base64
+from dataclasses import dataclass, fields
 from enum import Enum
-from typing import Literal, Optional
+from typing import Annotated, Literal, Optional, Union
 
-from pydantic import BaseModel, computed_field
+from pydantic import BaseModel, Field, computed_field
 
 
 class AISummary(BaseModel):
@@ -130,12 +131,86 @@ class Experience(BaseModel):
             return False
 
 
+def source_type(permalink: str) -> str:
+    return "study" if "10." in permalink else "reddit"
+
+
+def source_url(permalink: str) -> str:
+    if source_type(permalink) == "study":
+        return f"https://doi.org/{permalink}"
+    return f"https://www.reddit.com{permalink}"
+
+
+@dataclass(frozen=True, slots=True)
+class HitRecord:
+    """
+    Read-only search hit, what the search page renders of an `Experience`.
+
+    A slotted dataclass: no validation, no `__dict__`, and `source_type`,
+    `url` and `key` are plain attributes. The local index stores them per
+    document at build time; otherwise they are resolved once here instead of
+    on every access like `Experience`'s computed fields.
+    """
+
+    permalink: str
+    action: str
+    health_disorder: str
+    outcomes: str
+    rationale: Optional[str] = None
+    action_score: Optional[int] = None
+    outcomes_score: Optional[int] = None
+    mechanism: Optional[str] = None
+    personal_context: Optional[str] = None
+    takeaway: Optional[str] = None
+    biohack_type: Optional[str] = None
+    biohack_topic: Optional[str] = None
+    source_type: Optional[str] = None
+    url: Optional[str] = None
+    key: Optional[str] = None
+
+    def __post_init__(self):
+        if self.source_type is None:
+            object.__setattr__(self, "source_type", source_type(self.permalink))
+        if self.url is None:
+            object.__setattr__(self, "url", source_url(self.permalink))
+        if self.key is None:
+            key = base64.urlsafe_b64encode(self.permalink.encode("utf-8"))
+            object.__setattr__(self, "key", key.decode("ascii"))
+
+    @classmethod
+    def from_hit(cls, hit: dict) -> HitRecord:
+        return cls(**{name: hit.get(name) for name in hit_record_fields})
+
+    @property
+    def score(self) -> int:
+        if self.action_score is None:
+            raise ValueError("Action score is None")
+        if self.outcomes_score is None:
+            raise ValueError("Outcomes score is None")
+        return self.action_score + self.outcomes_score
+
+    def to_experience(self) -> Experience:
+        return Experience(
+            **{
+                name: getattr(self, name)
+                for name in hit_record_fields
+                if name not in ("source_type", "url", "key")
+            }
+        )
+
+
+hit_record_fields = [field.name for field in fields(HitRecord)]
+
+
 class DynamicBiohack(BaseModel):
     biohack_topic: Optional[str] = None
     why_care: Optional[str] = None
     biohack_topic: Optional[str] = None
     biohack_topic: Optional[str] = None
-    experiences: list[Experience]
+    # HitRecords on the search path, cached taxonomies come back as HitRecords too
+    experiences: list[
+        Annotated[Union[HitRecord, Experience], Field(union_mode="left_to_right")]
+    ]
     balance: Optional[bool] = None
     skeptical: Optional[bool] = None
     curious: Optional[bool] = None
@@ -175,6 +250,9 @@ class DynamicBiohackingTaxonomy(BaseModel):
     count_experiences: int
     count_reddits: int
     count_studies: int
+    # False when the enrichment stopped at its deadline or `min_results`, or
+    # calls failed; such a taxonomy is shown but not cached
+    complete: bool = True
 
 
 class EnrichBiohackInput(BaseModel):
@@ -0,0 +1,307 @@
+"""
+Blocking for topic near-duplicates, so the LLM only sees the ambiguous pairs.
+
+`near_dupe_llm_classifier` asks the `NearDupeChain*` chains about a pair of
+topics at a time: merging n topics is n(n-1)/2 prompts. Here the topics are
+embedded once, and the cosine similarity of each topic to its nearest
+neighbours splits the pairs in three bands:
+
+- `>= high`: near duplicates, merged without asking.
+- `[low, high)`: ambiguous, sent to a `NearDupeChainChunk*` chain,
+  `chunk_size` pairs per prompt.
+- `< low`, or not among the `k` nearest neighbours: never a candidate.
+
+The neighbours come from blockwise matrix products of the unit vectors and
+`local_index.top_k`, exact rather than approximate: topic lists are a few
+thousand rows, so one block of `block_size` rows against all topics is a
+single BLAS call.
+
+    poetry run python -m website.near_dupe_blocking --low 0.6 --high 0.9
+"""
+
+from __future__ import annotations
+
+import json
+import math
+from typing import Optional, Sequence
+
+import numpy as np
+from pydantic import BaseModel
+
+from website.local_index import normalize, top_k
+from website.near_dupe_llm_classifier import (NearDupeChainChunk,
+                                              NearDupeInput,
+                                              NearDupeInputChunk)
+
+
+class BlockingStats(BaseModel):
+    topics: int = 0
+    all_pairs: int = 0
+    candidate_pairs: int = 0
+    auto_merged: int = 0
+    llm_pairs: int = 0
+    llm_calls: int = 0
+    llm_merged: int = 0
+
+    @property
+    def llm_calls_avoided(self) -> int:
+        # against one `NearDupeChain` prompt per pair of topics
+        return self.all_pairs - self.llm_calls
+
+
+class BlockingEvaluation(BaseModel):
+    """
+    The bands against labeled pairs. The ambiguous band counts as predicted
+    near duplicates unless the LLM answered for it.
+    """
+
+    pairs: int = 0
+    positives: int = 0
+    true_positives: int = 0
+    false_positives: int = 0
+    ambiguous: int = 0
+    # positives below `low`: lost before the LLM could see them
+    blocked_positives: int = 0
+
+    @property
+    def precision(self) -> float:
+        predicted = self.true_positives + self.false_positives
+        return self.true_positives / predicted if predicted else 0.0
+
+    @property
+    def recall(self) -> float:
+        return self.true_positives / self.positives if self.positives else 0.0
+
+
+def candidate_pairs(
+    vectors: np.ndarray, *, k: int = 20, low: float = 0.6, block_size: int = 1024
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The (i, j) pairs, i < j, where j is among the `k` nearest neighbours of i
+    or i of j, with cosine similarity >= `low`, and their similarities.
+
+    >>> vectors = np.array([[1, 0], [0.96, 0.28], [0, 1]])
+    >>> pairs, similarities = candidate_pairs(vectors, k=1, low=0.5)
+    >>> pairs.tolist(), [round(s, 2) for s in similarities.tolist()]
+    ([[0, 1]], [0.96])
+    """
+    vectors = normalize(vectors)
+    n = len(vectors)
+    found: dict[tuple[int, int], float] = {}
+    for start in range(0, n, block_size):
+        similarities = vectors[start : start + block_size] @ vectors.T
+        for offset, row in enumerate(similarities):
+            i = start + offset
+            # the topic itself is its own nearest neighbour
+            row[i] = -np.inf
+            for j in top_k(row, k).tolist():
+                if row[j] < low:
+                    break
+                found[(min(i, j), max(i, j))] = float(row[j])
+    pairs = np.array(sorted(found), dtype=np.int64).reshape(-1, 2)
+    return pairs, np.array([found[tuple(p)] for p in pairs.tolist()], np.float32)
+
+
+async def ask_llm(
+    pairs: Sequence[tuple[str, str]],
+    *,
+    chain: type[NearDupeChainChunk] = NearDupeChainChunk,
+    chunk_size: int = 10,
+    llm_name: str = "gpt-4o",
+    size: int = 25,
+    max_tokens: int = 100,
+    max_retries: int = 1,
+    timeout: int = 10,
+) -> list[Optional[bool]]:
+    """
+    The chunk chain's answer for each pair of topics, None where its chunk
+    failed.
+    """
+    chunks = [pairs[i : i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+    answers: list[Optional[bool]] = [None] * len(pairs)
+    async for index, response in chain.iter_predict(
+        size=size,
+        llm_name=llm_name,
+        input_objects=[
+            NearDupeInputChunk.from_input_objects(
+                [NearDupeInput(topic_1=a, topic_2=b) for a, b in chunk]
+            )
+            for chunk in chunks
+        ],
+        max_tokens=max_tokens,
+        max_retries=max_retries,
+        timeout=timeout,
+        batch=True,
+    ):
+        if response is None or isinstance(response, Exception):
+            continue
+        start = index * chunk_size
+        chunk_answers = response.answers[: len(chunks[index])]
+        answers[start : start + len(chunk_answers)] = chunk_answers
+    return answers
+
+
+async def near_dupe_pairs(
+    topics: Sequence[str],
+    vectors: np.ndarray,
+    *,
+    low: float = 0.6,
+    high: float = 0.9,
+    k: int = 20,
+    chunk_size: int = 10,
+    **kwargs,
+) -> tuple[list[tuple[int, int]], BlockingStats]:
+    """
+    The near-duplicate pairs of `topics`: the auto-merged band, then the
+    pairs of the ambiguous band the LLM said yes to. A failed chunk is all
+    no, like the chains' "if you are unsure, return False".
+    """
+    pairs, similarities = candidate_pairs(vectors, k=k, low=low)
+    auto = pairs[similarities >= high].tolist()
+    ambiguous = pairs[similarities < high].tolist()
+    stats = BlockingStats(
+        topics=len(topics),
+        all_pairs=len(topics) * (len(topics) - 1) // 2,
+        candidate_pairs=len(pairs),
+        auto_merged=len(auto),
+        llm_pairs=len(ambiguous),
+        llm_calls=math.ceil(len(ambiguous) / chunk_size),
+    )
+    merged = [(i, j) for i, j in auto]
+    if ambiguous:
+        answers = await ask_llm(
+            [(topics[i], topics[j]) for i, j in ambiguous],
+            chunk_size=chunk_size,
+            **kwargs,
+        )
+        for (i, j), answer in zip(ambiguous, answers):
+            if answer:
+                merged.append((i, j))
+                stats.llm_merged += 1
+    return merged, stats
+
+
+def evaluate(
+    similarities: np.ndarray,
+    labels: Sequence[bool],
+    *,
+    low: float = 0.6,
+    high: float = 0.9,
+    llm_answers: Optional[Sequence[Optional[bool]]] = None,
+) -> BlockingEvaluation:
+    """
+    Score the bands on labeled pairs, given the cosine similarity of each.
+
+    >>> evaluation = evaluate(
+    ...     np.array([0.95, 0.7, 0.3, 0.92]), [True, True, True, False]
+    ... )
+    >>> evaluation.true_positives, evaluation.false_positives
+    (2, 1)
+    >>> evaluation.blocked_positives
+    1
+    """
+    evaluation = BlockingEvaluation(pairs=len(labels))
+    for index, (similarity, label) in enumerate(zip(similarities.tolist(), labels)):
+        if similarity >= high:
+            predicted = True
+        elif similarity >= low:
+            evaluation.ambiguous += 1
+            answer = llm_answers[index] if llm_answers is not None else None
+            predicted = True if answer is None else answer
+        else:
+            predicted = False
+            evaluation.blocked_positives += int(label)
+        evaluation.positives += int(label)
+        evaluation.true_positives += int(predicted and label)
+        evaluation.false_positives += int(predicted and not label)
+    return evaluation
+
+
+def labeled_pairs() -> list[tuple[str, str, bool]]:
+    """
+    The labeled topic pairs we have: the `Examples` LLM labels of
+    `fine_tuning_examples` (POS is a near duplicate or subset, HARD_POS
+    siblings, HARD_NEG and NEG are not near duplicates) and the hand labels
+    of `near_dupe_llm_classifier`.
+    """
+    from website.fine_tuning_examples import BiohackTypeEnum, Examples
+    from website.near_dupe_llm_classifier import labeled_inputs
+
+    pairs = [
+        (example.topic_1, example.topic_2, bool(example.expected_answer))
+        for example in labeled_inputs
+    ]
+    for biohack_type in BiohackTypeEnum:
+        if not Examples.file_path(biohack_type.value).exists():
+            continue
+        examples = Examples.load(biohack_type=biohack_type)
+        for record in examples.random_biohack_pair_labels or []:
+            record = record if isinstance(record, dict) else record.model_dump()
+            topic_1 = json.loads(record["text1"])["biohack_subtype"]
+            topic_2 = json.loads(record["text2"])["biohack_subtype"]
+            pairs.append((topic_1, topic_2, record["label"] == "POS"))
+    return pairs
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+
+    from rich import print
+    from rich.table import Table
+
+    from website.search import embedding_cache
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--low", type=float, default=0.6)
+    parser.add_argument("--high", type=float, default=0.9)
+    parser.add_argument("--llm", action="store_true", help="ask the LLM too")
+    parser.add_argument("--llm-name", default="gpt-4o")
+    args = parser.parse_args()
+
+    pairs = labeled_pairs()
+    texts = sorted({topic for pair in pairs for topic in pair[:2]})
+    row = {text: index for index, text in enumerate(texts)}
+    vectors = normalize(embedding_cache.embeddings.embed_documents(texts))
+    similarities = np.array(
+        [float(vectors[row[a]] @ vectors[row[b]]) for a, b, _ in pairs]
+    )
+    labels = [label for _, _, label in pairs]
+
+    llm_answers = None
+    if args.llm:
+        ambiguous = np.flatnonzero(
+            (similarities >= args.low) & (similarities < args.high)
+        ).tolist()
+        answers = asyncio.run(
+            ask_llm([pairs[i][:2] for i in ambiguous], llm_name=args.llm_name)
+        )
+        llm_answers = [None] * len(pairs)
+        for index, answer in zip(ambiguous, answers):
+            llm_answers[index] = answer
+
+    evaluation = evaluate(
+        similarities, labels, low=args.low, high=args.high, llm_answers=llm_answers
+    )
+    # what merging all the labeled topics would cost
+    all_pairs = len(texts) * (len(texts) - 1) // 2
+    _, found = candidate_pairs(vectors, low=args.low)
+    llm_calls = math.ceil(int((found < args.high).sum()) / 10)
+    table = Table(title=f"Near-dupe blocking, low={args.low} high={args.high}")
+    table.add_column("Labeled pairs")
+    table.add_column("Positives")
+    table.add_column("Precision")
+    table.add_column("Recall")
+    table.add_column("Ambiguous (LLM)")
+    table.add_column("Blocked positives")
+    table.add_column("LLM calls avoided")
+    table.add_row(
+        str(evaluation.pairs),
+        str(evaluation.positives),
+        f"{evaluation.precision:.2f}",
+        f"{evaluation.recall:.2f}",
+        str(evaluation.ambiguous),
+        str(evaluation.blocked_positives),
+        f"{all_pairs - llm_calls:,} of {all_pairs:,}",
+    )
+    print(table)
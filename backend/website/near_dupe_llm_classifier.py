@@ -459,6 +459,123 @@ class NearDupeChainChunkV4(NearDupeChainChunk):
         return input_text
 
 
+# hand labels, also the test cases of `is_member`
+labeled_inputs = [
+    NearDupeInput(
+        topic_1="Follow a ketogenic diet and exercise regularly to manage glucose levels.",
+        topic_2="Following a ketogenic diet",
+        expected_answer=True,
+    ),
+    NearDupeInput(
+        topic_1="Brewer Diet",
+        topic_2="Following a ketogenic diet",
+        expected_answer=False,
+    ),
+    NearDupeInput(
+        topic_1="Omega-3 Fatty Acids",
+        topic_2="Following a ketogenic diet",
+        expected_answer=False,
+    ),
+    NearDupeInput(
+        topic_1="Increased protein intake while maintaining a caloric deficit",
+        topic_2="Following a ketogenic diet",
+        expected_answer=False,
+    ),
+    NearDupeInput(
+        topic_1="Maintaining a calorie deficit while breastfeeding by ensuring adequate protein and micronutrient intake",
+        topic_2="Following a ketogenic diet",
+        expected_answer=False,
+    ),
+    NearDupeInput(
+        topic_1="Seed cycling in smoothies",
+        topic_2="Following a ketogenic diet",
+        expected_answer=False,
+    ),
+    NearDupeInput(
+        topic_1="Ketogenic diet with electrolyte replacement",
+        topic_2="Following a ketogenic diet",
+        expected_answer=True,
+    ),
+    NearDupeInput(
+        topic_1="Increased protein intake",
+        topic_2="Following a ketogenic diet",
+        expected_answer=False,
+    ),
+    NearDupeInput(
+        topic_1="Protein-Supplemented Very-Low-Calorie Diet",
+        topic_2="Following a ketogenic diet",
+        expected_answer=False,
+    ),
+    NearDupeInput(
+        topic_1="Controlled carb intake to manage mealtime blood sugar levels during pregnancy",
+        topic_2="Following a ketogenic diet",
+        expected_answer=False,
+    ),
+    NearDupeInput(
+        topic_1="Intermittent Fasting (IF)",
+        topic_2="Following a ketogenic diet",
+        expected_answer=False,
+    ),
+    NearDupeInput(
+        topic_1="Low-Carbohydrate Diet",
+        topic_2="Following a ketogenic diet",
+        expected_answer=False,
+    ),
+    NearDupeInput(
+        topic_1="Low carb diet",
+        topic_2="Following a ketogenic diet",
+        expected_answer=False,
+    ),
+    NearDupeInput(
+        topic_1="Going keto",
+        topic_2="Following a ketogenic diet",
+        expected_answer=True,
+    ),
+    NearDupeInput(
+        topic_1="Implement dietary changes to manage acid reflux",
+        topic_2="Following a ketogenic diet",
+        expected_answer=False,
+    ),
+    NearDupeInput(
+        topic_1="Follow a ketogenic diet (keto) for weight loss",
+        topic_2="Following a ketogenic diet",
+        expected_answer=True,
+    ),
+    NearDupeInput(
+        topic_1="strict keto-style diet",
+        topic_2="Following a ketogenic diet",
+        expected_answer=True,
+    ),
+    NearDupeInput(
+        topic_1="Incorporating more vegetables and healthy ingredients into meals, such as soups, stews, and salads.",
+        topic_2="Following a ketogenic diet",
+        expected_answer=False,
+    ),
+    NearDupeInput(
+        topic_1="Incorporating nutrient-dense foods like salmon and liver into the diet during pregnancy",
+        topic_2="Following a ketogenic diet",
+        expected_answer=False,
+    ),
+    NearDupeInput(
+        topic_1="Incorporating nutrient-dense foods like salmon and liver into the diet during pregnancy",
+        topic_2="Following a ketogenic diet",
+        expected_answer=False,
+    ),
+    # advanced examples
+    NearDupeInput(
+        topic_1="16/8 fasting",
+        topic_2="Atkins diet",
+        expected_answer=False,
+    ),
+    # Atkins diet IS a near dupe of 1940s USDA diet
+    NearDupeInput(
+        topic_1="Atkins diet",
+        topic_2="1940s USDA diet",
+        expected_answer=True,
+    ),
+]
+
+
 if __name__ == "__main__":
     # poetry run python is_member_by_o1_llm.py -v
     # pytest --doctest-modules is_member_by_o1_llm.py -v
@@ -468,120 +585,7 @@ if __name__ == "__main__":
     print("Running tests")
     import asyncio
 
-    input_objects = [
-        NearDupeInput(
-            topic_1="Follow a ketogenic diet and exercise regularly to manage glucose levels.",
-            topic_2="Following a ketogenic diet",
-            expected_answer=True,
-        ),
-        NearDupeInput(
-            topic_1="Brewer Diet",
-            topic_2="Following a ketogenic diet",
-            expected_answer=False,
-        ),
-        NearDupeInput(
-            topic_1="Omega-3 Fatty Acids",
-            topic_2="Following a ketogenic diet",
-            expected_answer=False,
-        ),
-        NearDupeInput(
-            topic_1="Increased protein intake while maintaining a caloric deficit",
-            topic_2="Following a ketogenic diet",
-            expected_answer=False,
-        ),
-        NearDupeInput(
-            topic_1="Maintaining a calorie deficit while breastfeeding by ensuring adequate protein and micronutrient intake",
-            topic_2="Following a ketogenic diet",
-            expected_answer=False,
-        ),
-        NearDupeInput(
-            topic_1="Seed cycling in smoothies",
-            topic_2="Following a ketogenic diet",
-            expected_answer=False,
-        ),
-        NearDupeInput(
-            topic_1="Ketogenic diet with electrolyte replacement",
-            topic_2="Following a ketogenic diet",
-            expected_answer=True,
-        ),
-        NearDupeInput(
-            topic_1="Increased protein intake",
-            topic_2="Following a ketogenic diet",
-            expected_answer=False,
-        ),
-        NearDupeInput(
-            topic_1="Protein-Supplemented Very-Low-Calorie Diet",
-            topic_2="Following a ketogenic diet",
-            expected_answer=False,
-        ),
-        NearDupeInput(
-            topic_1="Controlled carb intake to manage mealtime blood sugar levels during pregnancy",
-            topic_2="Following a ketogenic diet",
-            expected_answer=False,
-        ),
-        NearDupeInput(
-            topic_1="Intermittent Fasting (IF)",
-            topic_2="Following a ketogenic diet",
-            expected_answer=False,
-        ),
-        NearDupeInput(
-            topic_1="Low-Carbohydrate Diet",
-            topic_2="Following a ketogenic diet",
-            expected_answer=False,
-        ),
-        NearDupeInput(
-            topic_1="Low carb diet",
-            topic_2="Following a ketogenic diet",
-            expected_answer=False,
-        ),
-        NearDupeInput(
-            topic_1="Going keto",
-            topic_2="Following a ketogenic diet",
-            expected_answer=True,
-        ),
-        NearDupeInput(
-            topic_1="Implement dietary changes to manage acid reflux",
-            topic_2="Following a ketogenic diet",
-            expected_answer=False,
-        ),
-        NearDupeInput(
-            topic_1="Follow a ketogenic diet (keto) for weight loss",
-            topic_2="Following a ketogenic diet",
-            expected_answer=True,
-        ),
-        NearDupeInput(
-            topic_1="strict keto-style diet",
-            topic_2="Following a ketogenic diet",
-            expected_answer=True,
-        ),
-        NearDupeInput(
-            topic_1="Incorporating more vegetables and healthy ingredients into meals, such as soups, stews, and salads.",
-            topic_2="Following a ketogenic diet",
-            expected_answer=False,
-        ),
-        NearDupeInput(
-            topic_1="Incorporating nutrient-dense foods like salmon and liver into the diet during pregnancy",
-            topic_2="Following a ketogenic diet",
-            expected_answer=False,
-        ),
-        NearDupeInput(
-            topic_1="Incorporating nutrient-dense foods like salmon and liver into the diet during pregnancy",
-            topic_2="Following a ketogenic diet",
-            expected_answer=False,
-        ),
-        # advanced examples
-        NearDupeInput(
-            topic_1="16/8 fasting",
-            topic_2="Atkins diet",
-            expected_answer=False,
-        ),
-        # Atkins diet IS a near dupe of 1940s USDA diet
-        NearDupeInput(
-            topic_1="Atkins diet",
-            topic_2="1940s USDA diet",
-            expected_answer=True,
-        ),
-    ]
+    input_objects = labeled_inputs
     size = 25
     max_tokens = 100
     max_retries = 1
@@ -0,0 +1,275 @@
+"""
+int8 ONNX versions of the sentence-transformers models, served by onnxruntime.
+
+The cross-encoder of `website.rerank` (and `cross_encoders.py`) and the
+sentence embedding model of `fine_tuning_examples.mmr_fine_tune` run in fp32
+PyTorch: importing torch alone takes seconds, and each batch runs on the few
+CPU cores of a Container App. Exported once to ONNX with dynamic int8
+quantization of the weights, they only need onnxruntime and the tokenizers
+library at serve time.
+
+    poetry run python -m website.onnx_models cross-encoder \
+        cross-encoder/ms-marco-MiniLM-L-12-v2 models/ms-marco-MiniLM-L-12-v2
+    poetry run python -m website.onnx_models embedding \
+        sentence-transformers/all-MiniLM-L6-v2 models/all-MiniLM-L6-v2
+
+writes to the output directory:
+
+    model.onnx        -- fp32 export, dynamic batch and sequence axes
+    model.int8.onnx   -- dynamic int8 quantization of the MatMul weights
+    tokenizer.json    -- the fast tokenizer
+    config.json       -- kind, max_length, input names
+
+Serving:
+
+- `SessionPool`: a few `InferenceSession`s, each with a share of the cores,
+  so concurrent requests run side by side instead of queueing on one session.
+- Dynamic batching: inputs are sorted by token length and batched, so a batch
+  is padded to its own longest input, not the longest of the request.
+
+`OnnxCrossEncoder.predict` and `OnnxSentenceEncoder.encode` take the same
+arguments as their sentence-transformers counterparts, so they drop into
+`website.rerank.Reranker` (`RERANK_ONNX_DIR`) and the embedding callers.
+
+onnxruntime and tokenizers are the `onnx` extra; exporting also needs torch
+and transformers.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import queue
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Literal, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+Kind = Literal["cross-encoder", "embedding"]
+
+
+def length_batches(lengths: Sequence[int], batch_size: int) -> list[np.ndarray]:
+    """
+    Row indices in batches of similar length, shortest first.
+
+    >>> [rows.tolist() for rows in length_batches([5, 1, 9, 2, 6], 2)]
+    [[1, 3], [0, 4], [2]]
+    """
+    order = np.argsort(np.asarray(lengths), kind="stable")
+    return [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def export(
+    model_name: str, out_dir: Path, *, kind: Kind, max_length: int = 512
+) -> Path:
+    """
+    Export `model_name` to ONNX and quantize it, returns `out_dir`.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import (AutoModel, AutoModelForSequenceClassification,
+                              AutoTokenizer)
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if kind == "cross-encoder":
+        model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        sample = tokenizer(["question"], ["passage"], return_tensors="pt")
+        output_names = ["logits"]
+    else:
+        model = AutoModel.from_pretrained(model_name)
+        sample = tokenizer(["sentence"], return_tensors="pt")
+        output_names = ["last_hidden_state"]
+    model.eval()
+    input_names = list(sample.keys())
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes[output_names[0]] = {0: "batch"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            out_dir / "model.onnx",
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+        )
+    quantize_dynamic(
+        out_dir / "model.onnx",
+        out_dir / "model.int8.onnx",
+        weight_type=QuantType.QInt8,
+    )
+    tokenizer.save_pretrained(out_dir)
+    with open(out_dir / "config.json", "w") as f:
+        json.dump(
+            {
+                "model_name": model_name,
+                "kind": kind,
+                "max_length": min(max_length, tokenizer.model_max_length),
+                "input_names": input_names,
+            },
+            f,
+            indent=2,
+        )
+    logger.info(f"Exported {model_name} to {out_dir}")
+    return out_dir
+
+
+class SessionPool:
+    """
+    `size` onnxruntime sessions of one model, each with `threads` intra-op
+    threads. A caller borrows a session for one batch.
+    """
+
+    def __init__(
+        self,
+        model_path: Path,
+        *,
+        size: int = 2,
+        threads: Optional[int] = None,
+        sessions: Optional[list] = None,
+    ):
+        self.model_path = Path(model_path)
+        if sessions is None:
+            import onnxruntime
+
+            threads = threads or max(1, (os.cpu_count() or 1) // size)
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+            options.graph_optimization_level = (
+                onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            )
+            sessions = [
+                onnxruntime.InferenceSession(
+                    str(self.model_path),
+                    sess_options=options,
+                    providers=["CPUExecutionProvider"],
+                )
+                for _ in range(size)
+            ]
+        self.size = len(sessions)
+        self._idle: queue.Queue = queue.Queue()
+        for session in sessions:
+            self._idle.put(session)
+
+    @contextmanager
+    def session(self) -> Iterator:
+        session = self._idle.get()
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
+
+    def run(self, feeds: dict[str, np.ndarray]) -> np.ndarray:
+        with self.session() as session:
+            return session.run(None, feeds)[0]
+
+
+class OnnxModel:
+    def __init__(
+        self,
+        model_dir: Path,
+        *,
+        quantized: bool = True,
+        pool_size: int = 2,
+        threads: Optional[int] = None,
+    ):
+        from tokenizers import Tokenizer
+
+        self.model_dir = Path(model_dir)
+        with open(self.model_dir / "config.json") as f:
+            self.config = json.load(f)
+        self.input_names: list[str] = self.config["input_names"]
+        self.tokenizer = Tokenizer.from_file(str(self.model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.config["max_length"])
+        self.tokenizer.no_padding()
+        model_file = "model.int8.onnx" if quantized else "model.onnx"
+        self.pool = SessionPool(
+            self.model_dir / model_file, size=pool_size, threads=threads
+        )
+
+    def feeds(self, encodings: list) -> dict[str, np.ndarray]:
+        """
+        Pad one batch of encodings to its longest.
+        """
+        length = max(len(encoding.ids) for encoding in encodings)
+        arrays = {
+            "input_ids": np.zeros((len(encodings), length), dtype=np.int64),
+            "attention_mask": np.zeros((len(encodings), length), dtype=np.int64),
+            "token_type_ids": np.zeros((len(encodings), length), dtype=np.int64),
+        }
+        for row, encoding in enumerate(encodings):
+            n = len(encoding.ids)
+            arrays["input_ids"][row, :n] = encoding.ids
+            arrays["attention_mask"][row, :n] = encoding.attention_mask
+            arrays["token_type_ids"][row, :n] = encoding.type_ids
+        return {name: arrays[name] for name in self.input_names}
+
+    def batches(
+        self, encodings: list, batch_size: int
+    ) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        for rows in length_batches([len(e.ids) for e in encodings], batch_size):
+            yield rows, self.pool.run(self.feeds([encodings[row] for row in rows]))
+
+
+class OnnxCrossEncoder(OnnxModel):
+    def predict(
+        self, pairs: Sequence[tuple[str, str]], batch_size: int = 32, **kwargs
+    ) -> np.ndarray:
+        """
+        Relevance logits of each (question, passage), like `CrossEncoder.predict`.
+        """
+        if len(pairs) == 0:
+            return np.empty(0, dtype=np.float32)
+        encodings = self.tokenizer.encode_batch([tuple(pair) for pair in pairs])
+        scores = np.empty(len(pairs), dtype=np.float32)
+        for rows, logits in self.batches(encodings, batch_size):
+            scores[rows] = logits[:, 0]
+        return scores
+
+
+class OnnxSentenceEncoder(OnnxModel):
+    def encode(
+        self,
+        sentences: Sequence[str],
+        batch_size: int = 32,
+        normalize_embeddings: bool = False,
+        **kwargs,
+    ) -> np.ndarray:
+        """
+        Mean-pooled embeddings, like `SentenceTransformer.encode` for the
+        mean-pooling models (all-MiniLM-L6-v2 and its fine-tunes).
+        """
+        encodings = self.tokenizer.encode_batch(list(sentences))
+        embeddings: Optional[np.ndarray] = None
+        for rows, hidden in self.batches(encodings, batch_size):
+            lengths = np.array([len(encodings[row].ids) for row in rows.tolist()])
+            mask = (np.arange(hidden.shape[1]) < lengths[:, None]).astype(np.float32)
+            pooled = (hidden * mask[:, :, None]).sum(axis=1) / np.maximum(
+                mask.sum(axis=1, keepdims=True), 1e-9
+            )
+            if embeddings is None:
+                embeddings = np.empty((len(sentences), hidden.shape[-1]), np.float32)
+            embeddings[rows] = pooled
+        if embeddings is None:
+            return np.empty((0, 0), dtype=np.float32)
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings /= np.maximum(norms, 1e-12)
+        return embeddings
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("kind", choices=["cross-encoder", "embedding"])
+    parser.add_argument("model_name")
+    parser.add_argument("out_dir", type=Path)
+    parser.add_argument("--max-length", type=int, default=512)
+    args = parser.parse_args()
+    export(args.model_name, args.out_dir, kind=args.kind, max_length=args.max_length)
@@ -0,0 +1,525 @@
+"""
+Declarative, resumable runner for the topic ETL.
+
+`biohacks.main()` ran the ETL by commenting steps in and out. Here each step
+is a `Stage` with the paths it reads and writes:
+
+- order: stages are declared in pipeline order. A stage waits for every
+  earlier stage that writes what it reads or writes, or reads what it writes.
+  Everything else runs in parallel: the three topics, and the biohack types.
+- idempotent: a stage's fingerprint is a content hash of its inputs and its
+  params. It is skipped when its outputs exist and the fingerprint matches
+  the one recorded after its last run, so a rerun after a crash picks up at
+  the first stage whose inputs changed.
+- inputs and outputs are files or directories. With the columnar store
+  (`website.experience_store`) a stage can declare single columns, e.g. the
+  action scoring reads `action` and writes `action_score`, so tagging topics
+  doesn't make the scores stale.
+- `locks`: a stage that loads and saves a whole store holds its lock, so two
+  stages never save over each other's columns.
+- each stage records its wall time and, through `website.chain.llm_usage`,
+  its LLM calls, cache hits, tokens and cost. `bertopic_easy` calls its
+  models itself and is not counted.
+
+State and the hash memo live in `{ETL_STORE_DIR}/pipeline_state.json`.
+
+    poetry run python -m website.pipeline --dry-run
+    poetry run python -m website.pipeline --only "Sleep" --force "outcomes_score"
+    poetry run python -m website.pipeline --adopt   # mark the current files done
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterable, Literal, Optional
+
+from loguru import logger
+from pydantic import BaseModel
+
+from website.chain import LLMUsage, llm_usage
+
+
+@dataclass
+class Stage:
+    name: str
+    run: Callable[[], Any]
+    inputs: list[Path] = field(default_factory=list)
+    outputs: list[Path] = field(default_factory=list)
+    # LLM settings and the like, part of the fingerprint
+    params: dict[str, Any] = field(default_factory=dict)
+    # held while running, e.g. the store the stage loads and saves whole
+    locks: list[str] = field(default_factory=list)
+
+
+class StageRecord(BaseModel):
+    name: str
+    status: Literal["ran", "skipped", "adopted", "failed", "blocked"]
+    fingerprint: Optional[str] = None
+    wall_time: float = 0.0
+    usage: LLMUsage = LLMUsage()
+    finished: float = 0.0
+    error: Optional[str] = None
+
+
+class PipelineState(BaseModel):
+    stages: dict[str, StageRecord] = {}
+    # path -> (size, mtime_ns, sha256), so unchanged files are not read again
+    hashes: dict[str, tuple[int, int, str]] = {}
+
+
+def overlaps(a: Path, b: Path) -> bool:
+    """
+    >>> overlaps(Path("store"), Path("store/columns/action.json"))
+    True
+    >>> overlaps(Path("store/columns/action.json"), Path("store/meta.json"))
+    False
+    """
+    return a == b or a in b.parents or b in a.parents
+
+
+def dependencies(stages: list[Stage]) -> dict[str, set[str]]:
+    """
+    For each stage, the earlier stages it must wait for.
+    """
+    deps: dict[str, set[str]] = {}
+    for index, stage in enumerate(stages):
+        deps[stage.name] = set()
+        touched = stage.inputs + stage.outputs
+        for earlier in stages[:index]:
+            # read or write after write, or write after read
+            if any(overlaps(a, b) for a in touched for b in earlier.outputs) or any(
+                overlaps(a, b) for a in stage.outputs for b in earlier.inputs
+            ):
+                deps[stage.name].add(earlier.name)
+    return deps
+
+
+class ContentHasher:
+    def __init__(self, memo: dict[str, tuple[int, int, str]]):
+        self.memo = memo
+
+    def file(self, path: Path) -> str:
+        stat = path.stat()
+        cached = self.memo.get(str(path))
+        if cached is not None and tuple(cached[:2]) == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(functools.partial(f.read, 1 << 20), b""):
+                digest.update(chunk)
+        self.memo[str(path)] = (stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+        return digest.hexdigest()
+
+    def path(self, path: Path) -> str:
+        """
+        sha256 of a file, or of the relative names and hashes of the files
+        under a directory.
+        """
+        path = Path(path)
+        if path.is_file():
+            return self.file(path)
+        if not path.is_dir():
+            return "missing"
+        digest = hashlib.sha256()
+        for file in sorted(p for p in path.rglob("*") if p.is_file()):
+            digest.update(f"{file.relative_to(path)}\0{self.file(file)}\n".encode())
+        return digest.hexdigest()
+
+    def fingerprint(self, stage: Stage) -> str:
+        state = {
+            "params": stage.params,
+            "inputs": {str(path): self.path(path) for path in stage.inputs},
+        }
+        return hashlib.sha256(
+            json.dumps(state, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+
+class Pipeline:
+    def __init__(
+        self, stages: list[Stage], *, state_path: Path, max_parallel: int = 4
+    ):
+        names = [stage.name for stage in stages]
+        if len(set(names)) != len(names):
+            raise ValueError("Stage names must be unique")
+        self.stages = stages
+        self.state_path = Path(state_path)
+        self.max_parallel = max_parallel
+        self.deps = dependencies(stages)
+        self.state = PipelineState()
+        if self.state_path.exists():
+            self.state = PipelineState.model_validate_json(self.state_path.read_text())
+        self.hasher = ContentHasher(self.state.hashes)
+
+    def save_state(self) -> None:
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        tmp_path.write_text(self.state.model_dump_json(indent=2))
+        os.replace(tmp_path, self.state_path)
+
+    def is_fresh(self, stage: Stage, fingerprint: str) -> bool:
+        record = self.state.stages.get(stage.name)
+        return (
+            record is not None
+            and record.status in ("ran", "skipped", "adopted")
+            and record.fingerprint == fingerprint
+            and all(path.exists() for path in stage.outputs)
+        )
+
+    def plan(self) -> dict[str, bool]:
+        """
+        Whether each stage is fresh now, before anything upstream runs.
+        """
+        return {
+            stage.name: self.is_fresh(stage, self.hasher.fingerprint(stage))
+            for stage in self.stages
+        }
+
+    def adopt(self) -> None:
+        """
+        Record the current files as the output of every stage, e.g. for an
+        ETL store built before the pipeline existed.
+        """
+        for stage in self.stages:
+            self.state.stages[stage.name] = StageRecord(
+                name=stage.name,
+                status="adopted",
+                fingerprint=self.hasher.fingerprint(stage),
+                finished=time.time(),
+            )
+        self.save_state()
+
+    async def run(self, *, force: Iterable[str] = ()) -> list[StageRecord]:
+        force = set(force)
+        done = {stage.name: asyncio.Event() for stage in self.stages}
+        records: dict[str, StageRecord] = {}
+        semaphore = asyncio.Semaphore(self.max_parallel)
+        locks: dict[str, asyncio.Lock] = {}
+
+        async def run_stage(stage: Stage) -> None:
+            try:
+                await asyncio.gather(*(done[d].wait() for d in self.deps[stage.name]))
+                failed = [
+                    d
+                    for d in self.deps[stage.name]
+                    if records[d].status in ("failed", "blocked")
+                ]
+                if failed:
+                    records[stage.name] = StageRecord(
+                        name=stage.name, status="blocked", error=f"after {failed[0]}"
+                    )
+                    return
+                stage_locks = [
+                    locks.setdefault(name, asyncio.Lock())
+                    for name in sorted(set(stage.locks))
+                ]
+                async with semaphore:
+                    for lock in stage_locks:
+                        await lock.acquire()
+                    try:
+                        records[stage.name] = await self.run_one(
+                            stage, force=stage.name in force
+                        )
+                    finally:
+                        for lock in reversed(stage_locks):
+                            lock.release()
+                self.state.stages[stage.name] = records[stage.name]
+                self.save_state()
+            finally:
+                done[stage.name].set()
+
+        await asyncio.gather(*(run_stage(stage) for stage in self.stages))
+        return [records[stage.name] for stage in self.stages]
+
+    async def run_one(self, stage: Stage, *, force: bool) -> StageRecord:
+        fingerprint = await asyncio.to_thread(self.hasher.fingerprint, stage)
+        if not force and self.is_fresh(stage, fingerprint):
+            logger.info(f"{stage.name}: inputs unchanged, skipped")
+            previous = self.state.stages[stage.name]
+            return previous.model_copy(update={"status": "skipped"})
+        logger.info(f"{stage.name}: running")
+        # this task's context, shared by the tasks and threads it starts
+        usage = LLMUsage()
+        llm_usage.set(usage)
+        start = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(stage.run):
+                await stage.run()
+            else:
+                await asyncio.to_thread(stage.run)
+        except Exception as e:
+            logger.exception(f"{stage.name} failed")
+            return StageRecord(
+                name=stage.name,
+                status="failed",
+                wall_time=time.perf_counter() - start,
+                usage=usage,
+                finished=time.time(),
+                error=repr(e),
+            )
+        wall_time = time.perf_counter() - start
+        return StageRecord(
+            name=stage.name,
+            status="ran",
+            # after the run, so a stage that reads what it writes stays fresh
+            fingerprint=await asyncio.to_thread(self.hasher.fingerprint, stage),
+            wall_time=wall_time,
+            usage=usage,
+            finished=time.time(),
+        )
+
+
+def topic_pipeline() -> list[Stage]:
+    """
+    The ETL of `biohacks.main` and `biohack_topics`, in pipeline order.
+    """
+    from website import biohack_topics
+    from website.base import Base
+    from website.biohacks import TopicExperiences
+    from website.experiences import (CommentExperiences, StudyExperiences,
+                                     SubmissionExperiences)
+    from website.models import BiohackTypeEnum
+    from website.settings import ETL_STORE_DIR
+    from website.subreddit import topic_subreddits as topics
+
+    biohack_types = [t for t in BiohackTypeEnum if t != BiohackTypeEnum.other]
+    studies_dir = Path(ETL_STORE_DIR) / "study_deep_experiences_enriched"
+    scoring = dict(
+        batch_size=50, llm_name="gpt-4o-mini", max_retries=0, timeout=5
+    )
+
+    def stored(cls: type[Base], name: str) -> list[Path]:
+        # the columnar store, or the legacy JSON before the first save
+        return [
+            cls.store_path(name),
+            Path(ETL_STORE_DIR) / f"{name}.{cls.__name__}.json",
+        ]
+
+    def column(topic: str, name: str) -> Path:
+        return TopicExperiences.store_path(topic) / "columns" / f"{name}.json"
+
+    def valid_biohack_columns(topic: str) -> list[Path]:
+        # what `Experience.valid_biohack` and the topic tagging read
+        return [
+            column(topic, name)
+            for name in [
+                "action",
+                "biohack_type",
+                "action_score",
+                "outcomes_score",
+                "clinical_trial_study",
+            ]
+        ]
+
+    def scorer(topic: str, method: str, **kwargs) -> Callable:
+        async def run() -> None:
+            o = TopicExperiences.load(name=topic)
+            await getattr(o, method)(resume=True, **scoring, **kwargs)
+
+        return run
+
+    stages = []
+    for topic, subreddits in topics.items():
+        sources = stored(StudyExperiences, topic)
+        for subreddit_name in subreddits:
+            subreddit = subreddit_name.split("r/")[-1]
+            sources += stored(CommentExperiences, subreddit)
+            sources += stored(SubmissionExperiences, subreddit)
+        store = TopicExperiences.store_path(topic)
+        lock = [f"store:{topic}"]
+        stages += [
+            Stage(
+                name=f"from_all/{topic}",
+                run=functools.partial(
+                    TopicExperiences.from_all, topic=topic, subreddit_names=subreddits
+                ),
+                inputs=sources,
+                outputs=[store],
+                locks=lock,
+            ),
+            Stage(
+                name=f"dedupe/{topic}",
+                run=lambda topic=topic: TopicExperiences.load(
+                    name=topic
+                ).deduplicate_experiences(),
+                inputs=[
+                    column(topic, "permalink"),
+                    column(topic, "action"),
+                    column(topic, "outcomes"),
+                ],
+                outputs=[store],
+                locks=lock,
+            ),
+            Stage(
+                name=f"action_score/{topic}",
+                run=scorer(topic, "action_score_experiences", size=None, max_tokens=50),
+                inputs=[column(topic, "permalink"), column(topic, "action")],
+                outputs=[column(topic, "action_score")],
+                params={**scoring, "max_tokens": 50},
+                locks=lock,
+            ),
+            Stage(
+                name=f"biohack_subtype/{topic}",
+                run=scorer(
+                    topic, "extract_biohack_subtype", start=0, size=None, max_tokens=100
+                ),
+                inputs=[
+                    column(topic, "permalink"),
+                    column(topic, "action"),
+                    column(topic, "biohack_type"),
+                ],
+                outputs=[column(topic, "biohack_subtype")],
+                params={**scoring, "max_tokens": 100},
+                locks=lock,
+            ),
+            Stage(
+                name=f"outcomes_score/{topic}",
+                run=scorer(topic, "outcomes_score_experiences", size=None, max_tokens=50),
+                inputs=[column(topic, "permalink"), column(topic, "outcomes")],
+                outputs=[column(topic, "outcomes_score")],
+                params={**scoring, "max_tokens": 50},
+                locks=lock,
+            ),
+        ]
+
+    topic_columns = [path for topic in topics for path in valid_biohack_columns(topic)]
+    topic_locks = [f"store:{topic}" for topic in topics]
+    for biohack_type in biohack_types:
+        stages.append(
+            Stage(
+                name=f"unique_actions/{biohack_type.value}",
+                run=functools.partial(
+                    biohack_topics.write_unique_actions, biohack_type=biohack_type
+                ),
+                inputs=topic_columns + [studies_dir],
+                outputs=[biohack_topics.get_docs_file_path(biohack_type=biohack_type)],
+                locks=topic_locks,
+            )
+        )
+
+    def cluster(biohack_type: BiohackTypeEnum) -> None:
+        docs_file = biohack_topics.get_docs_file_path(biohack_type=biohack_type)
+        docs = json.loads(docs_file.read_text(encoding="utf-8"))
+        biohack_topics.cluster(biohack_type=biohack_type, docs=docs)
+
+    for biohack_type in biohack_types:
+        stages.append(
+            Stage(
+                name=f"cluster/{biohack_type.value}",
+                run=functools.partial(cluster, biohack_type),
+                inputs=[biohack_topics.get_docs_file_path(biohack_type=biohack_type)],
+                outputs=[biohack_topics.get_cluster_file_path(biohack_type=biohack_type)],
+                params={"namer": "o3-mini", "embedder": "text-embedding-3-large"},
+            )
+        )
+    for biohack_type in biohack_types:
+        cluster_file = biohack_topics.get_cluster_file_path(biohack_type=biohack_type)
+        stages += [
+            Stage(
+                name=f"tag/{biohack_type.value}",
+                run=functools.partial(
+                    biohack_topics.tag_experiences_with_topics, biohack_type=biohack_type
+                ),
+                inputs=[cluster_file] + topic_columns,
+                outputs=[column(topic, "biohack_topic") for topic in topics],
+                locks=topic_locks,
+            ),
+            Stage(
+                name=f"tag_studies/{biohack_type.value}",
+                run=functools.partial(
+                    biohack_topics.tag_study_experiences_with_topics,
+                    biohack_type=biohack_type,
+                ),
+                inputs=[cluster_file],
+                outputs=[studies_dir],
+            ),
+        ]
+    return stages
+
+
+def report(records: list[StageRecord]):
+    from rich.table import Table
+
+    table = Table(title="Topic pipeline")
+    for column in [
+        "Stage",
+        "Status",
+        "Wall (s)",
+        "LLM calls",
+        "Cached",
+        "Errors",
+        "Tokens",
+        "Cost ($)",
+    ]:
+        table.add_column(column)
+    total = LLMUsage()
+    for record in records:
+        usage = record.usage if record.status == "ran" else LLMUsage()
+        for name in LLMUsage.model_fields:
+            setattr(total, name, getattr(total, name) + getattr(usage, name))
+        table.add_row(
+            record.name,
+            record.status if record.error is None else f"{record.status}: {record.error}",
+            f"{record.wall_time:.1f}" if record.status == "ran" else "",
+            str(usage.calls),
+            str(usage.cached),
+            str(usage.errors),
+            f"{usage.prompt_tokens + usage.completion_tokens:,}",
+            f"{usage.cost:.2f}",
+        )
+    table.add_row(
+        "total",
+        "",
+        "",
+        str(total.calls),
+        str(total.cached),
+        str(total.errors),
+        f"{total.prompt_tokens + total.completion_tokens:,}",
+        f"{total.cost:.2f}",
+    )
+    return table
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from rich import print
+
+    from website.settings import ETL_STORE_DIR
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", default=None, help="regex of the stages to run")
+    parser.add_argument("--force", default=None, help="regex of stages to rerun")
+    parser.add_argument("--max-parallel", type=int, default=4)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--adopt", action="store_true")
+    args = parser.parse_args()
+
+    stages = topic_pipeline()
+    if args.only is not None:
+        stages = [stage for stage in stages if re.search(args.only, stage.name)]
+    pipeline = Pipeline(
+        stages,
+        state_path=Path(ETL_STORE_DIR) / "pipeline_state.json",
+        max_parallel=args.max_parallel,
+    )
+    if args.adopt:
+        pipeline.adopt()
+    elif args.dry_run:
+        for name, fresh in pipeline.plan().items():
+            print(f"{name}: {'fresh' if fresh else 'stale'}")
+    else:
+        force = [
+            stage.name
+            for stage in stages
+            if args.force is not None and re.search(args.force, stage.name)
+        ]
+        print(report(asyncio.run(pipeline.run(force=force))))
@@ -0,0 +1,296 @@
+"""
+Precomputed answers for the questions people actually ask.
+
+The homepage and the questions page steer users toward a known set of
+questions, and the access logs show a long tail of repeats. For those we don't
+need to embed, search and run 100 LLM calls per visit: a batch job
+
+    python -m website.precomputed access.log [access.log.1 ...]
+
+runs the full pipeline offline for `curated_questions` plus every question
+asked at least `min_count` times in the logs, and writes a gzipped JSON
+artifact to `PRECOMPUTED_PATH`. `/search` looks questions up in it by
+`normalize_question`, a dict lookup.
+
+The artifact records the search index version it was built against (index name
+and document count). Each worker checks it every `PRECOMPUTED_CHECK_SECONDS`;
+when the index changed, the worker holding the refresh lock rebuilds the
+artifact in the background while the stale answers keep being served, and the
+other workers reload the file once it was replaced. The lock is a file lock
+next to the artifact for the workers of one host, plus the Redis lock of the
+`ResultCache` across hosts when there is one.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import fcntl
+import gzip
+import os
+import re
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+from urllib.parse import unquote_plus
+
+from loguru import logger
+from pydantic import BaseModel
+
+from website import settings
+from website.ai_o3_summary import new_ai_summary
+from website.cache import normalize_question
+from website.models import AISummary, DynamicBiohackingTaxonomy
+from website.questions import curated_questions
+from website.search import run_search_and_enrich
+
+search_question_pattern = re.compile(r"GET /search\?(?:[^ ]*&)?question=([^ &]+)")
+
+
+class PrecomputedAnswer(BaseModel):
+    question: str
+    taxonomy: DynamicBiohackingTaxonomy
+    summary: Optional[AISummary] = None
+
+
+class PrecomputedArtifact(BaseModel):
+    version: str
+    built: float
+    answers: dict[str, PrecomputedAnswer]
+
+
+class PrecomputedStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    reloads: int = 0
+    refreshes: int = 0
+    refresh_errors: int = 0
+
+
+async def index_version(client) -> str:
+    """
+    Changes whenever documents are added to or removed from the index.
+
+    `client` must be an `azure.search.documents.aio.SearchClient`.
+    """
+    count = await client.get_document_count()
+    return f"{settings.index_name}:{count}"
+
+
+def mine_questions(log_paths: list[Path], *, min_count: int = 3) -> list[str]:
+    """
+    `/search` questions asked at least `min_count` times in uvicorn access
+    logs, most asked first.
+    """
+    counts: Counter[str] = Counter()
+    asked_as: dict[str, str] = {}
+    for log_path in log_paths:
+        with open(log_path, errors="replace") as f:
+            for line in f:
+                match = search_question_pattern.search(line)
+                if match is None:
+                    continue
+                question = unquote_plus(match.group(1)).strip()
+                key = normalize_question(question)
+                if key:
+                    counts[key] += 1
+                    asked_as.setdefault(key, question)
+    return [asked_as[key] for key, count in counts.most_common() if count >= min_count]
+
+
+async def precompute_answer(*, question: str, client) -> PrecomputedAnswer:
+    # offline, so no deadline: wait for every enrichment call
+    taxonomy = await run_search_and_enrich(
+        question=question,
+        client=client,
+        limit=100,
+        batch_size=300,
+        llm_name="gpt-4o",
+        max_tokens=100,
+        max_retries=2,
+        timeout=10,
+    )
+    summary = None
+    if taxonomy.biohack_types:
+        summary = await new_ai_summary(taxonomy=taxonomy, question=question)
+    return PrecomputedAnswer(question=question, taxonomy=taxonomy, summary=summary)
+
+
+async def precompute(
+    questions: list[str], *, client, concurrency: int = 4
+) -> PrecomputedArtifact:
+    version = await index_version(client)
+    semaphore = asyncio.Semaphore(concurrency)
+    answers: dict[str, PrecomputedAnswer] = {}
+
+    async def run(question: str) -> None:
+        async with semaphore:
+            try:
+                answer = await precompute_answer(question=question, client=client)
+            except Exception as e:
+                logger.error(f"Precomputing `{question}` failed: {e}")
+                return
+        if answer.taxonomy.biohack_types:
+            answers[normalize_question(question)] = answer
+
+    unique = {normalize_question(question): question for question in questions}
+    await asyncio.gather(*[run(question) for question in unique.values()])
+    logger.info(f"Precomputed {len(answers)}/{len(unique)} answers for {version}")
+    return PrecomputedArtifact(version=version, built=time.time(), answers=answers)
+
+
+def save(artifact: PrecomputedArtifact, path: Path) -> None:
+    # write next to it and rename, workers never read a half written file
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        f.write(artifact.model_dump_json())
+    os.replace(tmp_path, path)
+
+
+def load(path: Path) -> PrecomputedArtifact:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return PrecomputedArtifact.model_validate_json(f.read())
+
+
+class PrecomputedStore:
+    """
+    The artifact of one worker. `get` is a dict lookup, `refresh_forever` keeps
+    it in step with the search index.
+    """
+
+    def __init__(self, path: Path, *, check_seconds: float = 600):
+        self.path = Path(path)
+        self.check_seconds = check_seconds
+        self.artifact: Optional[PrecomputedArtifact] = None
+        self.mtime: Optional[float] = None
+        self.stats = PrecomputedStats()
+        self.reload()
+
+    def __len__(self) -> int:
+        return 0 if self.artifact is None else len(self.artifact.answers)
+
+    def reload(self) -> bool:
+        """
+        Load the artifact if the file changed since we last read it.
+        """
+        try:
+            mtime = self.path.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime == self.mtime:
+            return False
+        try:
+            self.artifact = load(self.path)
+        except Exception as e:
+            logger.error(f"Loading precomputed answers from {self.path} failed: {e}")
+            return False
+        self.mtime = mtime
+        self.stats.reloads += 1
+        logger.info(f"Loaded {len(self)} precomputed answers ({self.artifact.version})")
+        return True
+
+    def get(self, question: str) -> Optional[PrecomputedAnswer]:
+        answer = None
+        if self.artifact is not None:
+            answer = self.artifact.answers.get(normalize_question(question))
+        if answer is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        return answer
+
+    async def refresh(self, *, client, cache=None) -> bool:
+        """
+        Rebuild the artifact for the same questions when the index changed.
+        Only the worker that gets the file lock, and the `ResultCache` lock
+        when given, rebuilds.
+        """
+        self.reload()
+        if self.artifact is None:
+            return False
+        version = await index_version(client)
+        if version == self.artifact.version:
+            return False
+        with open(self.path.with_name(self.path.name + ".lock"), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False  # another worker is on it, we reload its file
+            try:
+                return await self.rebuild(version, client=client, cache=cache)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    async def rebuild(self, version: str, *, client, cache=None) -> bool:
+        if self.reload() and self.artifact.version == version:
+            return False  # another worker rebuilt it before we got the lock
+        token = None
+        if cache is not None:
+            token = await cache.acquire_lock("precomputed_refresh", ttl=3600)
+            if token is None:
+                return False  # a worker on another host is on it
+        try:
+            logger.info(f"Search index went {self.artifact.version} -> {version}")
+            questions = [answer.question for answer in self.artifact.answers.values()]
+            artifact = await precompute(questions, client=client)
+            save(artifact, self.path)
+            self.reload()
+            self.stats.refreshes += 1
+            return True
+        finally:
+            if token is not None:
+                await cache.release_lock("precomputed_refresh", token)
+
+    async def refresh_forever(self, *, client, cache=None) -> None:
+        while True:
+            await asyncio.sleep(self.check_seconds)
+            try:
+                await self.refresh(client=client, cache=cache)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Refreshing precomputed answers failed: {e}")
+                self.stats.refresh_errors += 1
+
+    def summary(self) -> dict:
+        return {
+            **self.stats.model_dump(),
+            "answers": len(self),
+            "version": None if self.artifact is None else self.artifact.version,
+        }
+
+
+precomputed: Optional[PrecomputedStore] = None
+if settings.precomputed_path is not None:
+    precomputed = PrecomputedStore(
+        settings.precomputed_path, check_seconds=settings.precomputed_check_seconds
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("access_logs", nargs="*", type=Path)
+    parser.add_argument("--min-count", type=int, default=3)
+    parser.add_argument("--output", type=Path, default=settings.precomputed_path)
+    args = parser.parse_args()
+    if args.output is None:
+        parser.error("set PRECOMPUTED_PATH or pass --output")
+
+    questions = curated_questions + mine_questions(
+        args.access_logs, min_count=args.min_count
+    )
+
+    async def main() -> PrecomputedArtifact:
+        client = settings.azure_search_async_client
+        try:
+            return await precompute(questions, client=client)
+        finally:
+            await client.close()
+
+    artifact = asyncio.run(main())
+    save(artifact, args.output)
+    size = Path(args.output).stat().st_size
+    print(f"Wrote {len(artifact.answers)} answers ({size:,} bytes) to {args.output}")
@@ -68,3 +68,17 @@ question = Question(
 )
 questions = []
 questions.append(question)
+
+# Asked from the homepage ("I'm feeling lucky") and the questions page, their
+# answers are precomputed, see website/precomputed.py
+curated_questions = [question.question for question in questions] + [
+    "Cancer and Diet",
+    "ADHD and Diet",
+    "Anxiety and Diet",
+    "Low iron during pregnancy",
+    "how to improve sleep naturally",
+    "best supplements for mental focus",
+    "intermittent fasting benefits",
+    "nootropics for brain health",
+    "meditation benefits for stress",
+]
@@ -0,0 +1,187 @@
+"""
+Local stand-in for the Reddit API, enough of it for praw to list a
+subreddit's new posts and fetch their comments without network access or
+credentials:
+
+- POST /api/v1/access_token
+- GET /r/{name}/about
+- GET /r/{name}/new, newest first, paged with `limit` and `after`
+- GET /comments/{id}
+
+Posts are `Submission` objects of `website.subreddit`, their comments
+included; the fixture adds the listing fields praw expects. `requests`
+keeps the paths served, so a test can check what a sync fetched.
+
+    with RedditFixture({"sleep": [submission, ...]}) as fixture:
+        reddit = fixture.reddit()
+        list(reddit.subreddit("sleep").new(limit=None))
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+from urllib.parse import parse_qs, urlparse
+
+import praw
+
+from website.subreddit import Submission
+
+
+def listing(children: list[dict[str, Any]], after: Optional[str] = None) -> dict:
+    return {
+        "kind": "Listing",
+        "data": {
+            "after": after,
+            "before": None,
+            "dist": len(children),
+            "children": children,
+        },
+    }
+
+
+def submission_thing(submission: Submission, subreddit: str) -> dict:
+    data = submission.model_dump(exclude={"comments", "relevant"})
+    data.update(subreddit=subreddit, name=f"t3_{submission.id}")
+    return {"kind": "t3", "data": data}
+
+
+def comment_thing(comment: Any, submission: Submission, subreddit: str) -> dict:
+    data = comment.model_dump(
+        exclude={
+            "previous_comment_text",
+            "submission_title",
+            "submission_selftext",
+            "enrichment",
+            "submission_question",
+            "relevant",
+        }
+    )
+    data.update(
+        subreddit=subreddit,
+        name=f"t1_{comment.id}",
+        link_id=f"t3_{submission.id}",
+        parent_id=comment.parent_id or f"t3_{submission.id}",
+        replies="",
+    )
+    return {"kind": "t1", "data": data}
+
+
+class RedditFixture:
+    def __init__(
+        self,
+        subreddits: dict[str, list[Submission]],
+        about: Optional[dict[str, dict[str, Any]]] = None,
+    ):
+        self.subreddits = subreddits
+        self.about = about or {}
+        self.requests: list[str] = []
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        assert self.server is not None, "use the fixture in a with block"
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reddit(self) -> praw.Reddit:
+        return praw.Reddit(
+            client_id="fixture",
+            client_secret="fixture",
+            user_agent="fixture",
+            oauth_url=self.url,
+            reddit_url=self.url,
+            check_for_updates=False,
+            check_for_async=False,
+        )
+
+    def new(self, name: str, *, limit: int, after: Optional[str]) -> dict:
+        submissions = sorted(
+            self.subreddits[name], key=lambda s: s.created_utc or 0, reverse=True
+        )
+        start = 0
+        if after is not None:
+            fullnames = [f"t3_{s.id}" for s in submissions]
+            start = fullnames.index(after) + 1
+        page = submissions[start : start + limit]
+        next_after = None
+        if start + limit < len(submissions):
+            next_after = f"t3_{page[-1].id}"
+        return listing([submission_thing(s, name) for s in page], after=next_after)
+
+    def comments(self, submission_id: str) -> list[dict]:
+        for name, submissions in self.subreddits.items():
+            for s in submissions:
+                if s.id == submission_id:
+                    comments = [comment_thing(c, s, name) for c in s.comments or []]
+                    return [listing([submission_thing(s, name)]), listing(comments)]
+        raise KeyError(submission_id)
+
+    def respond(self, method: str, path: str, query: dict[str, list[str]]) -> Any:
+        parts = [part for part in path.split("/") if part]
+        if method == "POST" and parts == ["api", "v1", "access_token"]:
+            return {
+                "access_token": "fixture",
+                "expires_in": 3600,
+                "scope": "*",
+                "token_type": "bearer",
+            }
+        if len(parts) == 3 and parts[0] == "r" and parts[2] == "about":
+            name = parts[1]
+            about = {
+                "display_name": name,
+                "title": name,
+                "name": f"t5_{name}",
+                "description": "",
+                "public_description": "",
+                "subscribers": 0,
+                **self.about.get(name, {}),
+            }
+            return {"kind": "t5", "data": about}
+        if len(parts) == 3 and parts[0] == "r" and parts[2] == "new":
+            limit = int(query.get("limit", ["25"])[0])
+            after = query.get("after", [None])[0]
+            return self.new(parts[1], limit=limit, after=after)
+        if len(parts) >= 2 and parts[0] == "comments":
+            return self.comments(parts[1])
+        raise KeyError(path)
+
+    def __enter__(self) -> RedditFixture:
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_method(self, method: str) -> None:
+                url = urlparse(self.path)
+                fixture.requests.append(url.path)
+                if method == "POST":
+                    self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                try:
+                    body = json.dumps(fixture.respond(method, url.path, parse_qs(url.query)))
+                    status = 200
+                except (KeyError, ValueError):
+                    body, status = json.dumps({"error": 404}), 404
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body.encode())))
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+            def do_GET(self) -> None:
+                self.handle_method("GET")
+
+            def do_POST(self) -> None:
+                self.handle_method("POST")
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        assert self.server is not None
+        self.server.shutdown()
+        self.server.server_close()
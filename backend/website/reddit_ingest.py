@@ -0,0 +1,262 @@
+"""
+Incremental Reddit ingestion.
+
+`FetchedSubreddit.from_reddit_api` walks `hot(limit=None)`, builds every
+submission and its comments in memory and rewrites one
+`subreddit_{name}_submissions.json` per subreddit, hours per refresh. A
+sync here only fetches what is new:
+
+    {REDDIT_DIR}/subreddit_{name}/
+        state.json            -- metadata and the high-water mark
+        shards/{time}.jsonl   -- one `Submission` per line, one shard per sync,
+                                 named by its start in nanoseconds
+
+- `new` lists posts newest first; a sync stops at the newest post of the
+  previous one (`created_utc`, and its fullname for posts of the same
+  second), so a daily refresh fetches a day of posts.
+- each submission is appended to the sync's shard, and flushed, as soon as
+  its comments are fetched; nothing else is held in memory.
+- the mark moves only once the shard is complete and fsynced. A crashed
+  sync starts over from the old mark, and `read_submissions` skips the posts
+  it had already written.
+- the first sync of a subreddit with a legacy JSON dump turns the dump into
+  the first shard and starts from its newest post.
+
+Reddit listings stop at 1000 posts, so a subreddit with more new posts
+between two syncs loses the oldest of them; the sync logs a warning.
+Comments added to posts after their sync are not fetched again.
+
+`FetchedSubreddit.load_from_subreddit_name` reads the shards when a
+subreddit has been synced. `website.reddit_fixture` stands in for the API
+in tests.
+
+    poetry run python -m website.reddit_ingest r/sleep r/insomnia
+    poetry run python -m website.reddit_ingest --topic Sleep
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+import praw
+from loguru import logger
+from pydantic import BaseModel
+
+from website.settings import REDDIT_DIR
+from website.subreddit import FetchedSubreddit, Submission, reddit_client
+
+
+class SyncState(BaseModel):
+    display_name: str
+    title: str
+    public_description: str
+    subscribers: Optional[int] = None
+    # the newest post of the last complete sync
+    newest_utc: Optional[float] = None
+    newest_fullname: Optional[str] = None
+    shards: list[str] = []
+    submissions: int = 0
+    comments: int = 0
+    synced: Optional[float] = None
+
+
+class SyncReport(BaseModel):
+    subreddit: str
+    listed: int = 0
+    submissions: int = 0
+    comments: int = 0
+    skipped: int = 0
+    seconds: float = 0.0
+    reached_mark: bool = True
+
+
+def subreddit_dir(name: str) -> Path:
+    return Path(REDDIT_DIR) / f"subreddit_{name}"
+
+
+def legacy_path(name: str) -> Path:
+    return Path(REDDIT_DIR) / f"subreddit_{name}_submissions.json"
+
+
+def load_state(name: str) -> Optional[SyncState]:
+    path = subreddit_dir(name) / "state.json"
+    if not path.exists():
+        return None
+    return SyncState.model_validate_json(path.read_text())
+
+
+def save_state(state: SyncState) -> None:
+    path = subreddit_dir(state.display_name) / "state.json"
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(state.model_dump_json(indent=2))
+    os.replace(tmp_path, path)
+
+
+def read_shard(path: Path) -> Iterator[Submission]:
+    with open(path) as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break  # the post being written when a sync crashed
+            yield Submission.model_validate_json(line)
+
+
+def read_submissions(name: str) -> Iterator[Submission]:
+    """
+    The synced submissions, newest shard first, each post once.
+    """
+    shards_dir = subreddit_dir(name) / "shards"
+    seen = set()
+    shards = sorted(shards_dir.glob("*.jsonl"), key=lambda p: int(p.stem))
+    for path in reversed(shards):
+        for submission in read_shard(path):
+            if submission.id not in seen:
+                seen.add(submission.id)
+                yield submission
+
+
+def load_synced(name: str) -> Optional[FetchedSubreddit]:
+    state = load_state(name)
+    if state is None:
+        return None
+    return FetchedSubreddit(
+        display_name=state.display_name,
+        title=state.title,
+        public_description=state.public_description,
+        subscribers=state.subscribers,
+        submissions=list(read_submissions(name)),
+    )
+
+
+def bootstrap(name: str, state: SyncState) -> SyncState:
+    """
+    The legacy dump as the first shard, its newest post as the mark.
+    """
+    path = legacy_path(name)
+    if not path.exists():
+        return state
+    logger.info(f"{name}: starting from {path}")
+    legacy = FetchedSubreddit.load_from_subreddit_name(name, legacy=True)
+    shard = subreddit_dir(name) / "shards" / "0.jsonl"
+    write_shard(shard, legacy.submissions)
+    newest = max(legacy.submissions, key=lambda s: s.created_utc or 0, default=None)
+    return state.model_copy(
+        update={
+            "newest_utc": None if newest is None else newest.created_utc,
+            "newest_fullname": None if newest is None else newest.name,
+            "shards": [shard.name],
+            "submissions": len(legacy.submissions),
+            "comments": sum(len(s.comments or []) for s in legacy.submissions),
+        }
+    )
+
+
+def write_shard(path: Path, submissions: list[Submission]) -> None:
+    with open(path, "w") as f:
+        for submission in submissions:
+            f.write(submission.model_dump_json() + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def sync_subreddit(
+    subreddit_name: str, *, reddit: Optional[praw.Reddit] = None
+) -> SyncReport:
+    reddit = reddit or reddit_client
+    name = subreddit_name.replace("r/", "")
+    report = SyncReport(subreddit=name)
+    start = time.perf_counter()
+    subreddit = reddit.subreddit(name)
+    (subreddit_dir(name) / "shards").mkdir(parents=True, exist_ok=True)
+    state = load_state(name)
+    if state is None:
+        state = SyncState(
+            display_name=name,
+            title=subreddit.title,
+            public_description=subreddit.public_description,
+        )
+        state = bootstrap(name, state)
+    state.subscribers = subreddit.subscribers
+
+    shard = subreddit_dir(name) / "shards" / f"{time.time_ns()}.jsonl"
+    newest: Optional[tuple[float, str]] = None
+    report.reached_mark = state.newest_utc is None
+    with open(shard, "a") as f:
+        for post in subreddit.new(limit=None):
+            if state.newest_utc is not None and (
+                post.created_utc < state.newest_utc
+                or post.name == state.newest_fullname
+            ):
+                report.reached_mark = True
+                break
+            report.listed += 1
+            if newest is None:
+                newest = (post.created_utc, post.name)
+            try:
+                submission = Submission.from_praw(post)
+            except Exception as e:
+                # not relevant, or deleted
+                logger.debug(f"{name}: skipping {post.name}: {e}")
+                report.skipped += 1
+                continue
+            f.write(submission.model_dump_json() + "\n")
+            f.flush()
+            report.submissions += 1
+            report.comments += len(submission.comments or [])
+        os.fsync(f.fileno())
+    if not report.reached_mark:
+        logger.warning(
+            f"{name}: the listing ended before the last sync's newest post, "
+            "older new posts were missed"
+        )
+
+    if report.submissions == 0:
+        shard.unlink()
+    else:
+        state.shards.append(shard.name)
+    if newest is not None:
+        state.newest_utc, state.newest_fullname = newest
+    state.submissions += report.submissions
+    state.comments += report.comments
+    state.synced = time.time()
+    save_state(state)
+    report.seconds = time.perf_counter() - start
+    logger.info(
+        f"{name}: {report.submissions} new submissions, {report.comments} comments, "
+        f"{report.skipped} skipped in {report.seconds:.1f}s"
+    )
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from rich import print
+    from rich.table import Table
+
+    from website.subreddit import topic_subreddits
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("subreddits", nargs="*")
+    parser.add_argument("--topic", choices=list(topic_subreddits), default=None)
+    args = parser.parse_args()
+
+    names = list(args.subreddits)
+    if args.topic is not None:
+        names += topic_subreddits[args.topic]
+    table = Table(title="Reddit sync")
+    for column in ["Subreddit", "Listed", "New", "Comments", "Skipped", "Seconds"]:
+        table.add_column(column)
+    for name in names:
+        r = sync_subreddit(name)
+        table.add_row(
+            r.subreddit,
+            str(r.listed),
+            str(r.submissions),
+            str(r.comments),
+            str(r.skipped),
+            f"{r.seconds:.1f}",
+        )
+    print(table)
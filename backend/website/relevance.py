@@ -0,0 +1,473 @@
+"""
+Relevance prefilter in front of the `enrich_biohacks` LLM calls.
+
+`enrich_biohacks` asks gpt-4o, one call per biohack, whether the biohack is
+relevant to the question and for its `why_care` sentence. Most answers are
+clear-cut. A logistic model over a few cheap features decides those locally:
+
+- `cosine`: the question embedding against the biohack topic embedding, both
+  from the `EmbeddingCache` (one batched request for the missing topics).
+- `overlap`: share of the question's words in the topic and the actions.
+- `experiences`: log of the number of experiences behind the biohack.
+- `score`: mean action + outcomes score of the experiences.
+- `rank`: position in the search ranking, 0 first and 1 last.
+
+With the model's probability p of the LLM saying relevant:
+
+- `p >= high`: relevant. The `top_k` most probable still go to the LLM for
+  their `why_care`, the others are kept without one.
+- `p <= low`: dropped without a call.
+- in between: the LLM decides, as before.
+
+Training data is the LLM's own decisions: with `RELEVANCE_LOG_PATH` set,
+`enrich_biohacks` appends each answer, its features and its latency to a
+JSONL file. Once a model is loaded only the biohacks it sends to the LLM are
+logged, so retraining sees more of the uncertain band.
+
+    poetry run python -m website.relevance evaluate decisions.jsonl
+    poetry run python -m website.relevance train decisions.jsonl relevance.json
+
+`evaluate` fits on part of the questions and replays the rest: agreement with
+the logged LLM decisions against the LLM calls, dollars and request latency
+saved, per band. `train` fits on all of them and writes the model for
+`RELEVANCE_MODEL_PATH`.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import json
+import math
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel
+
+from website import settings
+from website.bm25 import tokenize
+from website.cache import normalize_question
+from website.local_index import normalize
+from website.models import DynamicBiohack
+
+feature_names = ["cosine", "overlap", "experiences", "score", "rank"]
+
+
+def biohack_features(
+    question: str,
+    question_vector: np.ndarray,
+    biohacks: Sequence[DynamicBiohack],
+    topic_vectors: np.ndarray,
+) -> np.ndarray:
+    """
+    (len(biohacks), len(feature_names)) features, in the order of
+    `feature_names`.
+    """
+    features = np.zeros((len(biohacks), len(feature_names)), dtype=np.float32)
+    if len(biohacks) == 0:
+        return features
+    cosines = normalize(topic_vectors) @ normalize(question_vector[None, :])[0]
+    question_tokens = set(tokenize(question))
+    for row, biohack in enumerate(biohacks):
+        words = set(tokenize(biohack.biohack_topic or ""))
+        for experience in biohack.experiences:
+            words.update(tokenize(experience.action or ""))
+        scores = [
+            e.action_score + e.outcomes_score
+            for e in biohack.experiences
+            if e.action_score is not None and e.outcomes_score is not None
+        ]
+        features[row] = [
+            cosines[row],
+            len(question_tokens & words) / max(len(question_tokens), 1),
+            math.log1p(len(biohack.experiences)),
+            np.mean(scores) if scores else 0.0,
+            row / max(len(biohacks) - 1, 1),
+        ]
+    return features
+
+
+async def afeatures(
+    question: str, biohacks: Sequence[DynamicBiohack], embedding_cache
+) -> np.ndarray:
+    """
+    `biohack_features` with the vectors of `embedding_cache`.
+    """
+    question_vector = np.asarray(await embedding_cache.aembed_query(question))
+    topic_vectors = await embedding_cache.aembed_documents(
+        [biohack.biohack_topic or "" for biohack in biohacks]
+    )
+    return biohack_features(question, question_vector, biohacks, topic_vectors)
+
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-np.clip(x, -30, 30)))
+
+
+class RelevanceModel(BaseModel):
+    """
+    Logistic regression over the standardized features.
+    """
+
+    feature_names: list[str]
+    weights: list[float]
+    bias: float
+    mean: list[float]
+    scale: list[float]
+    low: float = 0.1
+    high: float = 0.9
+    trained_on: int = 0
+
+    @classmethod
+    def fit(
+        cls,
+        features: np.ndarray,
+        labels: Sequence[bool],
+        *,
+        l2: float = 1.0,
+        iterations: int = 25,
+        low: float = 0.1,
+        high: float = 0.9,
+    ) -> RelevanceModel:
+        """
+        Newton's method on the L2-penalized log loss, the bias unpenalized.
+        """
+        features = np.asarray(features, dtype=np.float64)
+        y = np.asarray(labels, dtype=np.float64)
+        mean = features.mean(axis=0)
+        scale = features.std(axis=0)
+        scale[scale == 0] = 1.0
+        x = np.hstack([(features - mean) / scale, np.ones((len(features), 1))])
+        penalty = np.full(x.shape[1], l2)
+        penalty[-1] = 0.0
+        w = np.zeros(x.shape[1])
+        for _ in range(iterations):
+            p = sigmoid(x @ w)
+            gradient = x.T @ (p - y) + penalty * w
+            hessian = (x.T * (p * (1 - p))) @ x + np.diag(penalty) + 1e-9 * np.eye(
+                x.shape[1]
+            )
+            step = np.linalg.solve(hessian, gradient)
+            w -= step
+            if np.abs(step).max() < 1e-6:
+                break
+        return cls(
+            feature_names=feature_names,
+            weights=w[:-1].tolist(),
+            bias=float(w[-1]),
+            mean=mean.tolist(),
+            scale=scale.tolist(),
+            low=low,
+            high=high,
+            trained_on=len(y),
+        )
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """
+        Probability that the LLM finds each biohack relevant.
+        """
+        x = (np.asarray(features, dtype=np.float64) - self.mean) / self.scale
+        return sigmoid(x @ np.asarray(self.weights) + self.bias)
+
+    def save(self, path: Path) -> None:
+        Path(path).write_text(self.model_dump_json(indent=2))
+
+    @classmethod
+    def load(cls, path: Path) -> RelevanceModel:
+        return cls.model_validate_json(Path(path).read_text())
+
+
+class Tiers(BaseModel):
+    # rows asked to the LLM, in search order
+    llm: list[int]
+    # rows the model is sure of, most probable first; some are in `llm` too
+    relevant: list[int]
+    dropped: list[int]
+
+    @property
+    def kept(self) -> list[int]:
+        """
+        Relevant rows kept without asking the LLM, so without a `why_care`.
+        """
+        asked = set(self.llm)
+        return [row for row in self.relevant if row not in asked]
+
+
+def split(
+    probabilities: np.ndarray, *, low: float, high: float, top_k: int
+) -> Tiers:
+    """
+    >>> tiers = split(np.array([0.95, 0.5, 0.05, 0.99]), low=0.1, high=0.9, top_k=1)
+    >>> tiers.llm, tiers.relevant, tiers.dropped, tiers.kept
+    ([1, 3], [3, 0], [2], [0])
+    """
+    probabilities = np.asarray(probabilities)
+    relevant = np.flatnonzero(probabilities >= high)
+    relevant = relevant[np.argsort(-probabilities[relevant], kind="stable")]
+    uncertain = np.flatnonzero((probabilities > low) & (probabilities < high))
+    return Tiers(
+        llm=sorted(uncertain.tolist() + relevant[:top_k].tolist()),
+        relevant=relevant.tolist(),
+        dropped=np.flatnonzero(probabilities <= low).tolist(),
+    )
+
+
+class Decision(BaseModel):
+    time: float
+    question: str
+    biohack_topic: Optional[str] = None
+    features: list[float]
+    relevant: bool
+    why_care: Optional[str] = None
+    # seconds from the start of the enrichment to this answer
+    latency: float
+    llm_name: str
+
+
+class DecisionLog:
+    """
+    Append-only JSONL of the LLM's relevance decisions, shared by the
+    workers.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def append(self, decisions: Sequence[Decision]) -> None:
+        if not decisions:
+            return
+        lines = "".join(decision.model_dump_json() + "\n" for decision in decisions)
+        with open(self.path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(lines)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read(self) -> list[Decision]:
+        decisions = []
+        with open(self.path) as f:
+            for line in f:
+                if line.endswith("\n"):  # skip a half written last line
+                    decisions.append(Decision.model_validate_json(line))
+        return decisions
+
+
+relevance_model: Optional[RelevanceModel] = None
+if settings.relevance_model_path is not None:
+    try:
+        relevance_model = RelevanceModel.load(settings.relevance_model_path)
+    except (OSError, ValueError) as e:
+        logger.error(f"Relevance model {settings.relevance_model_path}: {e}")
+
+decision_log: Optional[DecisionLog] = None
+if settings.relevance_log_path is not None:
+    decision_log = DecisionLog(settings.relevance_log_path)
+
+
+async def prefilter(
+    question: str,
+    biohacks: Sequence[DynamicBiohack],
+    embedding_cache,
+    *,
+    top_k: Optional[int] = None,
+) -> tuple[Optional[np.ndarray], Tiers]:
+    """
+    The features of `biohacks` and their tiers. Without a model every row
+    goes to the LLM; the features are only computed when a model or the
+    decision log needs them, and are None if embedding failed.
+    """
+    top_k = settings.relevance_top_k if top_k is None else top_k
+    everything = Tiers(llm=list(range(len(biohacks))), relevant=[], dropped=[])
+    if (relevance_model is None and decision_log is None) or not biohacks:
+        return None, everything
+    try:
+        features = await afeatures(question, biohacks, embedding_cache)
+    except Exception as e:
+        logger.warning(f"Relevance features failed, asking the LLM for all: {e}")
+        return None, everything
+    if relevance_model is None:
+        return features, everything
+    tiers = split(
+        relevance_model.predict(features),
+        low=relevance_model.low,
+        high=relevance_model.high,
+        top_k=top_k,
+    )
+    logger.info(
+        f"Relevance prefilter: {len(tiers.llm)} of {len(biohacks)} to the LLM, "
+        f"{len(tiers.kept)} kept, {len(tiers.dropped)} dropped"
+    )
+    return features, tiers
+
+
+class Evaluation(BaseModel):
+    questions: int = 0
+    decisions: int = 0
+    llm_calls: int = 0
+    # local decisions that differ from the logged LLM decision
+    false_keeps: int = 0
+    false_drops: int = 0
+    relevant: int = 0
+    # relevant biohacks shown with a `why_care`
+    with_why_care: int = 0
+    # per question: the slowest logged call, and the slowest call still made
+    latencies: list[float] = []
+    tiered_latencies: list[float] = []
+
+    @property
+    def agreement(self) -> float:
+        disagreements = self.false_keeps + self.false_drops
+        return 1 - disagreements / self.decisions if self.decisions else 0.0
+
+    @property
+    def calls_saved(self) -> float:
+        return 1 - self.llm_calls / self.decisions if self.decisions else 0.0
+
+
+def group_by_question(decisions: Sequence[Decision]) -> dict[str, list[Decision]]:
+    groups: dict[str, list[Decision]] = {}
+    for decision in decisions:
+        groups.setdefault(normalize_question(decision.question), []).append(decision)
+    return groups
+
+
+def evaluate(
+    model: RelevanceModel,
+    decisions: Sequence[Decision],
+    *,
+    low: Optional[float] = None,
+    high: Optional[float] = None,
+    top_k: int = 10,
+) -> Evaluation:
+    """
+    Replay the logged decisions of each question through the tiers.
+    """
+    low = model.low if low is None else low
+    high = model.high if high is None else high
+    evaluation = Evaluation()
+    for group in group_by_question(decisions).values():
+        features = np.array([decision.features for decision in group])
+        tiers = split(model.predict(features), low=low, high=high, top_k=top_k)
+        asked = set(tiers.llm)
+        relevant = set(tiers.relevant)
+        evaluation.questions += 1
+        evaluation.decisions += len(group)
+        evaluation.llm_calls += len(asked)
+        for row, decision in enumerate(group):
+            if row in asked:
+                # the LLM's answer stands, a relevant one with its why_care
+                evaluation.relevant += int(decision.relevant)
+                evaluation.with_why_care += int(decision.relevant)
+            elif row in relevant:
+                evaluation.relevant += 1
+                evaluation.false_keeps += int(not decision.relevant)
+            else:
+                evaluation.false_drops += int(decision.relevant)
+        evaluation.latencies.append(max(decision.latency for decision in group))
+        evaluation.tiered_latencies.append(
+            max((group[row].latency for row in asked), default=0.0)
+        )
+    return evaluation
+
+
+def train_test_split(
+    decisions: Sequence[Decision], *, test_share: float = 0.2, seed: int = 0
+) -> tuple[list[Decision], list[Decision]]:
+    """
+    Split by question, so no question is in both halves.
+    """
+    questions = sorted(group_by_question(decisions))
+    rng = np.random.default_rng(seed)
+    n_test = max(1, round(len(questions) * test_share))
+    test_questions = set(rng.permutation(questions)[:n_test].tolist())
+    train, test = [], []
+    for decision in decisions:
+        in_test = normalize_question(decision.question) in test_questions
+        (test if in_test else train).append(decision)
+    return train, test
+
+
+def fit_decisions(decisions: Sequence[Decision], **kwargs) -> RelevanceModel:
+    features = np.array([decision.features for decision in decisions])
+    return RelevanceModel.fit(features, [d.relevant for d in decisions], **kwargs)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from rich import print
+    from rich.table import Table
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["evaluate", "train"])
+    parser.add_argument("log_path", type=Path)
+    parser.add_argument("model_path", type=Path, nargs="?", default=None)
+    parser.add_argument("--low", type=float, default=0.1)
+    parser.add_argument("--high", type=float, default=0.9)
+    parser.add_argument("--l2", type=float, default=1.0)
+    parser.add_argument("--top-k", type=int, default=settings.relevance_top_k)
+    parser.add_argument("--test-share", type=float, default=0.2)
+    # ~1k prompt tokens at $2.50/M and ~100 completion tokens at $10/M
+    parser.add_argument("--cost-per-call", type=float, default=0.0035)
+    args = parser.parse_args()
+
+    decisions = DecisionLog(args.log_path).read()
+    if args.command == "train":
+        if args.model_path is None:
+            raise SystemExit("train needs the model path to write")
+        model = fit_decisions(decisions, l2=args.l2, low=args.low, high=args.high)
+        model.save(args.model_path)
+        print(model)
+        raise SystemExit(0)
+
+    if args.model_path is not None:
+        model, test = RelevanceModel.load(args.model_path), decisions
+    else:
+        train, test = train_test_split(decisions, test_share=args.test_share)
+        model = fit_decisions(train, l2=args.l2)
+    print(dict(zip(model.feature_names, model.weights)))
+
+    table = Table(
+        title=f"Relevance prefilter on {len(test)} decisions, top {args.top_k} asked"
+    )
+    for column in [
+        "Low",
+        "High",
+        "Agreement",
+        "False keeps",
+        "False drops",
+        "LLM calls saved",
+        "$ saved / 1k questions",
+        "why_care coverage",
+        "p50 latency (s)",
+        "p95 latency (s)",
+    ]:
+        table.add_column(column)
+    thresholds = [(args.low, args.high), (0.05, 0.95), (0.2, 0.8), (0.3, 0.7)]
+    start = time.perf_counter()
+    for low, high in dict.fromkeys(thresholds):
+        evaluation = evaluate(model, test, low=low, high=high, top_k=args.top_k)
+        saved = evaluation.decisions - evaluation.llm_calls
+        coverage = (
+            evaluation.with_why_care / evaluation.relevant if evaluation.relevant else 0
+        )
+        table.add_row(
+            f"{low:.2f}",
+            f"{high:.2f}",
+            f"{evaluation.agreement:.3f}",
+            str(evaluation.false_keeps),
+            str(evaluation.false_drops),
+            f"{evaluation.calls_saved:.1%}",
+            f"{1000 * saved * args.cost_per_call / max(evaluation.questions, 1):.2f}",
+            f"{coverage:.1%}",
+            f"{np.percentile(evaluation.latencies, 50):.2f}"
+            f" -> {np.percentile(evaluation.tiered_latencies, 50):.2f}",
+            f"{np.percentile(evaluation.latencies, 95):.2f}"
+            f" -> {np.percentile(evaluation.tiered_latencies, 95):.2f}",
+        )
+    print(table)
+    print(f"Replayed in {time.perf_counter() - start:.3f}s")
@@ -0,0 +1,201 @@
+"""
+Cross-encoder reranking of the biohacks before the LLM enrichment.
+
+`enrich_biohacks` asks gpt-4o whether each of the ~100 biohacks of a search is
+relevant. A cross-encoder on CPU scores every (question, biohack) pair in a
+few batched forward passes, so only the `rerank_top_k` best biohacks go to
+the LLM: fewer calls, and the slowest of fewer calls sets the p95.
+
+- The model (`RERANK_MODEL`, e.g. cross-encoder/ms-marco-MiniLM-L-12-v2) is
+  loaded on first use, or at startup, and then kept for the worker's life.
+- Scores are cached per (normalized question, biohack text) in an LRU, so a
+  repeated question or a biohack seen under several questions is scored once.
+- With `RERANK_ONNX_DIR`, the int8 ONNX export of the model runs on
+  onnxruntime instead (`website.onnx_models`, the `onnx` extra).
+- sentence-transformers is an optional dependency (the `dev` extra). Without
+  it, or without `RERANK_MODEL`, the search keeps every biohack.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel
+
+from website import settings
+from website.cache import normalize_question
+from website.models import DynamicBiohack
+
+
+class RerankStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    batches: int = 0
+
+
+def biohack_text(biohack: DynamicBiohack, experiences: int = 3) -> str:
+    """
+    What the cross-encoder reads of a biohack: its topic and a few of its
+    experiences, well inside the model's 512 tokens.
+    """
+    lines = [biohack.biohack_topic or ""]
+    for experience in biohack.experiences[:experiences]:
+        lines.append(f"{experience.action}. {experience.outcomes}")
+    return "\n".join(lines)
+
+
+class Reranker:
+    def __init__(
+        self,
+        model_name: str,
+        *,
+        onnx_dir: Optional[str] = None,
+        batch_size: int = 32,
+        max_entries: int = 50_000,
+    ):
+        self.model_name = model_name
+        self.onnx_dir = onnx_dir
+        self.batch_size = batch_size
+        self.max_entries = max_entries
+        self.stats = RerankStats()
+        self._model = None
+        self._load_lock = threading.Lock()
+        # one request at a time: the model is not safe to call from two
+        # threads at once, and the forward passes would compete for the cores
+        self._lock = threading.Lock()
+        self._scores: OrderedDict[tuple[str, str], float] = OrderedDict()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    self._model = self._load()
+        return self._model
+
+    def _load(self):
+        if self.onnx_dir is not None:
+            from website.onnx_models import OnnxCrossEncoder
+
+            logger.info(f"Loading ONNX cross-encoder {self.onnx_dir}")
+            return OnnxCrossEncoder(self.onnx_dir)
+        from sentence_transformers.cross_encoder import CrossEncoder
+
+        logger.info(f"Loading cross-encoder {self.model_name}")
+        return CrossEncoder(self.model_name, device="cpu")
+
+    def warm(self) -> None:
+        try:
+            self.model
+        except Exception as e:
+            # e.g. sentence-transformers missing: searches then skip reranking
+            logger.error(f"Cross-encoder {self.model_name} failed to load: {e}")
+
+    def scores(self, question: str, texts: Sequence[str]) -> np.ndarray:
+        """
+        Relevance logits of each text to `question`, higher is more relevant.
+        """
+        with self._lock:
+            return self._cached_scores(question, texts)
+
+    def _cached_scores(self, question: str, texts: Sequence[str]) -> np.ndarray:
+        question = normalize_question(question)
+        scores = np.empty(len(texts), dtype=np.float32)
+        missing: dict[str, list[int]] = {}
+        for index, text in enumerate(texts):
+            score = self._scores.get((question, text))
+            if score is None:
+                missing.setdefault(text, []).append(index)
+            else:
+                self._scores.move_to_end((question, text))
+                scores[index] = score
+        self.stats.hits += len(texts) - sum(len(rows) for rows in missing.values())
+        self.stats.misses += len(missing)
+        if missing:
+            pairs = [(question, text) for text in missing]
+            predicted = self.model.predict(pairs, batch_size=self.batch_size)
+            self.stats.batches += -(-len(pairs) // self.batch_size)
+            predicted = np.asarray(predicted, dtype=np.float32).tolist()
+            for (text, rows), score in zip(missing.items(), predicted):
+                scores[rows] = score
+                self._scores[(question, text)] = score
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+        return scores
+
+    def top_biohacks(
+        self, question: str, biohacks: list[DynamicBiohack], k: int
+    ) -> list[DynamicBiohack]:
+        """
+        The `k` biohacks most relevant to `question`, most relevant first.
+        """
+        if len(biohacks) <= k:
+            return biohacks
+        scores = self.scores(question, [biohack_text(b) for b in biohacks])
+        best = np.argsort(-scores, kind="stable")[:k]
+        return [biohacks[row] for row in best.tolist()]
+
+    def summary(self) -> dict:
+        return {
+            **self.stats.model_dump(),
+            "model": self.model_name,
+            "onnx": self.onnx_dir is not None,
+            "loaded": self._model is not None,
+            "entries": len(self._scores),
+        }
+
+
+reranker: Optional[Reranker] = None
+if settings.rerank_model is not None or settings.rerank_onnx_dir is not None:
+    reranker = Reranker(
+        settings.rerank_model or settings.rerank_onnx_dir,
+        onnx_dir=settings.rerank_onnx_dir,
+        batch_size=settings.rerank_batch_size,
+    )
+
+
+async def rerank_biohacks(
+    question: str, biohacks: list[DynamicBiohack], k: Optional[int] = None
+) -> list[DynamicBiohack]:
+    """
+    The top `k` (default `RERANK_TOP_K`) biohacks by the cross-encoder, or
+    all of them when reranking is off or fails. Runs in a thread, the
+    forward passes are CPU-bound.
+    """
+    k = settings.rerank_top_k if k is None else k
+    if reranker is None or len(biohacks) <= k:
+        return biohacks
+    try:
+        return await asyncio.to_thread(reranker.top_biohacks, question, biohacks, k)
+    except Exception as e:
+        logger.warning(f"Reranking failed, enriching all {len(biohacks)}: {e}")
+        return biohacks
+
+
+if __name__ == "__main__":
+    import time
+
+    from rich import print
+
+    from website.search import arun_search_hits, hits_to_biohacks
+    from website.settings import azure_search_async_client
+
+    question = "Iron and pregnancy"
+    reranker = reranker or Reranker("cross-encoder/ms-marco-MiniLM-L-12-v2")
+    hits = asyncio.run(
+        arun_search_hits(
+            question=question, client=azure_search_async_client, limit=100
+        )
+    )
+    biohacks = hits_to_biohacks(hits)
+    for _ in range(2):
+        start = time.perf_counter()
+        top = reranker.top_biohacks(question, biohacks, 30)
+        print(f"{len(biohacks)} -> {len(top)} in {time.perf_counter() - start:.3f}s")
+    print([biohack.biohack_topic for biohack in top])
+    print(reranker.summary())
@@ -0,0 +1,259 @@
+"""
+Spread the calls for one model over its regional deployments.
+
+`chain.endpoints` has the primary deployment of each model and
+`chain.backup_endpoints` the others. For every call the router
+
+- picks the healthy deployment with the fewest outstanding requests per unit
+  of weight
+- opens a deployment's circuit for `open_seconds` after `failure_threshold`
+  consecutive 429s, timeouts, connection errors or 5xxs, then lets one call
+  through to probe it
+- fails over to another deployment when a call fails that way
+- hedges: when a call takes longer than the deployment's p95 latency, sends a
+  duplicate to another deployment and keeps whichever answers first
+
+so one throttled region doesn't turn into search timeouts.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Optional
+
+from loguru import logger
+from openai import (APIConnectionError, APITimeoutError, InternalServerError,
+                    RateLimitError)
+from pydantic import BaseModel
+
+# relative share of the traffic, 1 when not listed
+weights: dict[str, float] = {}
+
+
+def is_endpoint_failure(e: BaseException) -> bool:
+    """
+    Errors that say something about the deployment rather than the prompt,
+    also when instructor wrapped them.
+    """
+    failures = (
+        RateLimitError,
+        APITimeoutError,
+        APIConnectionError,
+        InternalServerError,
+        asyncio.TimeoutError,
+    )
+    while e is not None:
+        if isinstance(e, failures):
+            return True
+        e = e.__cause__  # type: ignore
+    return False
+
+
+class EndpointStats(BaseModel):
+    requests: int = 0
+    failures: int = 0
+    hedges: int = 0
+    circuit_opened: int = 0
+    p95: Optional[float] = None
+    outstanding: int = 0
+    healthy: bool = True
+
+
+class EndpointState:
+    def __init__(self, *, url: str, weight: float = 1.0, window: int = 200):
+        self.url = url
+        self.weight = weight
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.stats = EndpointStats()
+
+    def half_open(self, now: float, failure_threshold: int) -> bool:
+        return self.consecutive_failures >= failure_threshold and self.healthy(now)
+
+    def healthy(self, now: float) -> bool:
+        # half-open, the probe is out and the other calls wait for its answer
+        return self.open_until <= now and not self.probing
+
+    def p95(self, min_samples: int = 20) -> Optional[float]:
+        if len(self.latencies) < min_samples:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def load(self) -> float:
+        return (self.outstanding + 1) / self.weight
+
+
+class Router:
+    def __init__(
+        self,
+        *,
+        name: str,
+        urls: list[str],
+        failure_threshold: int = 3,
+        open_seconds: float = 30,
+        hedge: bool = True,
+        min_hedge_delay: float = 0.05,
+    ):
+        self.name = name
+        self.endpoints = [
+            EndpointState(url=url, weight=weights.get(url, 1.0)) for url in urls
+        ]
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.hedge = hedge
+        self.min_hedge_delay = min_hedge_delay
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def pick(self, exclude: tuple = ()) -> Optional[EndpointState]:
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e not in exclude]
+        healthy = [e for e in candidates if e.healthy(now)]
+        if healthy:
+            return min(healthy, key=lambda e: e.load())
+        if candidates and not exclude:
+            # every circuit is open, the one closest to closing is the best bet
+            return min(candidates, key=lambda e: e.open_until)
+        return None
+
+    def launch(
+        self, endpoint: EndpointState, fn: Callable[[str], Awaitable[Any]]
+    ) -> asyncio.Task:
+        # count it right away so the next pick sees it, not when the task starts
+        endpoint.outstanding += 1
+        endpoint.stats.requests += 1
+        probe = endpoint.half_open(time.monotonic(), self.failure_threshold)
+        if probe:
+            endpoint.probing = True
+        task = asyncio.create_task(self.attempt(endpoint, fn))
+        task.add_done_callback(lambda _: self.landed(endpoint, probe))
+        return task
+
+    def landed(self, endpoint: EndpointState, probe: bool = False) -> None:
+        endpoint.outstanding -= 1
+        if probe:
+            # closed on success, opened again on failure, else the next probe
+            endpoint.probing = False
+
+    async def attempt(
+        self, endpoint: EndpointState, fn: Callable[[str], Awaitable[Any]]
+    ) -> Any:
+        start = time.monotonic()
+        try:
+            result = await fn(endpoint.url)
+        except Exception as e:
+            if is_endpoint_failure(e):
+                self.failed(endpoint)
+            raise
+        endpoint.latencies.append(time.monotonic() - start)
+        endpoint.consecutive_failures = 0
+        return result
+
+    def failed(self, endpoint: EndpointState) -> None:
+        endpoint.stats.failures += 1
+        endpoint.consecutive_failures += 1
+        if endpoint.consecutive_failures >= self.failure_threshold:
+            endpoint.open_until = time.monotonic() + self.open_seconds
+            endpoint.stats.circuit_opened += 1
+            logger.warning(
+                f"{self.name}: circuit open for {endpoint.url} for {self.open_seconds}s"
+            )
+
+    async def call(self, fn: Callable[[str], Awaitable[Any]]) -> Any:
+        """
+        `fn(url)` makes the call against one deployment.
+        """
+        primary = self.pick()
+        if primary is None:
+            raise ValueError(f"No endpoints for {self.name}")
+        tried = [primary]
+        tasks = {self.launch(primary, fn)}
+        try:
+            hedge_delay = primary.p95() if self.hedge and len(self) > 1 else None
+            if hedge_delay is not None:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=max(hedge_delay, self.min_hedge_delay)
+                )
+                backup = None if done else self.pick(exclude=tuple(tried))
+                if backup is not None:
+                    backup.stats.hedges += 1
+                    tried.append(backup)
+                    tasks.add(self.launch(backup, fn))
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if tasks or error is None or not is_endpoint_failure(error):
+                    continue
+                # fail over to a deployment we haven't tried yet
+                backup = self.pick(exclude=tuple(tried))
+                if backup is not None:
+                    logger.warning(f"{self.name}: failing over to {backup.url}")
+                    tried.append(backup)
+                    tasks.add(self.launch(backup, fn))
+            assert error is not None
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def snapshot(self) -> dict[str, dict]:
+        now = time.monotonic()
+        snapshot = {}
+        for endpoint in self.endpoints:
+            endpoint.stats.p95 = endpoint.p95()
+            endpoint.stats.outstanding = endpoint.outstanding
+            endpoint.stats.healthy = endpoint.healthy(now)
+            snapshot[endpoint.url] = endpoint.stats.model_dump()
+        return snapshot
+
+
+class RoutedCompletions:
+    def __init__(self, router: Router, clients: dict[str, Any]):
+        self.router = router
+        self.clients = clients
+
+    async def create(self, **kwargs) -> Any:
+        return await self.router.call(
+            lambda url: self.clients[url].chat.completions.create(**kwargs)
+        )
+
+
+class RoutedClient:
+    """
+    Stands in for an async instructor client, `client.chat.completions.create`
+    goes to whichever deployment the router picks.
+    """
+
+    def __init__(self, router: Router, clients: dict[str, Any]):
+        self.router = router
+        self.clients = clients
+        self.chat = SimpleNamespace(completions=RoutedCompletions(router, clients))
+
+
+routers: dict[str, Router] = {}
+
+
+def get_router(name: str, urls: list[str]) -> Router:
+    router = routers.get(name)
+    if router is None:
+        router = Router(name=name, urls=urls)
+        routers[name] = router
+    return router
+
+
+def router_stats() -> dict[str, dict]:
+    return {name: router.snapshot() for name, router in routers.items()}
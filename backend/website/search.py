@@ -4,7 +4,7 @@ import asyncio
 import os
 import time
 from collections import defaultdict
-from typing import Any, Iterable, Literal, Optional
+from typing import Any, AsyncIterator, Iterable, Literal, Optional
 
 from azure.search.documents.models import VectorizedQuery
 from dotenv import load_dotenv
@@ -15,15 +15,21 @@ from pydantic import BaseModel, Field
 from rich import print
 from rich.traceback import install
 from website.chain import Chain
+from website.columns import HitColumns, biohacks_to_taxonomy
+from website.dedupe import dedupe_experiences
 
 # install(show_locals=True)
 install()
 
 from langchain_openai import AzureOpenAIEmbeddings
+from website.embedding_cache import EmbeddingCache
 from website.experiences import Experience
 from website.models import (BiohackTypeGroup, DynamicBiohack,
                             DynamicBiohackingTaxonomy)
-from website.settings import azure_search_client, console
+from website.relevance import Decision, decision_log, prefilter
+from website.rerank import rerank_biohacks
+from website.settings import (azure_search_async_client, azure_search_client,
+                              console, embedding_cache_dir)
 
 openai_large = AzureOpenAIEmbeddings(
     # Usage examples:
@@ -34,6 +40,9 @@ openai_large = AzureOpenAIEmbeddings(
     azure_endpoint="https://openai-rg-nobsmed.openai.azure.com/",
     api_key=os.environ["API_KEY"],
 )
+embedding_cache = EmbeddingCache(
+    embeddings=openai_large, max_entries=4096, store_dir=embedding_cache_dir
+)
 
 
 def clean(experience: Experience):
@@ -57,29 +66,78 @@ def clean(experience: Experience):
     return experience
 
 
+def hits_to_experiences(hits: Iterable[dict]) -> list[Experience]:
+    experiences = []
+    for hit in hits:
+        experience = Experience(**hit)
+        experience = clean(experience)
+        experiences.append(experience)
+    experiences = sorted(experiences, key=lambda x: x.score, reverse=True)
+    return experiences
+
+
 def run_search_query(*, question: str, client, limit: int):
     console.print(f"Client: {client}", style="info")
     console.print(f"Searching for: {question}", style="info")
 
-    vector_query = VectorizedQuery(
-        vector=openai_large.embed_query(question),
-        k_nearest_neighbors=limit,
-        fields="health_disorderVector",
-    )
+    vector_queries = []
+    try:
+        vector_queries.append(
+            VectorizedQuery(
+                vector=embedding_cache.embed_query(question),
+                k_nearest_neighbors=limit,
+                fields="health_disorderVector",
+            )
+        )
+    except Exception as e:
+        # e.g. offline with the local index, BM25 alone still finds something
+        logger.warning(f"Embedding the question failed, text search only: {e}")
 
     hybrid_results = client.search(
-        vector_queries=[vector_query],  # shape similarity
+        vector_queries=vector_queries,  # shape similarity
         search_text=question,  # BM25 - probabilistic
         # select=["health_disorder", "action", "outcomes", "url"],
         top=limit,
     )
-    experiences = []
-    for hit in hybrid_results:
-        experience = Experience(**hit)
-        experience = clean(experience)
-        experiences.append(experience)
-    experiences = sorted(experiences, key=lambda x: x.score, reverse=True)
-    return experiences
+    return hits_to_experiences(hybrid_results)
+
+
+async def arun_search_hits(*, question: str, client, limit: int) -> list[dict]:
+    """
+    The raw hits of `arun_search_query`.
+
+    `client` must be an `azure.search.documents.aio.SearchClient`.
+    """
+    console.print(f"Searching for: {question}", style="info")
+
+    vector_queries = []
+    try:
+        vector_queries.append(
+            VectorizedQuery(
+                vector=await embedding_cache.aembed_query(question),
+                k_nearest_neighbors=limit,
+                fields="health_disorderVector",
+            )
+        )
+    except Exception as e:
+        logger.warning(f"Embedding the question failed, text search only: {e}")
+
+    hybrid_results = await client.search(
+        vector_queries=vector_queries,  # shape similarity
+        search_text=question,  # BM25 - probabilistic
+        top=limit,
+    )
+    return [hit async for hit in hybrid_results]
+
+
+async def arun_search_query(*, question: str, client, limit: int):
+    """
+    Same as `run_search_query` but doesn't block the event loop.
+
+    `client` must be an `azure.search.documents.aio.SearchClient`.
+    """
+    hits = await arun_search_hits(question=question, client=client, limit=limit)
+    return hits_to_experiences(hits)
 
 
 def make_taxonomy(
@@ -87,76 +145,26 @@ def make_taxonomy(
     experiences: list[Experience],
 ) -> DynamicBiohackingTaxonomy:
     start = time.time()
-    # deduplicate experiences
-    existing = set()
-    deduplicated = []
-    for experience in experiences:
-        action_outcome = f"{experience.action} {experience.outcomes}"
-        if action_outcome not in existing:
-            deduplicated.append(experience)
-            existing.add(action_outcome)
-    experiences = deduplicated
-    experiences = [clean(experience) for experience in experiences]
-
-    dynamic_biohacks: list[DynamicBiohack] = []
-    biohack_topic2experiences = defaultdict(list)
-    pertinent_experiences = []
-    for experience in experiences:
-        experience = clean(experience)
-        pertinent_experiences.append(experience)
-        biohack_topic2experiences[experience.biohack_topic].append(experience)
-
-    for k, v in biohack_topic2experiences.items():
-        dynamic_biohack = DynamicBiohack(biohack_topic=k, experiences=v)
-        dynamic_biohacks.append(dynamic_biohack)
-
-    biohack_type2biohack = defaultdict(list)
-    enriched_biohacks = []
-    for biohack in dynamic_biohacks:
-        enriched_biohacks.append(biohack)
-        biohack_type2biohack[biohack.biohack_type].append(biohack)
-
-    biohack_type_groups: list[BiohackTypeGroup] = []
-    for biohack_type, biohacks in biohack_type2biohack.items():
-        biohack_type_group = BiohackTypeGroup(
-            biohack_type=biohack_type, biohacks=biohacks
-        )
-        biohack_type_groups.append(biohack_type_group)
-
-    taxonomy = DynamicBiohackingTaxonomy(
-        biohack_types=biohack_type_groups,
-        count_experiences=len(pertinent_experiences),
-        count_reddits=sum(
-            [
-                1
-                for experience in pertinent_experiences
-                if experience.source_type == "reddit"
-            ]
-        ),
-        count_studies=sum(
-            [
-                1
-                for experience in pertinent_experiences
-                if experience.source_type == "study"
-            ]
-        ),
-    )
+    # dedupe on (action, outcomes) and group, without an Experience per step
+    columns = HitColumns.from_experiences(experiences).dedupe()
+    taxonomy = biohacks_to_taxonomy(columns.to_biohacks())
     taxo_time = time.time() - start
     print(f"Taxo time: {taxo_time}")
     return taxonomy
 
-    # deduplicate experiences
 
+class EnrichStats(BaseModel):
+    """
+    The LLM calls of `enrich_biohacks`, to tell a complete run from one cut
+    off by its deadline, `min_results` or failed calls.
+    """
+
+    asked: int = 0
+    answered: int = 0
 
-def dedupe_experiences(experiences: Iterable[Experience]) -> None:
-    existing = set()
-    deduplicated = []
-    for experience in experiences:
-        action_outcome = f"{experience.action} {experience.outcomes}"
-        if action_outcome not in existing:
-            deduplicated.append(experience)
-            existing.add(action_outcome)
-    experiences = deduplicated
+    @property
+    def complete(self) -> bool:
+        return self.answered == self.asked
 
 
 def experiences2biohacks(
@@ -165,22 +173,16 @@ def experiences2biohacks(
     """
     Group experiences into dynamic biohacks.
     """
-    dedupe_experiences(experiences)
-    d = {}
-    for experience in experiences:
-        experience = clean(experience)
-        if experience.biohack_topic not in d:
-            d[experience.biohack_topic] = []
-        d[experience.biohack_topic].append(experience)
-
-    dynamic_biohacks = []
-    for k, v in d.items():
-        dynamic_biohack = DynamicBiohack(
-            biohack_topic=k,
-            experiences=v,
-        )
-        dynamic_biohacks.append(dynamic_biohack)
-    return dynamic_biohacks
+    experiences = dedupe_experiences(experiences)
+    return HitColumns.from_experiences(experiences).to_biohacks()
+
+
+def hits_to_biohacks(hits: Iterable[dict]) -> list[DynamicBiohack]:
+    """
+    Same as `experiences2biohacks(hits_to_experiences(hits))`, but the hits
+    stay columns until the grouped `HitRecord`s are built.
+    """
+    return HitColumns.from_hits(hits).dedupe().to_biohacks()
 
 
 async def enrich_biohacks(
@@ -194,7 +196,21 @@ async def enrich_biohacks(
     timeout: int,
     start: int = 0,
     size: Optional[int] = None,
+    deadline: Optional[float] = None,
+    min_results: Optional[int] = None,
+    stats: Optional[EnrichStats] = None,
 ) -> list[DynamicBiohack]:
+    """
+    Keep the biohacks the LLM finds relevant, with their `why_care`.
+
+    Stops waiting after `deadline` seconds or once `min_results` relevant
+    biohacks are in, whichever comes first, and drops the stragglers.
+    `stats` counts the calls asked and answered.
+
+    With a relevance model (`website.relevance`), only its uncertain band and
+    its top relevant biohacks are asked; the other relevant ones are kept
+    without a `why_care` and the irrelevant ones dropped.
+    """
 
     question = question.strip()
 
@@ -260,28 +276,71 @@ async def enrich_biohacks(
             prompt = template.render(question=input.question, biohack=input.biohack)
             return prompt
 
-    input_objects = [Input(question=question, biohack=biohack) for biohack in biohacks]
-    responses = await EnrichChain.batch_predict(
+    def is_relevant(response) -> bool:
+        if not isinstance(response, Output):
+            return False  # Skip if response is not of type Output
+        if not response.relevant:
+            return False
+        if response.why_care is None or response.why_care.strip() == "":
+            return False  # Skip if why_care is not empty
+        return True
+
+    features, tiers = await prefilter(question, biohacks, embedding_cache)
+    # relevant by the prefilter, unless the LLM is asked and says otherwise
+    index2biohack = {index: biohacks[index] for index in tiers.relevant}
+    if min_results is not None:
+        min_results = max(1, min_results - len(tiers.kept))
+    input_objects = [
+        Input(question=question, biohack=biohacks[index]) for index in tiers.llm
+    ]
+    if stats is not None:
+        stats.asked += len(input_objects)
+    decisions = []
+    started = time.perf_counter()
+    async for llm_index, response in EnrichChain.iter_predict(
         size=batch_size,  # 300
         llm_name=llm_name,
         input_objects=input_objects,
         max_tokens=max_tokens,  # 100
         max_retries=max_retries,  # 0
         timeout=timeout,  # 1
-    )
-    enriched_biohacks = []
-
-    for biohack, response in zip(biohacks, responses):
-        if not isinstance(response, Output):
-            continue  # Skip if response is not of type Output
-        if not response.relevant:
+        call_deadline=timeout,
+        deadline=deadline,
+        min_results=min_results,
+        is_result=is_relevant,
+    ):
+        index = tiers.llm[llm_index]
+        if stats is not None and isinstance(response, Output):
+            stats.answered += 1
+        if features is not None and isinstance(response, Output):
+            decisions.append(
+                Decision(
+                    time=time.time(),
+                    question=question,
+                    biohack_topic=biohacks[index].biohack_topic,
+                    features=features[index].tolist(),
+                    relevant=is_relevant(response),
+                    why_care=response.why_care,
+                    latency=time.perf_counter() - started,
+                    llm_name=llm_name,
+                )
+            )
+        if not is_relevant(response):
+            if isinstance(response, Output):
+                index2biohack.pop(index, None)
             continue
-        if response.why_care is None or response.why_care.strip() == "":
-            continue  # Skip if why_care is not empty
+        biohack = biohacks[index]
         biohack.why_care = response.why_care.strip()
 
         print(biohack.why_care)
-        enriched_biohacks.append(biohack)
+        index2biohack[index] = biohack
+    if decision_log is not None and decisions:
+        try:
+            decision_log.append(decisions)
+        except OSError as e:
+            logger.warning(f"Relevance decisions not logged: {e}")
+    # keep the search ranking, not the completion order
+    enriched_biohacks = [index2biohack[index] for index in sorted(index2biohack)]
     return enriched_biohacks
 
 
@@ -297,40 +356,7 @@ def enriched_biohacks_to_taxonomy(
     Returns:
         DynamicBiohackingTaxonomy: Organized taxonomy grouped by biohack type
     """
-    # Group biohacks by their biohack_type
-    biohack_type2biohack = defaultdict(list)
-    all_experiences = []
-
-    for biohack in enriched_biohacks:
-        biohack_type2biohack[biohack.biohack_type].append(biohack)
-        all_experiences.extend(biohack.experiences)
-
-    # Create BiohackTypeGroup objects
-    biohack_type_groups: list[BiohackTypeGroup] = []
-    for biohack_type, biohacks in biohack_type2biohack.items():
-        biohack_type_group = BiohackTypeGroup(
-            biohack_type=biohack_type, biohacks=biohacks
-        )
-        biohack_type_groups.append(biohack_type_group)
-
-    # Calculate counts
-    count_experiences = len(all_experiences)
-    count_reddits = sum(
-        1 for experience in all_experiences if experience.source_type == "reddit"
-    )
-    count_studies = sum(
-        1 for experience in all_experiences if experience.source_type == "study"
-    )
-
-    # Create and return the taxonomy
-    taxonomy = DynamicBiohackingTaxonomy(
-        biohack_types=biohack_type_groups,
-        count_experiences=count_experiences,
-        count_reddits=count_reddits,
-        count_studies=count_studies,
-    )
-
-    return taxonomy
+    return biohacks_to_taxonomy(enriched_biohacks)
 
 
 async def run_search_and_enrich(
@@ -343,12 +369,17 @@ async def run_search_and_enrich(
     max_tokens: int = 100,
     max_retries: int = 0,
     timeout: int = 1,
+    deadline: Optional[float] = None,
+    min_results: Optional[int] = None,
 ) -> DynamicBiohackingTaxonomy:
     """
     Run a search query and enrich the results with LLM.
+
+    `client` must be an `azure.search.documents.aio.SearchClient`.
     """
-    experiences = run_search_query(question=question, client=client, limit=limit)
-    biohacks = experiences2biohacks(experiences)
+    hits = await arun_search_hits(question=question, client=client, limit=limit)
+    biohacks = await rerank_biohacks(question, hits_to_biohacks(hits))
+    stats = EnrichStats()
     enriched_biohacks = await enrich_biohacks(
         biohacks=biohacks,
         question=question,
@@ -357,11 +388,71 @@ async def run_search_and_enrich(
         max_tokens=max_tokens,
         max_retries=max_retries,
         timeout=timeout,
+        deadline=deadline,
+        min_results=min_results,
+        stats=stats,
     )
     taxonomy = enriched_biohacks_to_taxonomy(enriched_biohacks)
+    taxonomy.complete = stats.complete
     return taxonomy
 
 
+async def stream_search_and_enrich(
+    *,
+    question: str,
+    client,
+    limit: int = 100,
+    batch_size: int = 300,
+    llm_name: str = "gpt-4o",
+    max_tokens: int = 100,
+    max_retries: int = 0,
+    timeout: int = 1,
+    deadline: Optional[float] = None,
+    stats: Optional[EnrichStats] = None,
+) -> AsyncIterator[BiohackTypeGroup]:
+    """
+    Same as `run_search_and_enrich` but yields each biohack type group as soon
+    as the LLM responses for its biohacks land, so the page can render the
+    first group without waiting on the slowest one. `stats` adds up the
+    calls of all the groups.
+
+    `client` must be an `azure.search.documents.aio.SearchClient`.
+    """
+    hits = await arun_search_hits(question=question, client=client, limit=limit)
+    biohacks = await rerank_biohacks(question, hits_to_biohacks(hits))
+    biohack_type2biohacks = defaultdict(list)
+    for biohack in biohacks:
+        biohack_type2biohacks[biohack.biohack_type].append(biohack)
+
+    async def enrich_group(biohack_type: str, biohacks: list[DynamicBiohack]):
+        enriched_biohacks = await enrich_biohacks(
+            biohacks=biohacks,
+            question=question,
+            batch_size=batch_size,
+            llm_name=llm_name,
+            max_tokens=max_tokens,
+            max_retries=max_retries,
+            timeout=timeout,
+            deadline=deadline,
+            stats=stats,
+        )
+        return BiohackTypeGroup(biohack_type=biohack_type, biohacks=enriched_biohacks)
+
+    tasks = [
+        asyncio.create_task(enrich_group(biohack_type, biohacks))
+        for biohack_type, biohacks in biohack_type2biohacks.items()
+    ]
+    try:
+        for next_group in asyncio.as_completed(tasks):
+            biohack_type_group = await next_group
+            if biohack_type_group.biohacks:
+                yield biohack_type_group
+    finally:
+        # the client went away, don't keep paying for the other groups
+        for task in tasks:
+            task.cancel()
+
+
 if __name__ == "__main__":
     question = "Iron and pregnancy"
     limit = 20
@@ -399,7 +490,7 @@ if __name__ == "__main__":
     taxonomy = asyncio.run(
         run_search_and_enrich(
             question=question,
-            client=azure_search_client,
+            client=azure_search_async_client,
             limit=limit,
             batch_size=300,
             llm_name="gpt-4o",
@@ -13,6 +13,7 @@ load_dotenv(find_dotenv(".env"))
 load_dotenv(find_dotenv(".secret"))
 
 ETL_STORE_DIR = "/Users/borisdev/workspace/nobsmed/data/etl_store"
+REDDIT_DIR = "/Users/borisdev/workspace/nobsmed/data/subreddits"
 custom_theme = Theme({"info": "dim cyan", "warning": "magenta", "danger": "bold red"})
 console = Console(theme=custom_theme)
 
@@ -51,12 +52,130 @@ try:
 except KeyError:
     logger.error("LOGFIRE_ENVIRONMENT not set")
     logfire_env = "local"
+try:
+    # e.g. redis://:password@redis:6379/0 -- shared result cache for all uvicorn workers
+    redis_url = os.environ["REDIS_URL"]
+except KeyError:
+    logger.error("REDIS_URL not set, result cache is local to each worker")
+    redis_url = None
+try:
+    # on a mounted volume so question embeddings survive container restarts
+    embedding_cache_dir = os.environ["EMBEDDING_CACHE_DIR"]
+except KeyError:
+    logger.error("EMBEDDING_CACHE_DIR not set, question embeddings kept in memory only")
+    embedding_cache_dir = None
+try:
+    # SQLite file of validated LLM responses, shared by the workers and the ETL
+    llm_cache_path = os.environ["LLM_CACHE_PATH"]
+except KeyError:
+    logger.error("LLM_CACHE_PATH not set, LLM responses are not cached")
+    llm_cache_path = None
+try:
+    llm_cache_ttl = float(os.environ["LLM_CACHE_TTL"])
+except KeyError:
+    llm_cache_ttl = 30 * 24 * 3600.0
+try:
+    llm_cache_max_mb = int(os.environ["LLM_CACHE_MAX_MB"])
+except KeyError:
+    llm_cache_max_mb = 1024
+try:
+    # memory-mapped vector index built by `python -m website.local_index`
+    local_index_dir = os.environ["LOCAL_INDEX_DIR"]
+except KeyError:
+    logger.error("LOCAL_INDEX_DIR not set, searches go to Azure Search")
+    local_index_dir = None
+try:
+    # gzip artifact of precomputed answers, see website/precomputed.py
+    precomputed_path = os.environ["PRECOMPUTED_PATH"]
+except KeyError:
+    logger.error("PRECOMPUTED_PATH not set, no precomputed answers are served")
+    precomputed_path = None
+try:
+    # how often a worker checks whether the search index changed under the artifact
+    precomputed_check_seconds = float(os.environ["PRECOMPUTED_CHECK_SECONDS"])
+except KeyError:
+    precomputed_check_seconds = 600.0
+try:
+    # cross-encoder that picks the biohacks worth an LLM call, see website/rerank.py
+    rerank_model = os.environ["RERANK_MODEL"]
+except KeyError:
+    logger.error("RERANK_MODEL not set, every biohack goes to the LLM")
+    rerank_model = None
+try:
+    # int8 ONNX export of the cross-encoder, see website/onnx_models.py
+    rerank_onnx_dir = os.environ["RERANK_ONNX_DIR"]
+except KeyError:
+    rerank_onnx_dir = None
+try:
+    rerank_top_k = int(os.environ["RERANK_TOP_K"])
+except KeyError:
+    rerank_top_k = 30
+try:
+    rerank_batch_size = int(os.environ["RERANK_BATCH_SIZE"])
+except KeyError:
+    rerank_batch_size = 32
+try:
+    # logistic prefilter in front of the enrichment calls, see website/relevance.py
+    relevance_model_path = os.environ["RELEVANCE_MODEL_PATH"]
+except KeyError:
+    logger.error("RELEVANCE_MODEL_PATH not set, the LLM decides every biohack")
+    relevance_model_path = None
+try:
+    # JSONL of the LLM's relevance decisions, the prefilter's training data
+    relevance_log_path = os.environ["RELEVANCE_LOG_PATH"]
+except KeyError:
+    relevance_log_path = None
+try:
+    # relevant biohacks still sent to the LLM for their why_care
+    relevance_top_k = int(os.environ["RELEVANCE_TOP_K"])
+except KeyError:
+    relevance_top_k = 10
+try:
+    # shared httpx pool of the Azure OpenAI clients, per worker
+    llm_max_connections = int(os.environ["LLM_MAX_CONNECTIONS"])
+except KeyError:
+    llm_max_connections = 200
+try:
+    llm_max_keepalive_connections = int(os.environ["LLM_MAX_KEEPALIVE_CONNECTIONS"])
+except KeyError:
+    llm_max_keepalive_connections = 50
+try:
+    llm_keepalive_expiry = float(os.environ["LLM_KEEPALIVE_EXPIRY"])
+except KeyError:
+    llm_keepalive_expiry = 60.0
+try:
+    # seconds before a stalled o3 summary call gives up and frees its slot
+    summary_timeout = float(os.environ["SUMMARY_TIMEOUT"])
+except KeyError:
+    summary_timeout = 600.0
+try:
+    # comma separated chat completions URLs of other gpt-4o deployments, the
+    # router fails over and hedges the live enrichment calls to them
+    gpt_4o_backup_endpoints = [
+        url.strip()
+        for url in os.environ["GPT_4O_BACKUP_ENDPOINTS"].split(",")
+        if url.strip()
+    ]
+except KeyError:
+    logger.error("GPT_4O_BACKUP_ENDPOINTS not set, gpt-4o calls have no failover")
+    gpt_4o_backup_endpoints = []
 
 # console.print(f"redis_host: {redis_host}", style="info")
 console.print(f"opensearch_host: {opensearch_host}", style="info")
 console.print(f"logfire_send_to_logfire: {logfire_send_to_logfire}", style="info")
 console.print(f"web_app_env: {web_app_env}", style="info")
 console.print(f"logfire_env: {logfire_env}", style="info")
+console.print(f"redis_url set: {redis_url is not None}", style="info")
+console.print(f"llm_cache_path: {llm_cache_path}", style="info")
+console.print(f"precomputed_path: {precomputed_path}", style="info")
+console.print(f"local_index_dir: {local_index_dir}", style="info")
+console.print(f"rerank_model: {rerank_model} (top {rerank_top_k})", style="info")
+console.print(f"relevance_model_path: {relevance_model_path}", style="info")
+console.print(
+    f"llm pool: {llm_max_connections} connections, "
+    f"{llm_max_keepalive_connections} keep-alive for {llm_keepalive_expiry}s",
+    style="info",
+)
 console.print("THIS IS NEW ************************ FIXED LOGFIRE BUG", style="info")
 
 # try:
@@ -113,7 +232,12 @@ azure_search_endpoint = os.environ["AZURE_SEARCH_SERVICE_ENDPOINT"]
 azure_search_key = os.environ["AZURE_SEARCH_API_KEY"]
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
 
 azure_search_client = SearchClient(
     azure_search_endpoint, index_name, AzureKeyCredential(azure_search_key)
 )
+# one async client per worker, its aiohttp connection pool is shared by all requests
+azure_search_async_client = AsyncSearchClient(
+    azure_search_endpoint, index_name, AzureKeyCredential(azure_search_key)
+)
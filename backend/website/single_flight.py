@@ -0,0 +1,225 @@
+"""
+Single-flight request coalescing.
+
+When a shared link goes viral many users search the same question at the
+same moment. Instead of running the search + LLM enrichment pipeline once per
+request, the first caller (the leader) runs it and everyone else awaits the
+leader's result.
+
+- SingleFlight: in-process, concurrent callers await the same task
+- SharedSingleFlight: cross-worker, the leader holds a lock in the shared
+  cache and hands the result off through the cache
+- StreamFlight: for streamed results (/stream_search), the leader's items
+  are replayed to the other subscribers as they come, and the collected
+  result goes through a `SharedSingleFlight`, so the followers on other
+  workers and on /search get it too
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Optional
+
+from loguru import logger
+from pydantic import BaseModel
+
+from website.cache import ResultCache
+
+
+class FlightStats(BaseModel):
+    leaders: int = 0
+    followers: int = 0
+    shared_followers: int = 0
+    lock_timeouts: int = 0
+    stream_followers: int = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self.stats = FlightStats()
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats.leaders += 1
+            # run as its own task so a disconnecting leader doesn't cancel the followers
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats.followers += 1
+            logger.info(f"Coalescing request for `{key}` with the in-flight one")
+        return await asyncio.shield(task)
+
+
+class SharedSingleFlight:
+    def __init__(
+        self,
+        *,
+        cache: ResultCache,
+        lock_ttl: float = 60,
+        poll_interval: float = 0.25,
+        handoff_ttl: int = 60,
+        handoff_prefix: str = "flight:",
+    ):
+        self.cache = cache
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self.handoff_ttl = handoff_ttl
+        self.handoff_prefix = handoff_prefix
+        self.local = SingleFlight()
+
+    @property
+    def stats(self) -> FlightStats:
+        return self.local.stats
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        return await self.local.do(key, lambda: self._do_shared(key, fn))
+
+    async def _do_shared(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        handoff_key = self.handoff_prefix + key
+        deadline = time.monotonic() + self.lock_ttl
+        waited = False
+        while True:
+            token: Optional[str] = await self.cache.acquire_lock(key, ttl=self.lock_ttl)
+            if token is not None:
+                try:
+                    if waited:
+                        # the leader may have handed off and released the lock
+                        # after our last read
+                        result = await self._handoff(handoff_key)
+                        if result is not None:
+                            return result
+                    result = await fn()
+                    await self.cache.set(handoff_key, result, ttl=self.handoff_ttl)
+                    return result
+                finally:
+                    await self.cache.release_lock(key, token)
+
+            # another worker is the leader, wait for its result
+            waited = True
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                result = await self._handoff(handoff_key)
+                if result is not None:
+                    return result
+                if not await self.cache.is_locked(key):
+                    # it may have handed off between the two reads
+                    result = await self._handoff(handoff_key)
+                    if result is not None:
+                        return result
+                    break  # the leader failed or died, try to become the leader
+            else:
+                logger.warning(f"Gave up waiting on the leader for `{key}`")
+                self.stats.lock_timeouts += 1
+                return await fn()
+
+    async def _handoff(self, handoff_key: str) -> Any:
+        result = await self.cache.get(handoff_key)
+        if result is not None:
+            self.stats.shared_followers += 1
+        return result
+
+
+class Broadcast:
+    """
+    The items of one producer, each subscriber gets all of them from the
+    first, then `result`.
+    """
+
+    def __init__(self):
+        self.items: list[Any] = []
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.producer: Optional[asyncio.Future] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, item: Any) -> None:
+        self.items.append(item)
+        self._notify()
+
+    def close(self, result: Any = None, error: Optional[BaseException] = None):
+        self.result = result
+        self.error = error
+        self.done = True
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        index = 0
+        while True:
+            while index < len(self.items):
+                yield self.items[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class StreamFlight:
+    def __init__(self, flight: SharedSingleFlight):
+        self.flight = flight
+        self._broadcasts: dict[str, Broadcast] = {}
+
+    @property
+    def stats(self) -> FlightStats:
+        return self.flight.stats
+
+    def subscribe(
+        self,
+        key: str,
+        produce: Callable[[], AsyncIterator[Any]],
+        *,
+        collect: Callable[[list[Any]], Awaitable[Any]],
+        replay: Callable[[Any], Iterable[Any]],
+    ) -> Broadcast:
+        """
+        The leader runs `produce` under `key` in `flight` and `collect`s its
+        items into the result. When another caller of `flight` ran it, e.g.
+        a worker that holds the lock, the result's `replay` items are
+        published instead.
+        """
+        broadcast = self._broadcasts.get(key)
+        if broadcast is not None:
+            self.stats.stream_followers += 1
+            logger.info(f"Streaming `{key}` from the in-flight producer")
+            return broadcast
+        broadcast = Broadcast()
+        self._broadcasts[key] = broadcast
+
+        async def run() -> Any:
+            items = []
+            async for item in produce():
+                items.append(item)
+                broadcast.publish(item)
+            return await collect(items)
+
+        async def lead() -> None:
+            try:
+                result = await self.flight.do(key, run)
+                if not broadcast.items:
+                    for item in replay(result):
+                        broadcast.publish(item)
+                broadcast.close(result)
+            except Exception as e:
+                broadcast.close(error=e)
+            except BaseException as e:
+                broadcast.close(error=e)
+                raise
+            finally:
+                self._broadcasts.pop(key, None)
+
+        # its own task, a subscriber going away doesn't stop the others
+        broadcast.producer = asyncio.ensure_future(lead())
+        return broadcast
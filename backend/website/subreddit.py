@@ -10,6 +10,7 @@ from openai import AzureOpenAI, OpenAI
 from pydantic import BaseModel, Field
 from rich import print
 from website.chain import Chain
+from website.settings import REDDIT_DIR
 
 platform = "mac"
 app_name = "nobsmed-anecdotal-experiences"
@@ -249,6 +250,7 @@ class Submission(BaseModel):
                 input_object=PredictThreadRelevanceInputSchema(
                     title=submission.title, selftext=submission.selftext
                 ),
+                timeout=5,
             )
             if result.relevance:
                 relevant_submission = True
@@ -323,7 +325,16 @@ class FetchedSubreddit(BaseModel):
     submissions: list[Submission]
 
     @classmethod
-    def load_from_subreddit_name(cls, subreddit_name: str) -> "FetchedSubreddit":
+    def load_from_subreddit_name(
+        cls, subreddit_name: str, legacy: bool = False
+    ) -> "FetchedSubreddit":
+        if not legacy:
+            # the shards of website/reddit_ingest.py, once the subreddit is synced
+            from website.reddit_ingest import load_synced
+
+            synced = load_synced(subreddit_name)
+            if synced is not None:
+                return synced
         logger.warning(
             f"Deprecated for FetchedSubreddit ....Loading data from subreddit: {subreddit_name}"
         )
@@ -374,6 +385,9 @@ class FetchedSubreddit(BaseModel):
 
     @classmethod
     def from_reddit_api(cls, *, subreddit_display_names: List[str]) -> None:
+        """
+        Full dump of the hot posts, see website/reddit_ingest.py for refreshes.
+        """
         error_messages = []
         comment_count = 0
         idxes = range(len(subreddit_display_names))
@@ -426,7 +440,7 @@ class FetchedSubreddit(BaseModel):
             data["submissions"] = submission_objects
             instance = cls(**data)
             sink_file = f"subreddit_{subreddit_display_name}_submissions.json"
-            sink_file = REDDIT_DIR / sink_file
+            sink_file = Path(REDDIT_DIR) / sink_file
             logger.info(f"Writing to sink file: {sink_file}")
             with open(sink_file, "w") as f:
                 f.write(instance.model_dump_json(indent=2))
@@ -538,6 +552,13 @@ new_biohacker_subreddits = [
     "r/longevity",
 ]
 
+# the subreddits behind each topic of the ETL
+topic_subreddits = {
+    "Biohacking": biohacker_subreddits + new_biohacker_subreddits,
+    "Pregnancy": pregnancy_subreddits,
+    "Sleep": sleep_subreddits,
+}
+
 
 if __name__ == "__main__":
     # subreddit_display_names = sleep_subreddits + biohacker_subreddits
@@ -0,0 +1,14 @@
+import os
+
+# website.settings reads these at import time, the tests never talk to Azure
+for name in [
+    "AZURE_OPENAI_API_KEY",
+    "WEST_API_KEY",
+    "EASTUS2_API_KEY",
+    "API_KEY",
+    "AZURE_SEARCH_API_KEY",
+]:
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("AZURE_SEARCH_SERVICE_ENDPOINT", "https://test.invalid")
+# website.main configures logfire at import, the tests send it nothing
+os.environ.setdefault("LOGFIRE_SEND_TO_LOGFIRE", "false")
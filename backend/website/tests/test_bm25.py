@@ -0,0 +1,73 @@
+import numpy as np
+from azure.search.documents.models import VectorizedQuery
+
+from website.bm25 import BM25Index
+from website.local_index import LocalIndex, LocalSearchClient, normalize
+
+documents = [
+    {
+        "permalink": "/r/BabyBumps/comments/1/",
+        "action": "Took an iron supplement with vitamin C",
+        "outcomes": "Ferritin went from 9 to 40",
+        "health_disorder": "Iron deficiency anemia in pregnancy",
+        "takeaway": None,
+    },
+    {
+        "permalink": "/r/sleep/comments/2/",
+        "action": "Magnesium glycinate before bed",
+        "outcomes": "Fell asleep faster",
+        "health_disorder": "Insomnia",
+        "takeaway": "Magnesium helps sleep",
+    },
+    {
+        "permalink": "/r/Biohackers/comments/3/",
+        "action": "Cold showers every morning",
+        "outcomes": "More energy, less afternoon fatigue",
+        "health_disorder": "Fatigue",
+        "takeaway": None,
+    },
+]
+
+
+def test_bm25_ranks_matching_rows(tmp_path):
+    index = BM25Index.build(tmp_path, documents=documents * 10)
+    rows, scores = index.search("magnesium for sleep", 5)
+    assert all(row % 3 == 1 for row in rows)
+    assert np.all(np.diff(scores) <= 0)
+    assert len(index.search("ashwagandha", 5)[0]) == 0
+
+
+def test_hybrid_finds_keyword_match_far_from_the_vector(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = normalize(rng.standard_normal((len(documents), 16)))
+    index = LocalIndex.build(tmp_path, vectors=vectors, documents=documents)
+    hits = LocalSearchClient(index).search(
+        vector_queries=[
+            VectorizedQuery(
+                vector=vectors[2].tolist(),
+                k_nearest_neighbors=2,
+                fields="health_disorderVector",
+            )
+        ],
+        search_text="iron pregnancy",
+        top=2,
+    )
+    # vector pick and keyword pick both make the top 2
+    assert {hit["permalink"] for hit in hits} == {
+        "/r/Biohackers/comments/3/",
+        "/r/BabyBumps/comments/1/",
+    }
+
+    index.fusion, index.alpha = "linear", 0.0
+    rows, _ = index.hybrid_search(vectors[2], "iron pregnancy", 1)
+    assert index.document(rows[0])["permalink"] == "/r/BabyBumps/comments/1/"
+
+
+def test_text_only_without_a_question_vector(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = normalize(rng.standard_normal((len(documents), 16)))
+    LocalIndex.build(tmp_path, vectors=vectors, documents=documents)
+    hits = LocalSearchClient(LocalIndex(tmp_path)).search(
+        vector_queries=[], search_text="insomnia", top=10
+    )
+    assert [hit["permalink"] for hit in hits] == ["/r/sleep/comments/2/"]
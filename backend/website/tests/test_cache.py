@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+import fakeredis
+
+from website.cache import LocalCache, RedisCache, ResultCache
+from website.models import AISummary, DynamicBiohackingTaxonomy
+
+taxonomy = DynamicBiohackingTaxonomy(
+    biohack_types=[], count_experiences=3, count_reddits=2, count_studies=1
+)
+summary = AISummary(balance=["a"], skeptical=["b"], curious=["c"], mechanisms=[])
+
+
+def make_worker(server: fakeredis.FakeServer) -> ResultCache:
+    # each uvicorn worker has its own local tier but shares redis
+    client = fakeredis.FakeAsyncRedis(server=server)
+    return ResultCache(
+        local=LocalCache(max_entries=10, ttl=60),
+        shared=RedisCache(client=client, ttl=60, max_value_bytes=100_000),
+    )
+
+
+def test_local_lru_eviction():
+    local = LocalCache(max_entries=2, ttl=60)
+    local.set("a", 1)
+    local.set("b", 2)
+    local.get("a")  # a is now most recently used
+    local.set("c", 3)
+    assert local.get("b") is None
+    assert local.get("a") == 1
+    assert local.stats.evictions == 1
+
+
+def test_local_ttl():
+    local = LocalCache(max_entries=2, ttl=60)
+    local.set("a", 1, ttl=0.01)
+    time.sleep(0.02)
+    assert local.get("a") is None
+    assert local.stats.expirations == 1
+
+
+def test_shared_between_workers():
+    async def run():
+        server = fakeredis.FakeServer()
+        worker_1 = make_worker(server)
+        worker_2 = make_worker(server)
+        await worker_1.set("taxonomyiron", taxonomy)
+        await worker_1.set("summaryiron", summary)
+        await worker_1.set("summaryerror", "AI summary task returned no curious items")
+
+        assert await worker_2.get("taxonomyiron") == taxonomy
+        assert await worker_2.get("summaryiron") == summary
+        assert await worker_2.get("summaryerror") == (
+            "AI summary task returned no curious items"
+        )
+        assert worker_2.shared.stats.hits == 3
+
+        await worker_2.pop("summaryiron")
+        worker_1.local.pop("summaryiron")
+        assert await worker_1.get("summaryiron") is None
+
+    asyncio.run(run())
+
+
+def test_max_value_bytes():
+    async def run():
+        server = fakeredis.FakeServer()
+        client = fakeredis.FakeAsyncRedis(server=server)
+        shared = RedisCache(client=client, ttl=60, max_value_bytes=10)
+        await shared.set("taxonomyiron", taxonomy)
+        assert await shared.get("taxonomyiron") is None
+        assert shared.stats.evictions == 1
+
+    asyncio.run(run())
@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+from pydantic import BaseModel
+
+from website.chain import Chain
+
+
+class InputSchema(BaseModel):
+    delay: float
+
+
+class OutputSchema(BaseModel):
+    delay: float
+
+
+class SleepChain(Chain):
+    """
+    Stands in for the LLM, each call takes `delay` seconds.
+    """
+
+    input_schema = InputSchema
+    output_schema = OutputSchema
+
+    @classmethod
+    def make_input_text(cls, *, input: InputSchema) -> str:
+        return str(input.delay)
+
+    @classmethod
+    async def coroutine(cls, *, prompt: str, **kwargs):
+        await asyncio.sleep(float(prompt))
+        return OutputSchema(delay=float(prompt))
+
+
+def iter_predict(delays, **kwargs):
+    async def run():
+        return [
+            item
+            async for item in SleepChain.iter_predict(
+                max_tokens=100,
+                size=10,
+                llm_name="gpt-4o",
+                timeout=1,
+                max_retries=0,
+                input_objects=[InputSchema(delay=delay) for delay in delays],
+                **kwargs,
+            )
+        ]
+
+    start = time.perf_counter()
+    results = asyncio.run(run())
+    return results, time.perf_counter() - start
+
+
+def test_completion_order():
+    results, _ = iter_predict([0.2, 0.0, 0.1])
+    assert [index for index, _ in results] == [1, 2, 0]
+
+
+def test_call_deadline():
+    results, _ = iter_predict([0.0, 5.0], call_deadline=0.1)
+    index2result = dict(results)
+    assert isinstance(index2result[0], OutputSchema)
+    assert isinstance(index2result[1], asyncio.TimeoutError)
+
+
+def test_deadline_returns_partial_results():
+    results, elapsed = iter_predict([0.0, 0.0, 5.0], deadline=0.2)
+    assert sorted(index for index, _ in results) == [0, 1]
+    assert elapsed < 1
+
+
+def test_min_results():
+    results, elapsed = iter_predict([0.0, 0.05, 5.0, 5.0], min_results=2)
+    assert sorted(index for index, _ in results) == [0, 1]
+    assert elapsed < 1
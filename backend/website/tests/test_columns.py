@@ -0,0 +1,74 @@
+from website.models import DynamicBiohackingTaxonomy, HitRecord
+from website.search import (enriched_biohacks_to_taxonomy, hits_to_biohacks,
+                            hits_to_experiences, make_taxonomy)
+
+
+def make_hit(i: int, *, topic: str, biohack_type: str, score: int = 2) -> dict:
+    return {
+        "@search.score": 1.0,
+        "permalink": f"10.1000/{i}" if i % 3 == 0 else f"/r/Biohackers/{i}/",
+        "action": f"action {i}",
+        "outcomes": f"outcomes {i}",
+        "health_disorder": "Fatigue",
+        "biohack_type": biohack_type,
+        "biohack_topic": topic,
+        "action_score": score,
+        "outcomes_score": 1,
+    }
+
+
+hits = [
+    make_hit(0, topic="iron", biohack_type="supplement"),
+    make_hit(1, topic="running", biohack_type="exercise", score=3),
+    make_hit(2, topic="iron", biohack_type="supplement"),
+    make_hit(3, topic="magnesium", biohack_type="supplement", score=1),
+    make_hit(4, topic="cold showers", biohack_type="exercise"),
+]
+
+
+def test_hits_to_biohacks_groups_by_topic_in_score_order():
+    biohacks = hits_to_biohacks(hits)
+    assert [biohack.biohack_topic for biohack in biohacks] == [
+        "running",
+        "iron",
+        "cold showers",
+        "magnesium",
+    ]
+    assert [e.action for e in biohacks[1].experiences] == ["action 0", "action 2"]
+    # the same experiences the per-object path validates
+    experiences = {e.permalink: e for e in hits_to_experiences(hits)}
+    for biohack in biohacks:
+        for experience in biohack.experiences:
+            assert isinstance(experience, HitRecord)
+            assert experience.to_experience() == experiences[experience.permalink]
+
+
+def test_taxonomy_groups_by_type_and_counts_sources():
+    taxonomy = enriched_biohacks_to_taxonomy(hits_to_biohacks(hits))
+    assert [group.biohack_type for group in taxonomy.biohack_types] == [
+        "exercise",
+        "supplement",
+    ]
+    assert [len(group.biohacks) for group in taxonomy.biohack_types] == [2, 2]
+    assert taxonomy.count_experiences == 5
+    assert taxonomy.count_studies == 2
+    assert taxonomy.count_reddits == 3
+
+
+def test_make_taxonomy_dedupes_action_outcomes():
+    experiences = hits_to_experiences(hits + [make_hit(1, topic="x", biohack_type="y")])
+    taxonomy = make_taxonomy(experiences=experiences)
+    assert taxonomy.count_experiences == 5
+
+
+def test_hit_record_matches_experience_and_round_trips():
+    record = HitRecord.from_hit(hits[0])
+    experience = record.to_experience()
+    assert (record.source_type, record.url) == ("study", "https://doi.org/10.1000/0")
+    assert record.key == experience.key.decode("ascii")
+    assert record.score == experience.score
+
+    # what the taxonomy cache stores and reads back
+    taxonomy = enriched_biohacks_to_taxonomy(hits_to_biohacks(hits))
+    cached = DynamicBiohackingTaxonomy.model_validate_json(taxonomy.model_dump_json())
+    assert cached == taxonomy
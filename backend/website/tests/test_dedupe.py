@@ -0,0 +1,83 @@
+import numpy as np
+
+from website import base
+from website.biohacks import TopicExperiences
+from website.dedupe import dedupe_rows, minhash_signatures
+from website.experiences import Experience
+from website.search import experiences2biohacks
+
+zinc = (
+    "Started 25mg zinc picolinate with dinner every night for three months "
+    "and my acne cleared up almost completely"
+)
+
+
+def make_experience(i: int, action: str, outcomes: str) -> Experience:
+    return Experience(
+        permalink=f"/r/SkincareAddiction/{i}/",
+        action=action,
+        outcomes=outcomes,
+        health_disorder="Acne",
+        biohack_topic="zinc",
+        action_score=2,
+        outcomes_score=2,
+    )
+
+
+def test_exact_and_near_duplicates_keep_the_first_row():
+    texts = [
+        zinc,
+        "Magnesium glycinate before bed, asleep in ten minutes instead of an hour",
+        zinc.upper() + "!!",
+        zinc.replace("three", "four"),
+        "Cold showers every morning, more energy in the afternoon",
+    ]
+    assert dedupe_rows(texts).tolist() == [0, 1, 4]
+    assert dedupe_rows(texts, near=False).tolist() == [0, 1, 3, 4]
+
+
+def test_signatures_estimate_jaccard():
+    tokens = [f"w{i}" for i in range(200)]
+    # 150 of 199 bigrams in common out of 249: Jaccard ~0.6
+    signatures = minhash_signatures([tokens, tokens[:150] + ["x"] * 50])
+    assert abs((signatures[0] == signatures[1]).mean() - 0.6) < 0.15
+    rng = np.random.default_rng(0)
+    unrelated = [[f"w{i}" for i in rng.integers(10**6, size=30)] for _ in range(200)]
+    assert len(dedupe_rows([" ".join(t) for t in unrelated])) == 200
+
+
+def test_experiences2biohacks_drops_duplicates():
+    experiences = [
+        make_experience(0, "Zinc picolinate 25mg with dinner", zinc),
+        make_experience(1, "Zinc picolinate 25mg with dinner", zinc),
+        make_experience(2, "zinc picolinate 25mg, with dinner", zinc + "."),
+        make_experience(3, "Benzoyl peroxide wash", "Less redness"),
+    ]
+    biohacks = experiences2biohacks(experiences)
+    assert [e.permalink for e in biohacks[0].experiences] == [
+        "/r/SkincareAddiction/0/",
+        "/r/SkincareAddiction/3/",
+    ]
+
+
+def test_topic_store_drops_near_duplicates(tmp_path, monkeypatch):
+    monkeypatch.setattr(base, "ETL_STORE_DIR", tmp_path)
+    experiences = [
+        make_experience(0, "Zinc picolinate 25mg with dinner", zinc),
+        make_experience(0, "Zinc picolinate 25mg with dinner", zinc),
+        make_experience(1, "zinc picolinate 25mg, with dinner", zinc + "."),
+        make_experience(2, "Benzoyl peroxide wash", "Less redness"),
+    ]
+    topic = TopicExperiences(
+        title="Acne",
+        subreddit=[],
+        experiences=experiences,
+        action_embeddings=[[float(i)] for i in range(4)],
+    )
+    topic.deduplicate_experiences()
+    topic = TopicExperiences.load(name="Acne")
+    assert [e.permalink for e in topic.experiences] == [
+        "/r/SkincareAddiction/0/",
+        "/r/SkincareAddiction/2/",
+    ]
+    assert np.asarray(topic.action_embeddings).tolist() == [[0.0], [3.0]]
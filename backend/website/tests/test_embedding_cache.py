@@ -0,0 +1,66 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from website.embedding_cache import EmbeddingCache
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [float(len(text)), 1.0, 2.0, 3.0]
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def test_normalized_keys():
+    embeddings = FakeEmbeddings()
+    cache = EmbeddingCache(embeddings=embeddings, dim=4)
+    first = asyncio.run(cache.aembed_query("Iron and pregnancy?"))
+    second = asyncio.run(cache.aembed_query("iron  and pregnancy"))
+    assert first == second
+    assert embeddings.calls == 1
+    assert cache.stats.memory_hits == 1
+
+
+def test_disk_store_survives_restart(tmp_path):
+    embeddings = FakeEmbeddings()
+    cache = EmbeddingCache(embeddings=embeddings, store_dir=tmp_path, dim=4)
+    assert cache.prewarm(["Iron and pregnancy", "REM sleep", "rem sleep?"]) == 2
+
+    # a new worker (or a restarted container) reads the memory-mapped store
+    restarted = EmbeddingCache(embeddings=embeddings, store_dir=tmp_path, dim=4)
+    vector = restarted.embed_query("REM sleep")
+    assert embeddings.calls == 2
+    assert restarted.stats.disk_hits == 1
+    np.testing.assert_array_equal(vector, [9.0, 1.0, 2.0, 3.0])
+
+
+def test_async_misses_write_the_store_from_a_thread(tmp_path, monkeypatch):
+    cache = EmbeddingCache(embeddings=FakeEmbeddings(), store_dir=tmp_path, dim=4)
+    threads = []
+    original_put = cache.store.put
+
+    def put(key, vector):
+        threads.append(threading.get_ident())
+        original_put(key, vector)
+
+    monkeypatch.setattr(cache.store, "put", put)
+    asyncio.run(cache.aembed_query("REM sleep"))
+    assert len(threads) == 1 and threads[0] != threading.get_ident()
+    assert len(cache.store) == 1
+
+
+def test_lru_bound():
+    cache = EmbeddingCache(embeddings=FakeEmbeddings(), max_entries=1, dim=4)
+    cache.embed_query("a")
+    cache.embed_query("b")
+    assert cache.get("a") is None
@@ -0,0 +1,118 @@
+import json
+
+import numpy as np
+import pytest
+
+from website import base
+from website.base import Base
+from website.experience_store import ExperienceStore
+from website.models import Experience
+
+
+class SleepExperiences(Base):
+    experiences: list[Experience]
+    action_embeddings: list[list[float]] | None = None
+
+
+def make_topic() -> SleepExperiences:
+    experiences = [
+        Experience(
+            permalink=f"/r/sleep/{i}/",
+            action=f"magnesium {i}mg",
+            outcomes="fell asleep faster",
+            health_disorder="insomnia",
+            action_score=i,
+            action_embedding=[float(i), 1.0] if i % 2 else None,
+        )
+        for i in range(3)
+    ]
+    return SleepExperiences(
+        title="Sleep",
+        subreddit=[],
+        experiences=experiences,
+        action_embeddings=[[float(i), 0.5] for i in range(3)],
+    )
+
+
+def test_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(base, "ETL_STORE_DIR", tmp_path)
+    topic = make_topic()
+    topic.save()
+    topic.save()  # replaces the store
+    assert SleepExperiences.get_stored_file_names() == ["Sleep"]
+
+    loaded = SleepExperiences.load(name="Sleep")
+    assert loaded.title == "Sleep"
+    assert loaded.experiences == topic.experiences
+    assert isinstance(loaded.action_embeddings, np.memmap)
+    np.testing.assert_array_equal(loaded.action_embeddings, topic.action_embeddings)
+
+
+def test_projection_reads_only_its_columns(tmp_path, monkeypatch):
+    monkeypatch.setattr(base, "ETL_STORE_DIR", tmp_path)
+    make_topic().save()
+    store = ExperienceStore(SleepExperiences.store_path("Sleep"))
+    experiences = store.experiences(Experience, columns=["action", "action_score"])
+    assert [e.action_score for e in experiences] == [0, 1, 2]
+    assert experiences[1].action == "magnesium 1mg"
+    assert experiences[1].outcomes is None
+    assert sorted(store._columns) == ["action", "action_score"]
+
+
+def test_projected_load_refuses_to_save(tmp_path, monkeypatch):
+    monkeypatch.setattr(base, "ETL_STORE_DIR", tmp_path)
+    make_topic().save()
+    projected = SleepExperiences.load(name="Sleep", columns=["action_score"])
+    with pytest.raises(ValueError, match="action_score"):
+        projected.save()
+    loaded = SleepExperiences.load(name="Sleep")
+    assert loaded.experiences == make_topic().experiences
+    loaded.save()  # a full load still saves
+
+
+def test_legacy_json_until_saved(tmp_path, monkeypatch):
+    monkeypatch.setattr(base, "ETL_STORE_DIR", tmp_path)
+    topic = make_topic()
+    legacy_path = tmp_path / "Sleep.SleepExperiences.json"
+    legacy_path.write_text(topic.model_dump_json(indent=2))
+    assert SleepExperiences.load(name="Sleep").experiences == topic.experiences
+
+    legacy = json.loads(legacy_path.read_text())
+    legacy["experiences"] = legacy["experiences"][:1]
+    legacy_path.write_text(json.dumps(legacy))
+    SleepExperiences.load(name="Sleep").save()
+    assert len(SleepExperiences.load(name="Sleep").experiences) == 1
+    assert len(SleepExperiences.load(name="Sleep", legacy=True).experiences) == 1
+
+
+def test_journal_replays_a_crashed_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(base, "ETL_STORE_DIR", tmp_path)
+    topic = make_topic()
+    topic.save()
+    journal = topic.journal()
+    topic.experiences[0].outcomes_score = 4
+    topic.experiences[2].outcomes_score = 1
+    journal.append(topic.experiences, [0, 2], ["outcomes_score"])
+    with open(journal.path, "a") as f:
+        f.write('{"row": 1, "permalink": "/r/sleep/1/", "outcomes_sc')
+
+    # the run died before its final save
+    resumed = SleepExperiences.load(name="Sleep")
+    assert [e.outcomes_score for e in resumed.experiences] == [4, None, 1]
+    resumed.save()
+    assert not journal.path.exists()
+    reloaded = SleepExperiences.load(name="Sleep")
+    assert [e.outcomes_score for e in reloaded.experiences] == [4, None, 1]
+
+
+def test_resume_skips_scored_rows():
+    from website.biohacks import TopicExperiences
+
+    topic = TopicExperiences(title="Sleep", experiences=make_topic().experiences)
+    topic.experiences[1].outcomes_score = 3
+    rows = topic.unscored_rows("outcomes_score", start=0, size=None, resume=True)
+    assert rows == [0, 2]
+    assert topic.unscored_rows("outcomes_score", start=1, size=None, resume=False) == [
+        1,
+        2,
+    ]
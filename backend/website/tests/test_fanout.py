@@ -0,0 +1,135 @@
+import asyncio
+
+from website import base
+from website.base import Base, SubredditAttributes
+from website.biohacks import TopicExperiences
+from website.experience_store import Journal
+from website.experiences import (Biohack, CommentChain, CommentExperiences,
+                                 CommentInputSchema, SubmissionChain,
+                                 SubmissionExperiences,
+                                 SurfaceExperienceResponseSchema)
+from website.fanout import SubredditProgress, fan_out
+from website.subreddit import Comment, Submission
+
+
+class FakeLLM:
+    """
+    Every call takes 50ms, texts mentioning "meme" have no biohack.
+    """
+
+    def __init__(self):
+        self.inflight = 0
+        self.max_inflight = 0
+
+    async def coroutine(self, cls, *, prompt: str, **kwargs):
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        await asyncio.sleep(0.05)
+        self.inflight -= 1
+        if "meme" in prompt:
+            return SurfaceExperienceResponseSchema()
+        return SurfaceExperienceResponseSchema(
+            biohack=Biohack(action="magnesium", health_disorder="insomnia"),
+            outcomes="fell asleep faster",
+            takeaway="magnesium helps",
+            biohack_type="supplements",
+        )
+
+
+def submissions(self, *, size):
+    name = self.subreddit.display_name
+    return [
+        Submission(permalink=f"/r/{name}/{i}/", title="meme" if i == 0 else "sleep")
+        for i in range(5)
+    ]
+
+
+def comments(self, *, size):
+    return [
+        CommentInputSchema(
+            permalink=s.permalink + "c/",
+            comment=Comment(body="magnesium"),
+            submission=s,
+        )
+        for s in submissions(self, size=size)
+    ]
+
+
+def fake_extraction(tmp_path, monkeypatch) -> FakeLLM:
+    monkeypatch.setattr(base, "ETL_STORE_DIR", tmp_path)
+    monkeypatch.setattr(
+        Base,
+        "subreddit_metadata",
+        classmethod(
+            lambda cls, name: SubredditAttributes(
+                display_name=name, title=name, public_description=""
+            )
+        ),
+    )
+    monkeypatch.setattr(SubmissionExperiences, "get_relevant_input_objects", submissions)
+    monkeypatch.setattr(CommentExperiences, "get_relevant_input_objects", comments)
+    llm = FakeLLM()
+    for chain in [CommentChain, SubmissionChain]:
+        monkeypatch.setattr(chain, "coroutine", classmethod(llm.coroutine))
+    return llm
+
+
+def run_fan_out(**kwargs) -> list[SubredditProgress]:
+    return asyncio.run(
+        fan_out(
+            topic="Sleep",
+            subreddit_names=["r/insomnia", "r/sleep", "r/sleephackers"],
+            size=None,
+            llm_name="gpt-4o-mini",
+            max_retries=0,
+            max_tokens=400,
+            timeout=5,
+            **kwargs,
+        )
+    )
+
+
+def test_fan_out_streams_into_the_topic_store(tmp_path, monkeypatch):
+    llm = fake_extraction(tmp_path, monkeypatch)
+    progress = run_fan_out(max_subreddits=6, max_inflight=8)
+    # 5 calls per job, so the jobs overlapped up to the shared budget
+    assert llm.max_inflight == 8
+    assert [(p.inputs, p.done, p.experiences) for p in progress] == [(5, 5, 4)] * 6
+    assert all(p.throughput > 0 and p.finished is not None for p in progress)
+
+    topic = TopicExperiences.load(name="Sleep")
+    assert len(topic.experiences) == 24
+    assert [s.display_name for s in topic.subreddit] == [
+        "insomnia",
+        "sleep",
+        "sleephackers",
+    ]
+    insomnia = SubmissionExperiences.load(name="insomnia")
+    assert [e.permalink for e in insomnia.experiences] == [
+        f"/r/insomnia/{i}/" for i in range(1, 5)
+    ]
+
+
+def test_failed_job_keeps_the_old_store(tmp_path, monkeypatch):
+    fake_extraction(tmp_path, monkeypatch)
+    run_fan_out(max_subreddits=6, max_inflight=8)
+    journal = Journal(TopicExperiences.journal_path("Sleep"))
+    journal.path.write_text('{"row": 0, "permalink": "/r/insomnia/1/"}\n')
+    save = SubmissionExperiences.save
+
+    def failing_save(self):
+        if self.subreddit.display_name == "sleep":
+            raise OSError("disk full")
+        save(self)
+
+    monkeypatch.setattr(SubmissionExperiences, "save", failing_save)
+    progress = run_fan_out(max_subreddits=2, max_inflight=4)
+    failed = [(p.subreddit, p.source) for p in progress if p.error is not None]
+    assert failed == [("sleep", "submissions")]
+
+    store_path = TopicExperiences.store_path("Sleep")
+    assert not store_path.with_name(store_path.name + ".tmp").exists()
+    assert journal.path.exists()
+    permalinks = [e.permalink for e in TopicExperiences.load(name="Sleep").experiences]
+    assert len(permalinks) == 24
+    assert sum(p.startswith("/r/sleep/") and "/c/" not in p for p in permalinks) == 4
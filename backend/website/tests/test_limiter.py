@@ -0,0 +1,165 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pydantic import BaseModel
+
+from website.chain import Chain
+from website.limiter import DeploymentLimiter, Quota, get_limiter
+
+quota = Quota(rpm=60_000, tpm=6_000_000)
+
+
+def test_aimd_window():
+    limiter = DeploymentLimiter(name="gpt-4o", quota=quota, initial_window=16)
+
+    async def run():
+        async with limiter.slot(tokens=100):
+            pass
+        assert limiter.window == pytest.approx(16 + 1 / 16)
+        with pytest.raises(asyncio.TimeoutError):
+            async with limiter.slot(tokens=100):
+                raise asyncio.TimeoutError()
+        assert limiter.window == pytest.approx((16 + 1 / 16) / 2)
+        # concurrent 429s from the same burst only halve it once
+        with pytest.raises(asyncio.TimeoutError):
+            async with limiter.slot(tokens=100):
+                raise asyncio.TimeoutError()
+        assert limiter.window == pytest.approx((16 + 1 / 16) / 2)
+        assert limiter.stats.throttles == 2
+
+    asyncio.run(run())
+
+
+def test_batch_leaves_room_for_interactive():
+    limiter = DeploymentLimiter(
+        name="gpt-4o", quota=quota, max_concurrency=10, batch_share=0.7
+    )
+    batch = {"inflight": 0, "peak": 0}
+
+    async def batch_call():
+        async with limiter.slot(tokens=100, batch=True):
+            batch["inflight"] += 1
+            batch["peak"] = max(batch["peak"], batch["inflight"])
+            await asyncio.sleep(0.05)
+            batch["inflight"] -= 1
+
+    async def interactive_call():
+        await asyncio.sleep(0.01)
+        async with limiter.slot(tokens=100):
+            return limiter.inflight
+
+    async def run():
+        results = await asyncio.gather(
+            *[batch_call() for _ in range(30)], interactive_call()
+        )
+        return results[-1]
+
+    inflight_with_interactive = asyncio.run(run())
+    assert batch["peak"] == 7
+    # the live call didn't queue behind the 30 batch calls
+    assert inflight_with_interactive == 8
+
+
+def test_token_bucket_waits():
+    limiter = DeploymentLimiter(name="gpt-4o", quota=Quota(rpm=60_000, tpm=60_000))
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        async with limiter.slot(tokens=60_000):
+            pass
+        # the bucket is empty, 100 tokens refill in 0.1 s
+        async with limiter.slot(tokens=100):
+            pass
+        return loop.time() - start
+
+    elapsed = asyncio.run(run())
+    assert 0.08 < elapsed < 1
+
+
+class InputSchema(BaseModel):
+    text: str
+
+
+class OutputSchema(BaseModel):
+    text: str
+
+
+class SleepyCompletions:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    async def create(self, **kwargs):
+        await asyncio.sleep(self.seconds)
+        return OutputSchema(text="ok")
+
+
+def deadline_chain(seconds: float) -> type[Chain]:
+    class DeadlineChain(Chain):
+        input_schema = InputSchema
+        output_schema = OutputSchema
+        cache = False
+
+        @classmethod
+        def make_input_text(cls, *, input: InputSchema) -> str:
+            return input.text
+
+        @classmethod
+        def make_client(cls, llm_name, timeout, sync=False):
+            completions = SleepyCompletions(seconds)
+            return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    return DeadlineChain
+
+
+def run_with_deadline(chain: type[Chain], n: int, call_deadline: float) -> list:
+    async def run():
+        return [
+            result
+            async for _, result in chain.iter_predict(
+                max_tokens=10,
+                size=n,
+                llm_name="gpt-4o",
+                timeout=1,
+                max_retries=0,
+                input_objects=[InputSchema(text=f"iron {i}") for i in range(n)],
+                call_deadline=call_deadline,
+            )
+        ]
+
+    return asyncio.run(run())
+
+
+def test_missed_deadlines_throttle_their_deployment(monkeypatch):
+    from website import limiter as limiter_module
+    from website.chain import endpoints
+
+    monkeypatch.setattr(limiter_module, "limiters", {})
+    results = run_with_deadline(deadline_chain(5), n=1, call_deadline=0.05)
+    assert isinstance(results[0], asyncio.TimeoutError)
+    deployment = get_limiter("gpt-4o", endpoints["gpt-4o"])
+    assert deployment.stats.throttles == 1
+    assert deployment.window < 32
+    # the other deployments of the model keep their window
+    assert get_limiter("gpt-4o", "https://backup.invalid").window == 32
+
+
+def test_queued_calls_get_their_deadline_from_the_slot(monkeypatch):
+    from website import limiter as limiter_module
+    from website.chain import endpoints
+
+    deployment = DeploymentLimiter(
+        name="gpt-4o", quota=quota, initial_window=1, max_concurrency=1
+    )
+    monkeypatch.setattr(
+        limiter_module, "limiters", {("gpt-4o", endpoints["gpt-4o"]): deployment}
+    )
+    # one at a time, 0.04s each: the second waits for its slot and still has
+    # its 0.06s from there, the third is still queued when its deadline passes
+    results = run_with_deadline(deadline_chain(0.04), n=3, call_deadline=0.06)
+    assert sum(isinstance(r, OutputSchema) for r in results) == 2
+    assert sum(isinstance(r, asyncio.TimeoutError) for r in results) == 1
+    # nothing the deployment did, the window isn't halved
+    assert deployment.stats.throttles == 0
+    assert deployment.window == 1
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from pydantic import BaseModel
+
+from website import chain
+from website.chain import Chain
+from website.llm_cache import LLMCache
+
+
+class InputSchema(BaseModel):
+    sentence: str
+
+
+class OutputSchema(BaseModel):
+    relevant: bool
+
+
+class RelevanceChain(Chain):
+    input_schema = InputSchema
+    output_schema = OutputSchema
+
+    @classmethod
+    def make_input_text(cls, *, input: InputSchema) -> str:
+        return f"Is this relevant? {input.sentence}"
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        return OutputSchema(relevant=True)
+
+
+def test_hit_miss_and_ttl(tmp_path):
+    cache = LLMCache(tmp_path / "responses.sqlite", ttl=60)
+    key = cache.make_key(
+        chain="RelevanceChain",
+        llm_name="gpt-4o",
+        output_schema=OutputSchema,
+        prompt="Is this relevant? iron",
+    )
+    assert cache.get(key, OutputSchema) is None
+    cache.set(
+        key, OutputSchema(relevant=True), chain="RelevanceChain", llm_name="gpt-4o"
+    )
+    assert cache.get(key, OutputSchema) == OutputSchema(relevant=True)
+    assert cache.stats.hit_rate == 0.5
+
+    # another worker opening the same file sees it
+    assert LLMCache(tmp_path / "responses.sqlite").get(key, OutputSchema) is not None
+
+    cache.ttl = -1
+    assert cache.get(key, OutputSchema) is None
+
+
+def test_model_is_part_of_the_key(tmp_path):
+    cache = LLMCache(tmp_path / "responses.sqlite")
+    keys = {
+        cache.make_key(
+            chain="RelevanceChain",
+            llm_name=llm_name,
+            output_schema=OutputSchema,
+            prompt="Is this relevant? iron",
+        )
+        for llm_name in ["gpt-4o", "gpt-4o-mini"]
+    }
+    assert len(keys) == 2
+
+
+def test_size_eviction(tmp_path):
+    cache = LLMCache(tmp_path / "responses.sqlite", max_bytes=100, evict_every=1)
+    for i in range(20):
+        cache.set(
+            f"key{i}", OutputSchema(relevant=True), chain="RelevanceChain", llm_name="x"
+        )
+        time.sleep(0.001)
+    assert len(cache) * len('{"relevant":true}') <= 100
+    # the least recently used went first
+    assert cache.get("key19", OutputSchema) is not None
+    assert cache.get("key0", OutputSchema) is None
+
+
+def test_hits_defer_access_writes(tmp_path):
+    cache = LLMCache(tmp_path / "responses.sqlite", flush_every=3)
+    for key in ["a", "b", "c"]:
+        cache.set(key, OutputSchema(relevant=True), chain="RelevanceChain", llm_name="x")
+    changes = cache._db.total_changes
+    cache.get("a", OutputSchema)
+    cache.get("b", OutputSchema)
+    assert cache._db.total_changes == changes
+    cache.get("c", OutputSchema)
+    assert cache._db.total_changes == changes + 3
+    assert cache._accessed == {}
+
+
+def test_chain_consults_cache(tmp_path, monkeypatch):
+    cache = LLMCache(tmp_path / "responses.sqlite")
+    monkeypatch.setattr(chain, "llm_cache", cache)
+    writers = []
+    original_set = cache.set
+
+    def recording_set(*args, **kwargs):
+        writers.append(threading.get_ident())
+        original_set(*args, **kwargs)
+
+    monkeypatch.setattr(cache, "set", recording_set)
+    completions = FakeCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    async def run():
+        for _ in range(3):
+            result = await RelevanceChain.coroutine(
+                client=client,
+                llm_name="gpt-4o",
+                prompt="Is this relevant? iron",
+                max_retries=0,
+                max_tokens=100,
+            )
+            assert result == OutputSchema(relevant=True)
+
+    asyncio.run(run())
+    assert completions.calls == 1
+    # written off the event loop's thread
+    assert len(writers) == 1 and writers[0] != threading.get_ident()
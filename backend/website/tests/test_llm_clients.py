@@ -0,0 +1,66 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from website import llm_clients
+
+COMPLETION = {
+    "id": "chatcmpl-1",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-4o",
+    "choices": [
+        {
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": "ok"},
+        }
+    ],
+}
+
+
+class MockAzureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        payload = json.dumps(COMPLETION).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_clients_share_one_pool():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockAzureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_port}"
+
+    async def run():
+        clients = [
+            llm_clients.get_openai_client(
+                endpoint=endpoint,
+                deployment="gpt-4o",
+                api_version="2024-08-01-preview",
+                api_key="test",
+            )
+            for _ in range(3)
+        ]
+        assert clients[0] is clients[1] is clients[2]
+        for _ in range(5):
+            await clients[0].chat.completions.create(
+                model="gpt-4o", messages=[{"role": "user", "content": "hi"}]
+            )
+        await llm_clients.aclose()
+
+    asyncio.run(run())
+    server.shutdown()
+    host_stats = llm_clients.pool_stats().hosts["127.0.0.1"]
+    assert host_stats.requests == 5
+    assert host_stats.connections == 1
+    assert host_stats.reuse_rate == 0.8
@@ -0,0 +1,76 @@
+import asyncio
+
+import numpy as np
+
+from website import search
+from website.local_index import AsyncLocalSearchClient, LocalIndex, normalize
+
+
+def make_corpus(size: int = 2000, dim: int = 64, topics: int = 40) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    centers = normalize(rng.standard_normal((topics, dim)))
+    noise = rng.standard_normal((size, dim)) / np.sqrt(dim)
+    return normalize(centers[rng.integers(topics, size=size)] + 0.5 * noise)
+
+
+def make_documents(size: int) -> list[dict]:
+    return [
+        {
+            "permalink": f"/r/BabyBumps/comments/{i}/",
+            "action": f"action {i}",
+            "health_disorder": f"disorder {i}",
+            "outcomes": f"outcomes {i}",
+            "action_score": 1,
+            "outcomes_score": 1,
+        }
+        for i in range(size)
+    ]
+
+
+def test_recall_against_brute_force(tmp_path):
+    corpus = make_corpus()
+    index = LocalIndex.build(
+        tmp_path, vectors=corpus, documents=make_documents(len(corpus))
+    )
+    queries = normalize(corpus[:50] + 0.05)
+    recalls = []
+    for query in queries:
+        exact, _ = index.brute_force(query, 10)
+        found, scores = index.search(query, 10, nprobe=8)
+        recalls.append(len(set(found) & set(exact)) / 10)
+        assert np.all(np.diff(scores) <= 0)
+    assert np.mean(recalls) >= 0.9
+
+
+def test_float16_matches_float32(tmp_path):
+    corpus = make_corpus()
+    documents = make_documents(len(corpus))
+    f32 = LocalIndex.build(tmp_path / "f32", vectors=corpus, documents=documents)
+    f16 = LocalIndex.build(
+        tmp_path / "f16", vectors=corpus, documents=documents, dtype=np.float16
+    )
+    assert f16.vectors.dtype == np.float16
+    exact32, _ = f32.brute_force(corpus[0], 10)
+    exact16, _ = f16.brute_force(corpus[0], 10)
+    assert [f32.document(row) for row in exact32][0] == documents[0]
+    assert [f16.document(row) for row in exact16][0] == documents[0]
+
+
+def test_plugs_into_arun_search_query(tmp_path, monkeypatch):
+    corpus = make_corpus()
+    documents = make_documents(len(corpus))
+    LocalIndex.build(tmp_path, vectors=corpus, documents=documents)
+    # a fresh open only maps the files
+    client = AsyncLocalSearchClient(LocalIndex(tmp_path))
+
+    class FixedEmbedding:
+        async def aembed_query(self, text: str) -> list[float]:
+            return corpus[7].tolist()
+
+    monkeypatch.setattr(search, "embedding_cache", FixedEmbedding())
+    experiences = asyncio.run(
+        search.arun_search_query(question="disorder 7", client=client, limit=20)
+    )
+    assert len(experiences) == 20
+    assert "disorder 7" in {experience.health_disorder for experience in experiences}
+    assert asyncio.run(client.get_document_count()) == len(corpus)
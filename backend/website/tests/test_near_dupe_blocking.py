@@ -0,0 +1,55 @@
+import asyncio
+import re
+
+import numpy as np
+
+from website.near_dupe_blocking import candidate_pairs, evaluate, near_dupe_pairs
+from website.near_dupe_llm_classifier import (NearDupeChainChunk,
+                                              NearDupeResponseChunk)
+
+prompts = []
+
+
+class KetoChain(NearDupeChainChunk):
+    """
+    Stands in for the LLM: a pair is a near duplicate if both mention keto.
+    """
+
+    @classmethod
+    async def coroutine(cls, *, prompt: str, **kwargs):
+        prompts.append(prompt)
+        pairs = re.findall(r"A\.(.*) B\.(.*)", prompt)
+        return NearDupeResponseChunk(
+            answers=["keto" in a.lower() and "keto" in b.lower() for a, b in pairs]
+        )
+
+
+topics = ["Going keto", "Strict keto diet", "Keto with electrolytes", "Brewer Diet"]
+# 0 and 1 nearly the same direction, 2 between them and 3, 3 apart
+vectors = np.array([[1.0, 0.0, 0.0], [0.99, 0.1, 0.0], [0.7, 0.0, 0.7], [0, 1.0, 0]])
+
+
+def test_candidate_pairs_are_the_neighbours_above_low():
+    pairs, similarities = candidate_pairs(np.random.default_rng(0).random((50, 8)))
+    assert np.all(pairs[:, 0] < pairs[:, 1])
+    assert np.all(similarities >= 0.6)
+    assert len(pairs) == len({tuple(pair) for pair in pairs.tolist()})
+
+
+def test_only_the_ambiguous_band_goes_to_the_llm():
+    merged, stats = asyncio.run(
+        near_dupe_pairs(topics, vectors, low=0.5, high=0.95, k=3, chain=KetoChain)
+    )
+    # (0, 1) merged on similarity, (0, 2) and (1, 2) asked, 3 never a candidate
+    assert sorted(merged) == [(0, 1), (0, 2), (1, 2)]
+    assert (stats.auto_merged, stats.llm_pairs, stats.llm_merged) == (1, 2, 2)
+    assert len(prompts) == stats.llm_calls == 1
+    assert stats.llm_calls_avoided == 5
+
+
+def test_evaluate_counts_blocked_positives_and_llm_answers():
+    similarities = np.array([0.95, 0.7, 0.7, 0.3])
+    labels = [True, True, False, True]
+    evaluation = evaluate(similarities, labels, llm_answers=[None, True, False, None])
+    assert (evaluation.precision, evaluation.recall) == (1.0, 2 / 3)
+    assert (evaluation.ambiguous, evaluation.blocked_positives) == (2, 1)
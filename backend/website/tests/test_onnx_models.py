@@ -0,0 +1,36 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from website.onnx_models import SessionPool
+
+
+class SlowSession:
+    """
+    Stands in for an onnxruntime session, fails if two threads share it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def run(self, output_names, feeds):
+        assert self.lock.acquire(blocking=False), "session used concurrently"
+        try:
+            time.sleep(0.05)
+            return [feeds["input_ids"].sum(axis=1, keepdims=True)]
+        finally:
+            self.lock.release()
+
+
+def test_session_pool_runs_one_batch_per_session_at_a_time():
+    pool = SessionPool("model.int8.onnx", sessions=[SlowSession(), SlowSession()])
+    feeds = [{"input_ids": np.full((2, 3), i)} for i in range(6)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(6) as executor:
+        results = list(executor.map(pool.run, feeds))
+    elapsed = time.perf_counter() - start
+    assert [result[0, 0] for result in results] == [3 * i for i in range(6)]
+    # 6 batches on 2 sessions: 3 rounds, not 1 and not 6
+    assert 0.14 < elapsed < 0.3
@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+from website.chain import LLMUsage, record_usage
+from website.pipeline import Pipeline, Stage, dependencies
+
+
+def copy_stage(name, source, sink, calls, **kwargs) -> Stage:
+    def run():
+        calls.append(name)
+        sink.write_text(source.read_text().upper())
+
+    return Stage(name=name, run=run, inputs=[source], outputs=[sink], **kwargs)
+
+
+def make_stages(tmp_path, calls) -> list[Stage]:
+    raw, clean, scored, tagged = (
+        tmp_path / name for name in ["raw", "clean", "scored", "tagged"]
+    )
+    raw.write_text("magnesium")
+    return [
+        copy_stage("clean", raw, clean, calls),
+        copy_stage("score", clean, scored, calls),
+        copy_stage("tag", raw, tagged, calls),
+    ]
+
+
+def run(pipeline: Pipeline, **kwargs):
+    return {r.name: r.status for r in asyncio.run(pipeline.run(**kwargs))}
+
+
+def test_dependencies_from_paths(tmp_path):
+    deps = dependencies(make_stages(tmp_path, []))
+    assert deps == {"clean": set(), "score": {"clean"}, "tag": set()}
+
+
+def test_reruns_only_what_changed(tmp_path):
+    calls = []
+    state_path = tmp_path / "state.json"
+    pipeline = Pipeline(make_stages(tmp_path, calls), state_path=state_path)
+    assert run(pipeline) == {"clean": "ran", "score": "ran", "tag": "ran"}
+    assert calls.index("clean") < calls.index("score")
+    assert (tmp_path / "scored").read_text() == "MAGNESIUM"
+
+    calls.clear()
+    pipeline = Pipeline(make_stages(tmp_path, calls), state_path=state_path)
+    assert run(pipeline) == {"clean": "skipped", "score": "skipped", "tag": "skipped"}
+    assert calls == []
+
+    # an edited intermediate file reruns only what reads it
+    (tmp_path / "clean").write_text("ZINC")
+    pipeline = Pipeline(make_stages(tmp_path, calls), state_path=state_path)
+    assert run(pipeline) == {"clean": "skipped", "score": "ran", "tag": "skipped"}
+    assert (tmp_path / "scored").read_text() == "ZINC"
+
+    (tmp_path / "tagged").unlink()
+    calls.clear()
+    pipeline = Pipeline(make_stages(tmp_path, calls), state_path=state_path)
+    assert run(pipeline, force=["clean"]) == {
+        "clean": "ran",
+        "score": "ran",
+        "tag": "ran",
+    }
+    assert calls.index("clean") < calls.index("score")
+    assert (tmp_path / "scored").read_text() == "MAGNESIUM"
+
+
+def test_failure_blocks_downstream(tmp_path):
+    calls = []
+    stages = make_stages(tmp_path, calls)
+
+    def fail():
+        raise RuntimeError("rate limited")
+
+    stages[0].run = fail
+    pipeline = Pipeline(stages, state_path=tmp_path / "state.json")
+    assert run(pipeline) == {"clean": "failed", "score": "blocked", "tag": "ran"}
+    assert "rate limited" in pipeline.state.stages["clean"].error
+
+
+def test_parallel_stages_with_their_own_usage(tmp_path):
+    def scorer(topic: str):
+        async def score():
+            await asyncio.sleep(0.2)
+            record_usage(
+                llm_name="gpt-4o-mini", prompt="x" * 4000, result=None, max_tokens=50
+            )
+            if topic == "Sleep":
+                record_usage(
+                    llm_name="gpt-4o-mini",
+                    prompt="x",
+                    result=None,
+                    max_tokens=50,
+                    cached=True,
+                )
+            (tmp_path / topic).write_text("scored")
+
+        return score
+
+    stages = [
+        Stage(name=topic, run=scorer(topic), outputs=[tmp_path / topic])
+        for topic in ["Biohacking", "Pregnancy", "Sleep"]
+    ]
+    pipeline = Pipeline(stages, state_path=tmp_path / "state.json", max_parallel=3)
+    start = time.perf_counter()
+    records = asyncio.run(pipeline.run())
+    assert time.perf_counter() - start < 0.5
+    usage = {r.name: r.usage for r in records}
+    assert usage["Biohacking"].calls == 1
+    assert usage["Sleep"].cached == 1
+    assert usage["Sleep"].prompt_tokens == usage["Pregnancy"].prompt_tokens > 0
+    assert usage["Pregnancy"].cost > 0
+    assert isinstance(pipeline.state.stages["Sleep"].usage, LLMUsage)
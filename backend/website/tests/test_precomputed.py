@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+from website import precomputed
+from website.models import DynamicBiohackingTaxonomy
+from website.precomputed import (PrecomputedAnswer, PrecomputedArtifact,
+                                 PrecomputedStore, mine_questions, save)
+from website.settings import index_name
+
+
+class FakeSearchClient:
+    def __init__(self, count: int):
+        self.count = count
+
+    async def get_document_count(self) -> int:
+        return self.count
+
+
+def make_answer(question: str) -> PrecomputedAnswer:
+    taxonomy = DynamicBiohackingTaxonomy(
+        biohack_types=[], count_experiences=1, count_reddits=1, count_studies=0
+    )
+    return PrecomputedAnswer(question=question, taxonomy=taxonomy)
+
+
+def make_artifact(version: str, questions: list[str]) -> PrecomputedArtifact:
+    return PrecomputedArtifact(
+        version=version,
+        built=time.time(),
+        answers={question.lower(): make_answer(question) for question in questions},
+    )
+
+
+def test_get_by_normalized_question(tmp_path):
+    path = tmp_path / "answers.json.gz"
+    save(make_artifact(f"{index_name}:10", ["iron and pregnancy"]), path)
+    store = PrecomputedStore(path)
+    assert store.get("  Iron and   Pregnancy? ").question == "iron and pregnancy"
+    assert store.get("ADHD and Diet") is None
+    assert store.summary()["hits"] == 1
+
+
+def test_mine_questions(tmp_path):
+    log = tmp_path / "access.log"
+    log.write_text(
+        '1.2.3.4 - "GET /search?question=Iron+and+pregnancy HTTP/1.1" 200\n' * 3
+        + '1.2.3.4 - "GET /search?question=iron%20and%20pregnancy%3F HTTP/1.1" 200\n'
+        + '1.2.3.4 - "GET /search?question=ADHD+and+Diet HTTP/1.1" 200\n'
+        + '1.2.3.4 - "GET /health HTTP/1.1" 200\n'
+    )
+    assert mine_questions([log], min_count=2) == ["Iron and pregnancy"]
+
+
+def test_refresh_when_index_changes(tmp_path, monkeypatch):
+    path = tmp_path / "answers.json.gz"
+    save(make_artifact(f"{index_name}:10", ["iron and pregnancy"]), path)
+    store = PrecomputedStore(path)
+    rebuilt = []
+
+    async def fake_precompute(questions, *, client):
+        rebuilt.extend(questions)
+        version = await precomputed.index_version(client)
+        return make_artifact(version, questions)
+
+    monkeypatch.setattr(precomputed, "precompute", fake_precompute)
+
+    async def run():
+        unchanged = await store.refresh(client=FakeSearchClient(10))
+        changed = await store.refresh(client=FakeSearchClient(11))
+        return unchanged, changed
+
+    assert asyncio.run(run()) == (False, True)
+    assert rebuilt == ["iron and pregnancy"]
+    assert store.artifact.version == f"{index_name}:11"
+    # another worker picks the new file up
+    assert PrecomputedStore(path).artifact.version == f"{index_name}:11"
+
+
+def test_one_worker_refreshes_without_redis(tmp_path, monkeypatch):
+    path = tmp_path / "answers.json.gz"
+    save(make_artifact(f"{index_name}:10", ["iron and pregnancy"]), path)
+    workers = [PrecomputedStore(path) for _ in range(3)]
+    rebuilt = []
+
+    async def fake_precompute(questions, *, client):
+        rebuilt.extend(questions)
+        await asyncio.sleep(0.05)
+        version = await precomputed.index_version(client)
+        return make_artifact(version, questions)
+
+    monkeypatch.setattr(precomputed, "precompute", fake_precompute)
+
+    async def run():
+        client = FakeSearchClient(11)
+        return await asyncio.gather(
+            *[worker.refresh(client=client) for worker in workers]
+        )
+
+    assert sorted(asyncio.run(run())) == [False, False, True]
+    assert rebuilt == ["iron and pregnancy"]
+    # the others reload the new file on their next check
+    assert not asyncio.run(workers[1].refresh(client=FakeSearchClient(11)))
+    assert workers[1].artifact.version == f"{index_name}:11"
@@ -0,0 +1,83 @@
+import json
+
+from website import reddit_ingest, subreddit
+from website.reddit_fixture import RedditFixture
+from website.reddit_ingest import read_submissions, sync_subreddit
+from website.subreddit import Comment, FetchedSubreddit, Submission
+
+
+def make_submission(i: int, title: str = "magnesium for sleep") -> Submission:
+    return Submission(
+        id=f"p{i}",
+        name=f"t3_p{i}",
+        created_utc=1_700_000_000 + i * 60,
+        title=title,
+        selftext="fell asleep faster",
+        author="sleeper",
+        link_flair_text="Success",
+        permalink=f"/r/sleep/comments/p{i}/",
+        comments=[
+            Comment(
+                id=f"c{i}",
+                body="same here",
+                author="owl",
+                permalink=f"/r/sleep/comments/p{i}/c{i}/",
+            )
+        ],
+    )
+
+
+def use_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(reddit_ingest, "REDDIT_DIR", tmp_path)
+    monkeypatch.setattr(subreddit, "REDDIT_DIR", tmp_path)
+
+
+def test_sync_fetches_only_new_posts(tmp_path, monkeypatch):
+    use_dir(tmp_path, monkeypatch)
+    posts = [make_submission(i) for i in range(3)]
+    posts.append(make_submission(3, title="weekly memes"))
+    with RedditFixture({"sleep": posts}) as fixture:
+        first = sync_subreddit("r/sleep", reddit=fixture.reddit())
+        assert (first.listed, first.submissions, first.skipped) == (4, 3, 1)
+
+        fixture.requests.clear()
+        posts += [make_submission(4), make_submission(5)]
+        second = sync_subreddit("r/sleep", reddit=fixture.reddit())
+        assert (second.listed, second.submissions, second.comments) == (2, 2, 2)
+        assert second.reached_mark
+        comment_fetches = [p for p in fixture.requests if p.startswith("/comments/")]
+        assert sorted(comment_fetches) == ["/comments/p4/", "/comments/p5/"]
+
+        third = sync_subreddit("r/sleep", reddit=fixture.reddit())
+        assert third.listed == 0
+
+    assert len(list((tmp_path / "subreddit_sleep" / "shards").glob("*.jsonl"))) == 2
+    fetched = FetchedSubreddit.load_from_subreddit_name("sleep")
+    assert sorted(s.id for s in fetched.submissions) == ["p0", "p1", "p2", "p4", "p5"]
+    assert fetched.submissions[0].comments[0].body == "same here"
+
+
+def test_crashed_sync_and_legacy_dump(tmp_path, monkeypatch):
+    use_dir(tmp_path, monkeypatch)
+    legacy = FetchedSubreddit(
+        display_name="sleep",
+        title="Sleep",
+        public_description="",
+        submissions=[make_submission(0), make_submission(1)],
+    )
+    (tmp_path / "subreddit_sleep_submissions.json").write_text(
+        legacy.model_dump_json()
+    )
+    posts = [make_submission(i) for i in range(4)]
+    with RedditFixture({"sleep": posts}) as fixture:
+        report = sync_subreddit("sleep", reddit=fixture.reddit())
+    # the dump is the first shard, only the posts after it are fetched
+    assert report.submissions == 2
+
+    # a sync that died writing p3 after p2
+    shards = tmp_path / "subreddit_sleep" / "shards"
+    with open(shards / "1.jsonl", "w") as f:
+        f.write(make_submission(2).model_dump_json() + "\n")
+        f.write(json.dumps({"id": "p3", "title": "magn"}))
+    ids = [s.id for s in read_submissions("sleep")]
+    assert sorted(ids) == ["p0", "p1", "p2", "p3"]
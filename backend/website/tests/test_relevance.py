@@ -0,0 +1,186 @@
+import asyncio
+
+import numpy as np
+
+from website import relevance, search, settings
+from website.chain import Chain
+from website.embedding_cache import EmbeddingCache
+from website.models import DynamicBiohack, HitRecord
+from website.relevance import (Decision, DecisionLog, RelevanceModel,
+                               evaluate, fit_decisions)
+
+
+class TopicEmbeddings:
+    """
+    Stands in for text-embedding-3-large: iron texts point one way, the
+    rest the other.
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def embed_query(self, text):
+        return [1.0, 0.0] if "iron" in text else [0.0, 1.0]
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+    async def aembed_documents(self, texts):
+        self.batches.append(texts)
+        return [self.embed_query(text) for text in texts]
+
+
+def make_biohack(topic: str) -> DynamicBiohack:
+    record = HitRecord(
+        permalink=f"/r/{topic}/",
+        action=topic,
+        outcomes="better",
+        health_disorder="x",
+        action_score=3,
+        outcomes_score=2,
+    )
+    return DynamicBiohack(biohack_topic=topic, experiences=[record])
+
+
+def make_decisions(n_questions: int = 40, seed: int = 0) -> list[Decision]:
+    rng = np.random.default_rng(seed)
+    decisions = []
+    for question in range(n_questions):
+        for rank in range(10):
+            cosine = rng.uniform(0, 1)
+            decisions.append(
+                Decision(
+                    time=0.0,
+                    question=f"question {question}",
+                    features=[cosine, cosine / 2, 0.7, 5.0, rank / 9],
+                    relevant=bool(cosine > 0.5),
+                    latency=0.5 + rank / 10,
+                    llm_name="gpt-4o",
+                )
+            )
+    return decisions
+
+
+def test_features_batch_the_missing_topics():
+    embeddings = TopicEmbeddings()
+    cache = EmbeddingCache(embeddings=embeddings, dim=2)
+    biohacks = [make_biohack(t) for t in ["iron bisglycinate", "cold showers"]]
+    features = asyncio.run(relevance.afeatures("iron and pregnancy", biohacks, cache))
+    assert features.shape == (2, len(relevance.feature_names))
+    np.testing.assert_allclose(features[:, 0], [1.0, 0.0])
+    np.testing.assert_allclose(features[:, 1], [0.5, 0.0])
+    np.testing.assert_allclose(features[:, 4], [0.0, 1.0])
+
+    asyncio.run(relevance.afeatures("iron and pregnancy", biohacks, cache))
+    assert embeddings.batches == [["cold showers", "iron bisglycinate"]]
+
+
+def test_fit_separates_logged_decisions():
+    decisions = make_decisions()
+    model = fit_decisions(decisions, low=0.2, high=0.8)
+    probabilities = model.predict(np.array([d.features for d in decisions]))
+    labels = np.array([d.relevant for d in decisions])
+    assert ((probabilities > 0.5) == labels).mean() > 0.95
+    assert model.weights[0] > 0
+
+    reloaded = RelevanceModel.model_validate_json(model.model_dump_json())
+    np.testing.assert_allclose(
+        reloaded.predict(np.array([d.features for d in decisions])), probabilities
+    )
+
+
+def test_replay_saves_calls_and_latency(tmp_path):
+    log = DecisionLog(tmp_path / "decisions.jsonl")
+    log.append(make_decisions())
+    decisions = log.read()
+    assert len(decisions) == 400
+
+    model = fit_decisions(decisions)
+    everything = evaluate(model, decisions, low=0.0, high=1.0, top_k=10)
+    assert everything.llm_calls == everything.decisions == 400
+    assert everything.agreement == 1.0
+
+    tiered = evaluate(model, decisions, low=0.1, high=0.9, top_k=2)
+    assert tiered.questions == 40
+    assert tiered.calls_saved > 0.3
+    assert tiered.agreement > 0.95
+    assert np.mean(tiered.tiered_latencies) < np.mean(tiered.latencies)
+
+
+class FixedModel:
+    """
+    Stands in for a trained `RelevanceModel` with fixed probabilities.
+    """
+
+    low = 0.1
+    high = 0.9
+
+    def __init__(self, probabilities):
+        self.probabilities = np.array(probabilities)
+
+    def predict(self, features):
+        assert len(features) == len(self.probabilities)
+        return self.probabilities
+
+
+def test_enrich_asks_only_the_uncertain_and_top_relevant(tmp_path, monkeypatch):
+    topics = ["iron", "ferritin", "cold showers", "heme iron", "vitamin c", "liver"]
+    biohacks = [make_biohack(topic) for topic in topics]
+    log = DecisionLog(tmp_path / "decisions.jsonl")
+    monkeypatch.setattr(
+        relevance, "relevance_model", FixedModel([0.95, 0.5, 0.05, 0.99, 0.5, 0.92])
+    )
+    monkeypatch.setattr(relevance, "decision_log", log)
+    monkeypatch.setattr(search, "decision_log", log)
+    monkeypatch.setattr(settings, "relevance_top_k", 1)
+    monkeypatch.setattr(
+        search, "embedding_cache", EmbeddingCache(embeddings=TopicEmbeddings(), dim=2)
+    )
+    asked = []
+    answers = {
+        "ferritin": (False, None),
+        "heme iron": (False, None),
+        "vitamin c": (True, "helps absorb iron"),
+    }
+
+    async def iter_predict(cls, *, input_objects, min_results, **kwargs):
+        asked.extend(input.biohack.biohack_topic for input in input_objects)
+        assert min_results == 1  # 3 wanted, 2 kept without asking
+        # completion order is not the search order
+        for index in reversed(range(len(input_objects))):
+            relevant, why_care = answers[input_objects[index].biohack.biohack_topic]
+            yield index, cls.output_schema(relevant=relevant, why_care=why_care)
+
+    monkeypatch.setattr(Chain, "iter_predict", classmethod(iter_predict))
+    stats = search.EnrichStats()
+
+    enriched = asyncio.run(
+        search.enrich_biohacks(
+            biohacks=biohacks,
+            question="iron and pregnancy",
+            batch_size=10,
+            llm_name="gpt-4o",
+            max_tokens=100,
+            max_retries=0,
+            timeout=1,
+            min_results=3,
+            stats=stats,
+        )
+    )
+    assert (stats.asked, stats.answered, stats.complete) == (3, 3, True)
+    # uncertain ferritin and vitamin c, and heme iron the most probable
+    assert asked == ["ferritin", "heme iron", "vitamin c"]
+    # cold showers dropped unasked, heme iron dropped by the LLM, in search order
+    assert [(b.biohack_topic, b.why_care) for b in enriched] == [
+        ("iron", None),
+        ("vitamin c", "helps absorb iron"),
+        ("liver", None),
+    ]
+    decisions = log.read()
+    assert sorted((d.biohack_topic, d.relevant) for d in decisions) == [
+        ("ferritin", False),
+        ("heme iron", False),
+        ("vitamin c", True),
+    ]
+    assert all(d.question == "iron and pregnancy" for d in decisions)
+    assert all(len(d.features) == len(relevance.feature_names) for d in decisions)
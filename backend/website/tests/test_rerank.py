@@ -0,0 +1,68 @@
+import asyncio
+
+import numpy as np
+
+from website import rerank
+from website.models import DynamicBiohack, HitRecord
+from website.rerank import Reranker
+
+
+class WordOverlapModel:
+    """
+    Stands in for the cross-encoder: the score is the number of question
+    words in the text.
+    """
+
+    def __init__(self):
+        self.pairs = []
+
+    def predict(self, pairs, batch_size):
+        self.pairs.extend(pairs)
+        return np.array(
+            [len(set(q.split()) & set(t.lower().split())) for q, t in pairs],
+            dtype=np.float32,
+        )
+
+
+def make_biohack(topic: str) -> DynamicBiohack:
+    record = HitRecord(
+        permalink=f"/r/{topic}/", action=topic, outcomes="better", health_disorder="x"
+    )
+    return DynamicBiohack(biohack_topic=topic, experiences=[record])
+
+
+biohacks = [
+    make_biohack(topic)
+    for topic in ["cold showers", "iron for pregnancy", "iron", "magnesium"]
+]
+
+
+def make_reranker() -> Reranker:
+    reranker = Reranker("test-model", batch_size=2)
+    reranker._model = WordOverlapModel()
+    return reranker
+
+
+def test_top_biohacks_are_the_best_scored_and_scores_are_cached():
+    reranker = make_reranker()
+    top = reranker.top_biohacks("Iron and pregnancy", biohacks, 2)
+    assert [biohack.biohack_topic for biohack in top] == ["iron for pregnancy", "iron"]
+    assert len(reranker._model.pairs) == 4
+    # same question, normalized the same, nothing new to score
+    reranker.top_biohacks("iron and pregnancy?", biohacks, 2)
+    assert len(reranker._model.pairs) == 4
+    assert (reranker.stats.hits, reranker.stats.misses) == (4, 4)
+
+
+def test_rerank_biohacks_keeps_everything_when_off_or_failing(monkeypatch):
+    monkeypatch.setattr(rerank, "reranker", None)
+    assert asyncio.run(rerank.rerank_biohacks("iron", biohacks, 1)) == biohacks
+
+    reranker = Reranker("not-installed")
+    reranker._model = object()  # no predict
+    monkeypatch.setattr(rerank, "reranker", reranker)
+    assert asyncio.run(rerank.rerank_biohacks("iron", biohacks, 1)) == biohacks
+
+    monkeypatch.setattr(rerank, "reranker", make_reranker())
+    top = asyncio.run(rerank.rerank_biohacks("magnesium", biohacks, 1))
+    assert [biohack.biohack_topic for biohack in top] == ["magnesium"]
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from website.router import Router
+
+
+def test_least_outstanding():
+    router = Router(name="gpt-4o-mini", urls=["west", "east"], hedge=False)
+    seen = []
+
+    async def call(url):
+        seen.append(url)
+        await asyncio.sleep(0.01)
+        return url
+
+    async def run():
+        await asyncio.gather(*[router.call(call) for _ in range(10)])
+
+    asyncio.run(run())
+    assert seen.count("west") == seen.count("east") == 5
+
+
+def test_failover_and_circuit_breaker():
+    router = Router(
+        name="gpt-4o-mini", urls=["west", "east"], failure_threshold=2, hedge=False
+    )
+    calls = {"west": 0, "east": 0}
+
+    async def call(url):
+        calls[url] += 1
+        if url == "west":
+            raise asyncio.TimeoutError()
+        return url
+
+    async def run():
+        return [await router.call(call) for _ in range(5)]
+
+    assert asyncio.run(run()) == ["east"] * 5
+    # west got two strikes and then its circuit opened
+    assert calls["west"] == 2
+    assert router.snapshot()["west"]["healthy"] is False
+
+
+def test_half_open_circuit_lets_one_probe_through():
+    router = Router(
+        name="gpt-4o-mini", urls=["west", "east"], failure_threshold=2, hedge=False
+    )
+    west = router.endpoints[0]
+    west.consecutive_failures = 2  # its circuit opened and the cooldown passed
+    seen = []
+
+    async def call(url):
+        seen.append(url)
+        await asyncio.sleep(0.01)
+        return url
+
+    async def run():
+        await asyncio.gather(*[router.call(call) for _ in range(5)])
+        # the probe got through, the circuit is closed again
+        await asyncio.gather(*[router.call(call) for _ in range(4)])
+
+    asyncio.run(run())
+    assert seen[:5].count("west") == 1
+    assert seen[5:].count("west") == 2
+    assert west.consecutive_failures == 0 and not west.probing
+
+
+def test_prompt_errors_dont_fail_over():
+    router = Router(name="gpt-4o-mini", urls=["west", "east"], hedge=False)
+
+    async def call(url):
+        raise ValueError("bad prompt")
+
+    with pytest.raises(ValueError):
+        asyncio.run(router.call(call))
+    assert router.snapshot()["west"]["failures"] == 0
+
+
+def test_hedge_after_p95():
+    router = Router(name="gpt-4o-mini", urls=["west", "east"], min_hedge_delay=0.01)
+    for endpoint in router.endpoints:
+        endpoint.latencies.extend([0.02] * 20)
+    router.endpoints[1].outstanding = 1  # west is picked first
+
+    async def call(url):
+        await asyncio.sleep(5 if url == "west" else 0.01)
+        return url
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        result = await router.call(call)
+        return result, loop.time() - start
+
+    result, elapsed = asyncio.run(run())
+    assert result == "east"
+    assert elapsed < 1
+    assert router.snapshot()["east"]["hedges"] == 1
@@ -0,0 +1,137 @@
+import asyncio
+
+import fakeredis
+
+from website.cache import LocalCache, RedisCache, ResultCache
+from website.models import DynamicBiohackingTaxonomy
+from website.single_flight import SharedSingleFlight, SingleFlight
+
+taxonomy = DynamicBiohackingTaxonomy(
+    biohack_types=[], count_experiences=3, count_reddits=2, count_studies=1
+)
+
+
+def test_single_flight_coalesces():
+    calls = 0
+
+    async def run_search_and_enrich():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return taxonomy
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(
+            *[flight.do("taxonomyiron", run_search_and_enrich) for _ in range(20)]
+        )
+        assert all(result is taxonomy for result in results)
+        assert flight.stats.leaders == 1
+        assert flight.stats.followers == 19
+        assert len(flight) == 0
+
+    asyncio.run(run())
+    assert calls == 1
+
+
+def test_shared_single_flight_across_workers():
+    calls = 0
+
+    async def run_search_and_enrich():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.1)
+        return taxonomy
+
+    def make_worker(server):
+        client = fakeredis.FakeAsyncRedis(server=server)
+        cache = ResultCache(
+            local=LocalCache(max_entries=10, ttl=60),
+            shared=RedisCache(client=client, ttl=60, max_value_bytes=100_000),
+        )
+        return SharedSingleFlight(cache=cache, lock_ttl=5, poll_interval=0.01)
+
+    async def run():
+        server = fakeredis.FakeServer()
+        workers = [make_worker(server) for _ in range(3)]
+        results = await asyncio.gather(
+            *[
+                worker.do("taxonomyiron", run_search_and_enrich)
+                for worker in workers
+                for _ in range(5)
+            ]
+        )
+        assert all(result == taxonomy for result in results)
+        assert sum(worker.stats.shared_followers for worker in workers) == 2
+
+    asyncio.run(run())
+    assert calls == 1
+
+
+class RacyCache:
+    """
+    Another worker leads `taxonomyiron`. Its lock frees after our
+    `unlock_after`-th cache call and its handoff lands after the
+    `handoff_after`-th one.
+    """
+
+    def __init__(self, *, unlock_after: int, handoff_after: int):
+        self.unlock_after = unlock_after
+        self.handoff_after = handoff_after
+        self.calls = 0
+        self.values = {}
+        self.owner = "leader"
+
+    def called(self) -> None:
+        self.calls += 1
+        if self.calls == self.unlock_after:
+            self.owner = None
+        if self.calls == self.handoff_after:
+            self.values["flight:taxonomyiron"] = taxonomy
+
+    async def acquire_lock(self, key, ttl):
+        acquired = self.owner is None
+        if acquired:
+            self.owner = "follower"
+        self.called()
+        return self.owner if acquired else None
+
+    async def release_lock(self, key, token):
+        if self.owner == token:
+            self.owner = None
+
+    async def is_locked(self, key):
+        locked = self.owner is not None
+        self.called()
+        return locked
+
+    async def get(self, key):
+        value = self.values.get(key)
+        self.called()
+        return value
+
+    async def set(self, key, value, ttl=None):
+        self.values[key] = value
+
+
+def test_shared_follower_rereads_the_handoff_after_the_lock_frees():
+    calls = 0
+
+    async def run_search_and_enrich():
+        nonlocal calls
+        calls += 1
+        return taxonomy
+
+    # calls: 1 acquire_lock, 2 get, 3 is_locked, 4 get, 5 acquire_lock, 6 get
+    for cache in [
+        # handed off and released between our read and `is_locked`
+        RacyCache(unlock_after=2, handoff_after=2),
+        # released, then handed off between our last read and `acquire_lock`
+        RacyCache(unlock_after=2, handoff_after=4),
+    ]:
+        flight = SharedSingleFlight(cache=cache, lock_ttl=5, poll_interval=0.001)
+        result = asyncio.run(flight.do("taxonomyiron", run_search_and_enrich))
+        assert result is taxonomy
+        assert flight.stats.shared_followers == 1
+        assert cache.owner is None
+    assert calls == 0
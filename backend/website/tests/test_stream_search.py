@@ -0,0 +1,164 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from website import main
+from website.cache import LocalCache, ResultCache
+from website.models import BiohackTypeGroup, DynamicBiohack, HitRecord
+from website.single_flight import SharedSingleFlight, StreamFlight
+
+
+def make_group(biohack_type: str, topics: list[str]) -> BiohackTypeGroup:
+    biohacks = [
+        DynamicBiohack(
+            biohack_topic=topic,
+            why_care=f"{topic} matters",
+            experiences=[
+                HitRecord(
+                    permalink=f"/r/sleep/{topic}/",
+                    action=topic,
+                    outcomes="better",
+                    health_disorder="insomnia",
+                    biohack_type=biohack_type,
+                    source_type="reddit",
+                )
+            ],
+        )
+        for topic in topics
+    ]
+    return BiohackTypeGroup(biohack_type=biohack_type, biohacks=biohacks)
+
+
+class FakePipeline:
+    """
+    Stands in for the search + enrichment and o3 summary streams, each item
+    after `delay` seconds.
+    """
+
+    def __init__(self, delay: float = 0.0, complete: bool = True):
+        self.delay = delay
+        self.complete = complete
+        self.searches = 0
+        self.summaries = 0
+
+    async def stream_search_and_enrich(self, *, stats, **kwargs):
+        self.searches += 1
+        # one biohack call missed the deadline unless complete
+        stats.asked += 3
+        stats.answered += 3 if self.complete else 2
+        for group in [
+            make_group("supplements", ["magnesium", "glycine"]),
+            make_group("diet", ["tart cherry"]),
+        ]:
+            await asyncio.sleep(self.delay)
+            yield group
+
+    async def stream_ai_summary(self, *, taxonomy, question):
+        self.summaries += 1
+        for section in ["curious", "balance", "skeptical"]:
+            await asyncio.sleep(self.delay)
+            yield section, [f"{section} about {question}"]
+
+
+def fake_app(monkeypatch, pipeline: FakePipeline) -> None:
+    cache = ResultCache(local=LocalCache(max_entries=10, ttl=60))
+    search_flight = SharedSingleFlight(cache=cache)
+    monkeypatch.setattr(main, "cache", cache)
+    monkeypatch.setattr(main, "precomputed", None)
+    monkeypatch.setattr(main, "search_flight", search_flight)
+    monkeypatch.setattr(main, "search_stream_flight", StreamFlight(search_flight))
+    monkeypatch.setattr(
+        main, "summary_stream_flight", StreamFlight(SharedSingleFlight(cache=cache))
+    )
+    monkeypatch.setattr(
+        main, "stream_search_and_enrich", pipeline.stream_search_and_enrich
+    )
+    monkeypatch.setattr(main, "stream_ai_summary", pipeline.stream_ai_summary)
+
+
+def events(body: str) -> list[str]:
+    return [
+        line.removeprefix("event: ")
+        for line in body.split("\n")
+        if line.startswith("event: ")
+    ]
+
+
+expected = [
+    "biohack_type",
+    "biohack_type",
+    "counts",
+    "summary_section",
+    "summary_section",
+    "summary_section",
+    "done",
+]
+
+
+def test_stream_search_replays_from_the_cache(monkeypatch):
+    pipeline = FakePipeline()
+    fake_app(monkeypatch, pipeline)
+    client = TestClient(main.app)
+
+    first = client.get("/stream_search", params={"question": "sleep?"})
+    assert first.headers["content-type"].startswith("text/event-stream")
+    assert events(first.text) == expected
+    assert "magnesium" in first.text and "curious about sleep" in first.text
+
+    second = client.get("/stream_search", params={"question": "Sleep"})
+    assert events(second.text) == expected
+    assert (pipeline.searches, pipeline.summaries) == (1, 1)
+    summary_only = client.get(
+        "/stream_search", params={"question": "sleep", "summary_only": True}
+    )
+    assert events(summary_only.text) == expected[2:]
+
+
+def test_summary_only_skips_the_biohack_types_after_the_cache_expires(monkeypatch):
+    pipeline = FakePipeline()
+    fake_app(monkeypatch, pipeline)
+    client = TestClient(main.app)
+    # the page rendered the taxonomy, which expired before the stream started
+    response = client.get(
+        "/stream_search", params={"question": "sleep", "summary_only": True}
+    )
+    assert events(response.text) == expected[2:]
+    assert (pipeline.searches, pipeline.summaries) == (1, 1)
+
+
+def test_partial_search_is_not_cached(monkeypatch):
+    pipeline = FakePipeline(complete=False)
+    fake_app(monkeypatch, pipeline)
+    client = TestClient(main.app)
+    for _ in range(2):
+        response = client.get("/stream_search", params={"question": "sleep"})
+        assert events(response.text) == expected
+    # the cut-off taxonomy is shown, and the next visitor searches again
+    assert (pipeline.searches, pipeline.summaries) == (2, 2)
+
+
+def test_concurrent_streams_share_one_producer(monkeypatch):
+    pipeline = FakePipeline(delay=0.02)
+    fake_app(monkeypatch, pipeline)
+
+    async def stream(delay: float) -> str:
+        await asyncio.sleep(delay)
+        return "".join(
+            [
+                event
+                async for event in main.stream_search_events(
+                    question="sleep", summary_only=False
+                )
+            ]
+        )
+
+    async def run() -> list[str]:
+        # the late ones join mid-stream and get the earlier items replayed
+        streams = asyncio.gather(*[stream(0.005 * i) for i in range(5)])
+        return await asyncio.wait_for(streams, timeout=5)
+
+    bodies = asyncio.run(run())
+    assert all(events(body) == expected for body in bodies)
+    assert len(set(bodies)) == 1
+    assert (pipeline.searches, pipeline.summaries) == (1, 1)
+    assert main.search_stream_flight.stats.stream_followers == 4